@@ -0,0 +1,68 @@
+"""Maps the ASNs ("AS1234") to dense integer IDs, so that sets of ASNs can be
+kept as bitsets (integers with the bit of the ID of every member set) and be
+combined with integer operations instead of hashing the ASN strings again and
+again.
+"""
+import binascii
+
+
+class ASRegistry(object):
+    """The ASNs seen by a process, numbered in the order they were first
+    seen. The IDs are only meaningful within the process.
+    """
+
+    def __init__(self):
+        self._ids = dict()
+        self._ASNs = []
+
+    def __len__(self):
+        return len(self._ASNs)
+
+    def id_of(self, asn):
+        """Returns the ID of the ASN, giving it the next free one if it is
+        seen for the first time.
+        """
+        ID = self._ids.get(asn)
+        if ID is None:
+            ID = self._ids[asn] = len(self._ASNs)
+            self._ASNs.append(asn)
+        return ID
+
+    def ASN_of(self, ID):
+        return self._ASNs[ID]
+
+    def bitset(self, ASNs):
+        """Returns the bitset of the given ASNs."""
+        id_of = self.id_of
+        IDs = [id_of(asn) for asn in ASNs]
+        if not IDs:
+            return 0
+        # Setting the bits one by one on an integer would copy it every time.
+        data = bytearray(max(IDs) // 8 + 1)
+        for ID in IDs:
+            data[ID >> 3] |= 1 << (ID & 7)
+        data.reverse()
+        return int(binascii.hexlify(data), 16)
+
+    def ASNs(self, bits):
+        """Yields the ASNs of a bitset, in the order of their IDs."""
+        if not bits:
+            return
+        digits = '{:x}'.format(bits)
+        data = bytearray(binascii.unhexlify('0' * (len(digits) % 2) + digits))
+        data.reverse()
+        for index, byte in enumerate(data):
+            while byte:
+                lowest = byte & -byte
+                yield self._ASNs[8 * index + lowest.bit_length() - 1]
+                byte ^= lowest
+
+
+def count(bits):
+    """Returns the number of ASNs in a bitset."""
+    return bin(bits).count('1')
+
+
+# The registry of the process. The bitsets are only exchanged within a
+# process, the resolver processes send the ASNs themselves.
+registry = ASRegistry()
@@ -0,0 +1,67 @@
+import gevent
+from gevent.lock import BoundedSemaphore
+import requests.adapters
+
+import communicator
+
+
+class AsyncCommunicator(object):
+    """Cooperative (gevent based) front-end of a communicator.
+
+    The get_* methods return immediately with a greenlet that runs the
+    request; call .get() on it (or gevent.joinall() on several of them) to
+    collect the reply. No more than `concurrency` requests are in flight at
+    any time and all of them share the same keep-alive connection pool.
+
+    NOTE: The caller is responsible for applying the gevent monkey patching
+    before any request is made, otherwise the requests block the event loop.
+    """
+    DEFAULT_CONCURRENCY = 200
+
+    def __init__(self, comm_factory=communicator.Communicator,
+                 concurrency=DEFAULT_CONCURRENCY):
+        self.comm = comm_factory()
+        self.concurrency = concurrency
+        self.in_flight = BoundedSemaphore(concurrency)
+
+        # Let the HTTP connection pool grow up to the concurrency limit so
+        # that connections are reused instead of being discarded. The
+        # communicator may be the persistent one of a ResolverPool process,
+        # so the pool is only replaced when it has to grow, keeping the
+        # kept-alive connections of the previous tasks.
+        session = getattr(self.comm, 'session', None)
+        if session is not None and getattr(session, 'async_pool_maxsize', 0) < concurrency:
+            adapter = requests.adapters.HTTPAdapter(pool_connections=1,
+                                                    pool_maxsize=concurrency)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            session.async_pool_maxsize = concurrency
+
+    @property
+    def reply_format(self):
+        return self.comm.reply_format
+
+    def _limited(self, function, *args, **kwargs):
+        with self.in_flight:
+            return function(*args, **kwargs)
+
+    def close(self):
+        self.comm.close()
+
+    def get_policy_by_autnum(self, autnum):
+        return gevent.spawn(self._limited, self.comm.get_policy_by_autnum,
+                            autnum)
+
+    def get_filter_set(self, value):
+        """Makes requests for as-set, route-set."""
+        return gevent.spawn(self._limited, self.comm.get_filter_set, value)
+
+    def get_routes_by_autnum(self, autnum, ipv6_enabled=False):
+        """Requests all the route[6] objects for a given AS number."""
+        return gevent.spawn(self._limited, self.comm.get_routes_by_autnum,
+                            autnum, ipv6_enabled=ipv6_enabled)
+
+    def get_parsed(self, kind, name):
+        """Looks up and parses an object (see communicator.get_parsed)."""
+        return gevent.spawn(self._limited, communicator.get_parsed,
+                            self.comm, kind, name)
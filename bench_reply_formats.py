@@ -0,0 +1,63 @@
+"""Compares the XML and the JSON reply formats of the RIPE search service on
+the same objects: bytes transferred and time spent parsing the replies.
+
+Usage: python bench_reply_formats.py [-n REPEAT] OBJECT [OBJECT ...]
+
+Every OBJECT is either an AS number (its origin routes are requested), an
+AS-SET or an RS-SET. The replies are requested directly (bypassing the cache)
+once per format and then parsed REPEAT times.
+"""
+import argparse
+import timeit
+
+import communicator
+import parsers
+import rpsl
+
+
+def fetch(comm, obj):
+    """Returns the (uncached) reply for the object and its parser."""
+    parse = parsers.REPLY_PARSERS[comm.reply_format]
+    if rpsl.is_ASN(obj):
+        url = comm._search_URL_builder(obj, 'origin', ['route', 'route6'],
+                                       comm.flags)
+        parser = parse.AS_routes
+    elif rpsl.is_AS_set(obj):
+        url = comm._search_URL_builder(obj, None, (), comm.flags)
+        parser = parse.AS_set_members
+    else:
+        url = comm._search_URL_builder(obj, None, (), comm.flags)
+        parser = parse.RS_members
+    content, _ = comm._send_DB_request(url)
+    return content, parser
+
+
+def main():
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument('OBJECT', nargs='+')
+    arg_parser.add_argument('-n', '--repeat', type=int, default=20)
+    args = arg_parser.parse_args()
+
+    totals = dict()
+    print "{:<24} {:>6} {:>12} {:>14}".format("object", "format", "bytes",
+                                               "parse (ms)")
+    for obj in args.OBJECT:
+        for reply_format in ('xml', 'json'):
+            comm = communicator.Communicator(reply_format=reply_format)
+            content, parser = fetch(comm, obj)
+            comm.close()
+            parse_time = min(timeit.repeat(lambda: parser(content),
+                                           number=1, repeat=args.repeat))
+            size, elapsed = totals.get(reply_format, (0, 0.0))
+            totals[reply_format] = (size + len(content), elapsed + parse_time)
+            print "{:<24} {:>6} {:>12} {:>14.3f}".format(
+                obj, reply_format, len(content), parse_time * 1000)
+
+    for reply_format in ('xml', 'json'):
+        size, elapsed = totals[reply_format]
+        print "{:<24} {:>6} {:>12} {:>14.3f}".format(
+            "TOTAL", reply_format, size, elapsed * 1000)
+
+
+if __name__ == "__main__":
+    main()
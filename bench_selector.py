@@ -0,0 +1,149 @@
+"""Benchmarks libParser.selector end to end against mock_ripe_server.py
+replaying a fixture archive, so that the results do not depend on the live
+RIPE DB.
+
+Usage: python bench_selector.py [-n REPEAT] [-c CONCURRENCY] [--rate RATE]
+                                [--latency MS] [--error-403 P] [--error-500 P]
+                                [--reset P] [--bandwidth BYTES]
+                                [--codec CODEC] [--cache-backend BACKEND]
+                                [--warm [--reparse]] FIXTURES OBJECT
+
+Record the fixtures first with: python libParser.py --record FIXTURES OBJECT
+
+By default every run starts with an empty cache, so all the replies are
+downloaded from the mock server. With --warm the cache is filled once and the
+timed runs are served from it; --reparse drops the parsed objects before
+every warm run, so that the cached replies are decoded and parsed again. The
+disk footprint of the cache is reported as well.
+"""
+import argparse
+import functools
+import multiprocessing as mp
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+
+import communicator
+import counters
+import fixtures
+import libParser
+import mock_ripe_server
+import ratelimit
+import rest_cache
+
+
+def serve(fixtures_folder, port, options):
+    server = mock_ripe_server.ReplayServer(
+        ('127.0.0.1', port), fixtures.FixtureArchive(fixtures_folder),
+        options)
+    server.serve_forever()
+
+
+def run_once(obj, comm_factory, concurrency, cache_folder):
+    """Runs the selector and returns the elapsed time."""
+    communicator.Communicator.CACHING_ROOT_FOLDER = cache_folder
+    rest_cache.SingletonRestCache._instances.clear()
+    counters.reset()
+    start = time.time()
+    result = libParser.selector(obj, False, False, output_type='screen',
+                                comm_factory=comm_factory,
+                                concurrency=concurrency)
+    elapsed = time.time() - start
+    if not result:
+        raise RuntimeError("The selector failed, check the fixtures.")
+    return elapsed
+
+
+def footprint(folder):
+    """Returns the bytes used by the files in the folder."""
+    size = 0
+    for root, _, files in os.walk(folder):
+        for name in files:
+            size += os.path.getsize(os.path.join(root, name))
+    return size
+
+
+def drop_parsed(folder):
+    """Removes the parsed objects (see RestCache.update_parsed) from a cache
+    folder of either backend.
+    """
+    prefix = rest_cache.RestCache.PARSED_PREFIX
+    db_path = os.path.join(folder, rest_cache.SQLiteCacheBackend.DB_FILENAME)
+    if os.path.exists(db_path):
+        conn = sqlite3.connect(db_path)
+        conn.execute("DELETE FROM entries WHERE type LIKE ?", (prefix + '%',))
+        conn.commit()
+        conn.close()
+    for root, _, files in os.walk(folder):
+        for name in files:
+            if name.startswith(prefix):
+                os.remove(os.path.join(root, name))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('FIXTURES')
+    parser.add_argument('OBJECT')
+    parser.add_argument('-n', '--repeat', type=int, default=3)
+    parser.add_argument('-c', '--concurrency', type=int)
+    parser.add_argument('-p', '--port', type=int, default=8043)
+    parser.add_argument('--rate', type=float, default=ratelimit.TokenBucket.MAX_RATE,
+                        help="Initial rate (requests/s) of the shared token bucket.")
+    parser.add_argument('--latency', type=float, default=0,
+                        help="Delay in milliseconds before every reply.")
+    parser.add_argument('--error-403', type=float, default=0)
+    parser.add_argument('--error-500', type=float, default=0)
+    parser.add_argument('--reset', type=float, default=0)
+    parser.add_argument('--bandwidth', type=int)
+    parser.add_argument('--codec', choices=sorted(rest_cache.RestCache.CODECS),
+                        default=rest_cache.RestCache.DEFAULT_CODEC)
+    parser.add_argument('--cache-backend', choices=sorted(rest_cache.RestCache.BACKENDS),
+                        default=rest_cache.RestCache.DEFAULT_BACKEND)
+    parser.add_argument('--warm', action="store_true",
+                        help="Time runs on a cache filled by a first run.")
+    parser.add_argument('--reparse', action="store_true",
+                        help="Drop the parsed objects before every warm run.")
+    args = parser.parse_args()
+
+    options = mock_ripe_server.ReplayOptions(args.latency / 1000.0,
+                                             args.error_403, args.error_500,
+                                             args.reset, args.bandwidth)
+    server = mp.Process(target=serve, args=(args.FIXTURES, args.port, options))
+    server.daemon = True
+    server.start()
+    time.sleep(0.5)
+
+    # The token bucket lives in shared memory; replace it before the
+    # resolvers fork so that all of them use the new one.
+    communicator.Communicator.rate_limiter = ratelimit.TokenBucket(rate=args.rate)
+    comm_factory = functools.partial(communicator.Communicator,
+                                     db_url='http://127.0.0.1:{}'.format(args.port),
+                                     cache_backend=args.cache_backend,
+                                     cache_codec=args.codec)
+    timings = []
+    cache_folder = tempfile.mkdtemp() + '/'
+    try:
+        if args.warm:
+            run_once(args.OBJECT, comm_factory, args.concurrency, cache_folder)
+        for _ in xrange(args.repeat):
+            if not args.warm:
+                shutil.rmtree(cache_folder)
+                os.mkdir(cache_folder)
+            elif args.reparse:
+                drop_parsed(cache_folder)
+            timings.append(run_once(args.OBJECT, comm_factory,
+                                    args.concurrency, cache_folder))
+        size = footprint(cache_folder)
+    finally:
+        server.terminate()
+        shutil.rmtree(cache_folder, ignore_errors=True)
+
+    print "runs: {}  best: {:.3f}s  mean: {:.3f}s  cache: {} bytes ({})".format(
+        len(timings), min(timings), sum(timings) / len(timings), size, args.codec)
+    print counters.cache_report()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,68 @@
 import logging
+from Queue import Queue
+import threading
+import time
 
 import requests
 
+import counters
 import errors
+import fixtures
+import parsers
+import ratelimit
 import rest_cache
 
 
+class _Flight(object):
+    """A request on the wire that other threads can wait for."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.reply = None
+        self.error = None
+
+
+def _get_validators(response):
+    """Returns the validators (ETag/Last-Modified) of an HTTP response."""
+    validators = dict()
+    for header in ('etag', 'last-modified'):
+        value = response.headers.get(header)
+        if value:
+            validators[header] = value
+    return validators
+
+
+def _request(comm, kind, name):
+    if kind == 'AS_routes':
+        return comm.get_routes_by_autnum(name, ipv6_enabled=True)
+    return comm.get_filter_set(name)
+
+
+def get_parsed(comm, kind, name):
+    """Looks up an object through the communicator and returns its parsed
+    reply, or None if it was not found.
+
+    Parameters
+    ----------
+    comm : object
+        The communicator. It is asked first for its own (cached) parsed
+        reply, if it has a get_parsed() method.
+    kind : str
+        The lookup: 'AS_routes' (the routes of an AS number),
+        'AS_set_members' or 'RS_members', after the fields of
+        parsers.ReplyParsers.
+    name : str
+        The AS number, AS set or RS.
+    """
+    own = getattr(comm, 'get_parsed', None)
+    if own is not None:
+        return own(kind, name)
+    reply = _request(comm, kind, name)
+    if reply is None:
+        return None
+    return getattr(parsers.REPLY_PARSERS[comm.reply_format], kind)(reply)
+
+
 class Communicator():
     ripe_db_url = "http://rest.db.ripe.net"
     default_db_source = "ripe"
@@ -18,9 +75,31 @@ class Communicator():
 
     CACHING_ROOT_FOLDER = "~/.libParser/cache/"
     EXPIRE_TIMEOUT_AFTER = 86400
+    # How long an object that was not found (404) is not asked for again.
+    NEGATIVE_EXPIRE_AFTER = 4 * 3600
+    # How many expired replies are refreshed at once in the background, as
+    # many as the threads of a resolver process (see stale_while_revalidate).
+    REFRESH_THREADS = 10
+
+    # Status codes that signal an overloaded (or rate limiting) server. The
+    # request is retried with backoff and the shared rate is decreased.
+    TRANSIENT_STATUS_CODES = (403, 500, 502, 503, 504)
+    MAX_BACKOFF_RETRIES = 4
+
+    # Shared by all the communicators of the process and of the resolver
+    # processes that are forked from it.
+    rate_limiter = ratelimit.TokenBucket()
+
+    # Media types of the supported reply formats of the search service.
+    REPLY_FORMATS = {'xml': 'application/xml', 'json': 'application/json'}
 
     def __init__(self, db_url=ripe_db_url, source=default_db_source,
-                 alternatives=alternative_db_sources):
+                 alternatives=alternative_db_sources, reply_format='xml',
+                 record_to=None, cache_backend=rest_cache.RestCache.DEFAULT_BACKEND,
+                 memory_cache_bytes=rest_cache.RestCache.DEFAULT_MEMORY_BYTES,
+                 cache_codec=rest_cache.RestCache.DEFAULT_CODEC, expire_after=None,
+                 stale_while_revalidate=False, cache_max_bytes=None,
+                 refresh_on_close=True):
         def _get_alternatives(alternatives):
             s = []
             for i in alternatives:
@@ -31,10 +110,31 @@ class Communicator():
         self.source = source
         self.other_sources = _get_alternatives(alternatives)
         self.session = requests.Session()
-        self.session.headers = {'Accept': 'application/xml'}
+        # The format of the set and route replies. Policies are always
+        # requested in XML since that is what the PolicyParser reads.
+        self.reply_format = reply_format
+        self.session.headers = {'Accept': self.REPLY_FORMATS[reply_format]}
         self.flags = set()
         self.flags.add('no-referenced')
-        self.cache = rest_cache.RestCache(self.EXPIRE_TIMEOUT_AFTER, self.CACHING_ROOT_FOLDER)
+        # expire_after overrides the EXPIRE_TIMEOUT_AFTER of the replies per
+        # keyword, e.g. {'route': 3600}. The cache is unbounded unless
+        # cache_max_bytes is given.
+        self.cache = rest_cache.RestCache(self.EXPIRE_TIMEOUT_AFTER, self.CACHING_ROOT_FOLDER,
+                                          cache_backend, memory_cache_bytes, cache_codec,
+                                          self.NEGATIVE_EXPIRE_AFTER, expire_after,
+                                          stale_while_revalidate, cache_max_bytes)
+
+        # In stale-while-revalidate mode an expired reply is served at once
+        # and refreshed by background threads for the next lookups (and
+        # runs). The refreshes are queued as (url, keyword). Unless
+        # refresh_on_close is set, close() leaves the pending ones: their
+        # replies stay expired in the cache and are refreshed by a later run.
+        self.stale_while_revalidate = stale_while_revalidate
+        self.refresh_on_close = refresh_on_close
+        self._refresh_q = Queue()
+        self._refreshing = set()
+        self._refreshing_lock = threading.Lock()
+        self._refreshers = []
 
         # (TCP keep-alive) Used when we have a not-yet-known closed session.
         # The server closes the connection, but we already have a request in
@@ -42,80 +142,298 @@ class Communicator():
         # retrying we eventually open another connection.
         self.max_retries = 3
 
+        # The requests currently on the wire, used for coalescing identical
+        # requests of concurrent threads. Table scheme: {url: _Flight}
+        self._in_flight = dict()
+        self._in_flight_lock = threading.Lock()
+
+        # When a folder is given every reply (fetched or cached) is recorded
+        # in a fixture archive that mock_ripe_server.py can replay.
+        self.recorder = None
+        if record_to is not None:
+            self.recorder = fixtures.FixtureArchive(record_to)
+
+    def close(self):
+        """Waits for the pending background refreshes, if refresh_on_close
+        is set, and closes the session.
+        """
+        if self.refresh_on_close:
+            self.wait_for_refreshes()
+        self.session.close()
+
+    def wait_for_refreshes(self):
+        """Waits for the pending background refreshes (see
+        stale_while_revalidate).
+        """
+        if self._refreshers:
+            self._refresh_q.join()
+
     def get_policy_by_autnum(self, autnum):
         db_reply = None
-        url = self._search_URL_builder(autnum, None, (), self.flags)
-        _cached_reply = self.cache.get_or(url, self.policy_keyword)
+        url = self._search_URL_builder(autnum, None, (), self.flags, 'xml')
+        _cached_reply = self._get_cached(url, self.policy_keyword)
         if _cached_reply != "":
             db_reply = _cached_reply
+            counters.increment('cache_hits')
             logging.debug('Policy for {} found in cache'.format(autnum))
         else:
+            counters.increment('cache_misses')
             try:
-                db_reply = self._send_DB_request(url)
+                db_reply = self._coalesced_request(url, self.policy_keyword)
                 logging.debug("Policy received for {}".format(autnum))
-                self.cache.update(url, db_reply, self.policy_keyword)
             except errors.RIPEDBError:
                 logging.error("Failed to receive policy for "
                               "{} due to RIPE DB error.".format(autnum))
             except errors.SendRequestError as e:
                 logging.error('Get policy failed. {}'.format(e))
 
+        self._record(url, db_reply)
         return db_reply
 
     def get_filter_set(self, value):
         """Makes requests for as-set, route-set."""
         db_reply = None
         url = self._search_URL_builder(value, None, (), self.flags)
-        _cached_reply = self.cache.get_or(url, self.filterset_keyword)
+        _cached_reply = self._get_cached(url, self.filterset_keyword)
         if _cached_reply != "":
             db_reply = _cached_reply
+            counters.increment('cache_hits')
             logging.debug('Filter set {} found in cache'.format(value))
         else:
+            counters.increment('cache_misses')
             try:
-                db_reply = self._send_DB_request(url)
-                self.cache.update(url, db_reply, self.filterset_keyword)
+                db_reply = self._coalesced_request(url, self.filterset_keyword)
+            except errors.TransientDBError:
+                logging.warning('Get Filter throttled for {}.'.format(value))
+                raise
             except errors.RIPEDBError:
                 logging.error('Get Filter failed for '
                               '{} due to RIPE DB error.'.format(value))
             except errors.SendRequestError as e:
                 logging.error('Get all routes failed for {}. {}'.format(value, e))
 
+        self._record(url, db_reply)
         return db_reply
 
     def get_routes_by_autnum(self, autnum, ipv6_enabled=False):
         """Requests all the route[6] objects for a given AS number."""
         db_reply = None
-        type_filter = ['route']
-        if ipv6_enabled:
-            type_filter.append('route6')
-
-        url = self._search_URL_builder(autnum, 'origin', type_filter, self.flags)
+        url = self._routes_URL(autnum, ipv6_enabled)
 
-        _cached_reply = self.cache.get_or(url, self.route_keyword)
+        _cached_reply = self._get_cached(url, self.route_keyword)
         if _cached_reply != "":
             db_reply = _cached_reply
+            counters.increment('cache_hits')
             logging.debug('Routes originated by {} found in cache'.format(autnum))
         else:
+            counters.increment('cache_misses')
             try:
-                db_reply = self._send_DB_request(url)
-                self.cache.update(url, db_reply, self.route_keyword)
+                db_reply = self._coalesced_request(url, self.route_keyword)
+            except errors.TransientDBError:
+                logging.warning('Get all routes throttled for {}.'.format(autnum))
+                raise
             except errors.RIPEDBError:
                 logging.error('Get all routes failed for '
                               '{} due to RIPE DB error'.format(autnum))
             except errors.SendRequestError as e:
                 logging.error('Get all routes failed for {}. {}'.format(autnum, e))
 
+        self._record(url, db_reply)
         return db_reply
 
+    def _get_cached(self, url, keyword):
+        """Returns the cached reply for the URL or "". In stale-while-revalidate
+        mode an expired reply is returned as well and a background refresh
+        of it is scheduled.
+        """
+        reply = self.cache.get_or(url, keyword)
+        if reply != "" or not self.stale_while_revalidate:
+            return reply
+        stale = self.cache.get_expired(url, keyword)
+        if not stale:
+            return ""
+        counters.increment('stale_hits')
+        logging.debug('Serving expired reply for {} while refreshing it'.format(url))
+        self._schedule_refresh(url, keyword)
+        return stale
+
+    def _schedule_refresh(self, url, keyword):
+        with self._refreshing_lock:
+            if url in self._refreshing:
+                return
+            self._refreshing.add(url)
+            # One more thread while the pending refreshes outnumber them.
+            if len(self._refreshers) < min(self.REFRESH_THREADS, len(self._refreshing)):
+                refresher = threading.Thread(
+                    target=self._background_refresh,
+                    name='refresher-{}'.format(len(self._refreshers)))
+                refresher.daemon = True
+                refresher.start()
+                self._refreshers.append(refresher)
+        self._refresh_q.put((url, keyword))
+
+    def _background_refresh(self):
+        """Refreshes the queued expired replies, one at a time per thread."""
+        while True:
+            url, keyword = self._refresh_q.get()
+            try:
+                self._coalesced_request(url, keyword)
+            except errors.NotFoundError:
+                logging.debug('Expired reply for {} is no longer found'.format(url))
+            except Exception as e:
+                logging.warning('Background refresh of {} failed. {}'.format(url, e))
+            finally:
+                with self._refreshing_lock:
+                    self._refreshing.discard(url)
+                self._refresh_q.task_done()
+
+    def _coalesced_request(self, url, keyword):
+        """Sends the request for the given URL and caches the reply, making
+        sure that only one request per URL is on the wire.
+
+        Threads asking for a URL that is already being requested wait for
+        that request and share its reply (or its error). Across processes the
+        per-URL lock of the cache serialises the fetches, so a process that
+        waited for the lock finds the reply in the cache instead of sending
+        the request again.
+
+        URLs that were recently not found (404) are not requested again until
+        the negative cache entry expires; NotFoundError is raised instead.
+        """
+        if self.cache.is_negative(url, keyword):
+            counters.increment('negative_hits')
+            raise errors.NotFoundError("RIPE-API_ERROR_404 (cached)")
+
+        with self._in_flight_lock:
+            flight = self._in_flight.get(url)
+            is_leader = flight is None
+            if is_leader:
+                flight = _Flight()
+                self._in_flight[url] = flight
+
+        if not is_leader:
+            logging.debug('Waiting for in-flight request {}'.format(url))
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.reply
+
+        try:
+            with self.cache.key_lock(url, keyword):
+                reply = self.cache.get_or(url, keyword)
+                if reply == "" and self.cache.is_negative(url, keyword):
+                    counters.increment('negative_hits')
+                    raise errors.NotFoundError("RIPE-API_ERROR_404 (cached)")
+                elif reply == "":
+                    try:
+                        reply = self._refresh(url, keyword)
+                    except errors.NotFoundError:
+                        counters.increment('not_found')
+                        self.cache.update_negative(url, keyword)
+                        raise
+                else:
+                    logging.debug('Reply for {} was fetched by another '
+                                  'process'.format(url))
+            flight.reply = reply
+            return reply
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._in_flight_lock:
+                del self._in_flight[url]
+            flight.done.set()
+
+    def _routes_URL(self, autnum, ipv6_enabled):
+        type_filter = ['route']
+        if ipv6_enabled:
+            type_filter.append('route6')
+        return self._search_URL_builder(autnum, 'origin', type_filter, self.flags)
+
+    def get_parsed(self, kind, name):
+        """Returns the parsed reply of a lookup (see the module's get_parsed()). The parsed
+        result is cached next to the reply, so a warm run skips the parsing
+        as long as the reply stays fresh.
+        """
+        if kind == 'AS_routes':
+            url = self._routes_URL(name, True)
+            keyword = self.route_keyword
+        else:
+            url = self._search_URL_builder(name, None, (), self.flags)
+            keyword = self.filterset_keyword
+
+        parse = getattr(parsers.REPLY_PARSERS[self.reply_format], kind)
+        parsed = None
+        # When recording, every reply has to go through _record().
+        if self.recorder is None:
+            parsed = self.cache.get_parsed(url, keyword, kind)
+            if parsed is not None:
+                counters.increment('parsed_hits')
+                return parsed
+
+            # A cached reply is decoded straight into the parser.
+            stream = self.cache.get_stream(url, keyword)
+            if stream is not None:
+                counters.increment('cache_hits')
+                try:
+                    parsed = parse(stream)
+                except Exception as e:
+                    logging.warning('Failed to parse the cached reply for {}. {}'.format(name, e))
+                finally:
+                    stream.close()
+
+        if parsed is None:
+            reply = _request(self, kind, name)
+            if reply is None:
+                return None
+            # A reply that was not modified is still parsed in the cache.
+            if self.recorder is None:
+                parsed = self.cache.get_parsed(url, keyword, kind)
+                if parsed is not None:
+                    counters.increment('parsed_hits')
+                    return parsed
+            parsed = parse(reply)
+        self.cache.update_parsed(url, keyword, kind, parsed)
+        return parsed
+
+    def _record(self, url, reply):
+        """Records the reply in the fixture archive, if recording."""
+        if self.recorder is not None and reply is not None:
+            self.recorder.record(url[len(self.db_url):], 200, reply)
+
+    def _refresh(self, url, keyword):
+        """Requests the URL and caches the reply. An expired cache entry that
+        carries validators is revalidated with a conditional request, so an
+        unchanged object costs neither a body transfer nor a re-parse.
+        """
+        stale = self.cache.get_stale(url, keyword)
+        validators = stale[1] if stale is not None else None
+
+        content, new_validators = self._send_DB_request(url, validators)
+        if content is None:
+            logging.debug('Cached reply for {} is not modified'.format(url))
+            counters.increment('revalidations')
+            self.cache.touch(url, keyword)
+            return stale[0]
+
+        counters.increment('downloads')
+        if stale is not None:
+            counters.increment('refetches')
+        self.cache.update(url, content, keyword, new_validators)
+        return content
+
     def _search_URL_builder(self, query_string, inverse_attribute,
-                            type_filters, flags):
+                            type_filters, flags, reply_format=None):
         """Builds the url that is required by the search service of the RIPE API.
         Example:
         http://rest.db.ripe.net/search.xml?query-string=as199664&type-filter=route6&inverse-attribute=origin
         """
+        if reply_format is None:
+            reply_format = self.reply_format
 
-        new_url = ["/search.xml?"
-                   "query-string={}&source={}".format(query_string,
+        new_url = ["/search.{}?"
+                   "query-string={}&source={}".format(reply_format,
+                                                      query_string,
                                                       self.source)]
         new_url.append(self.other_sources)
 
@@ -130,34 +448,64 @@ class Communicator():
 
         return self.db_url + ''.join(new_url)
 
-    def _send_DB_request(self, db_url):
+    def _send_DB_request(self, db_url, validators=None):
         """The passed URL is being sent to the RIPE DEBUG. The function raises
         a custom error based on RIPE's API error list in case of receiving a
         non-expected status code.
+
+        Every request waits for the shared rate limiter. When the server
+        pushes back (query limit exceeded or 5xx) the rate is decreased and
+        the request is retried after a jittered exponential backoff. When the
+        retries are exhausted TransientDBError is raised, so that the caller
+        can re-queue the object instead of dropping it.
+
+        When validators (of a previously cached reply) are given the request
+        is conditional. Returns the tuple (content, validators) of the reply,
+        where content is None if the server replied 304 Not Modified.
         """
+        headers = dict()
+        if validators:
+            if validators.get('etag'):
+                headers['If-None-Match'] = validators['etag']
+            if validators.get('last-modified'):
+                headers['If-Modified-Since'] = validators['last-modified']
+
         retries = self.max_retries
+        backoff_attempt = 0
         logging.debug('Communicator._send_DB_request {}'.format(db_url))
         while True:
             try:
-                r = self.session.get(db_url)
+                self.rate_limiter.acquire()
+                r = self.session.get(db_url, headers=headers)
                 if r.status_code == 200:
-                    return r.content
+                    self.rate_limiter.succeeded()
+                    return r.content, _get_validators(r)
+                elif r.status_code == 304 and validators:
+                    self.rate_limiter.succeeded()
+                    return None, validators
+                elif r.status_code in self.TRANSIENT_STATUS_CODES:
+                    if r.status_code == 403:
+                        logging.warning("RIPE-API: Query limit exceeded.")
+                    else:
+                        logging.warning("RIPE-API: Server Error "
+                                        "({})".format(r.status_code))
+                    self.rate_limiter.throttled()
+                    backoff_attempt += 1
+                    if backoff_attempt > self.MAX_BACKOFF_RETRIES:
+                        raise errors.TransientDBError(
+                            "RIPE-API_ERROR_{}".format(r.status_code))
+                    time.sleep(ratelimit.backoff_delay(backoff_attempt))
+                    continue
                 elif r.status_code == 400:
                     logging.warning("RIPE-API: The service is unable to "
                                     "understand and process the request.")
                     raise errors.RIPEDBError("RIPE-API_ERROR_400")
-                elif r.status_code == 403:
-                    logging.warning("RIPE-API: Query limit exceeded.")
-                    raise errors.RIPEDBError("RIPE-API_ERROR_403")
                 elif r.status_code == 404:
                     logging.warning("RIPE-API: No Objects found")
-                    raise errors.RIPEDBError("RIPE-API_ERROR_404")
+                    raise errors.NotFoundError("RIPE-API_ERROR_404")
                 elif r.status_code == 409:
                     logging.warning("RIPE-API: Integrity constraint violated")
                     raise errors.RIPEDBError("RIPE-API_ERROR_409")
-                elif r.status_code == 500:
-                    logging.warning("RIPE-API: Internal Server Error")
-                    raise errors.RIPEDBError("RIPE-API_ERROR_500")
                 else:
                     logging.warning("Unknown RIPE-API response "
                                     "({})".format(r.status_code))
@@ -167,5 +515,7 @@ class Communicator():
                     raise e
                 retries -= 1
                 continue
+            except errors.RIPEDBError:
+                raise
             except:
                 raise errors.SendRequestError
@@ -0,0 +1,82 @@
+import multiprocessing as mp
+
+
+# The counters kept for a run. They are summed over the main process and all
+# the resolver processes forked from it.
+NAMES = (
+    'cache_hits',       # Replies served from the cache.
+    'cache_misses',     # Replies that had to be requested.
+    'downloads',        # Requests answered with a full body.
+    'revalidations',    # Refreshes of expired entries avoided (304).
+    'refetches',        # Expired entries that were downloaded again.
+    'memory_hits',      # Cache hits served by the in-memory tier.
+    'memory_misses',    # Lookups that went past the in-memory tier.
+    'memory_evictions', # Entries dropped from the full in-memory tier.
+    'parsed_hits',      # Lookups answered by the parsed-object cache.
+    'not_found',        # Requests answered with 404 (cached as negative).
+    'negative_hits',    # Requests avoided by a cached 404.
+    'stale_hits',       # Expired replies served while being refreshed.
+    'cache_evictions',  # Entries removed to keep the cache within its size.
+)
+
+
+class SharedCounters(object):
+    """Named integer counters that live in shared memory, so that processes
+    forked after their creation update the same values.
+    """
+
+    def __init__(self, names=NAMES):
+        self.names = names
+        self._index = dict((name, i) for i, name in enumerate(names))
+        self._values = mp.RawArray('l', len(names))
+        self._lock = mp.Lock()
+
+    def increment(self, name, value=1):
+        with self._lock:
+            self._values[self._index[name]] += value
+
+    def get(self, name):
+        return self._values[self._index[name]]
+
+    def snapshot(self):
+        with self._lock:
+            return dict((name, self._values[i])
+                        for name, i in self._index.iteritems())
+
+    def reset(self):
+        with self._lock:
+            for i in xrange(len(self.names)):
+                self._values[i] = 0
+
+
+_shared = SharedCounters()
+
+
+def increment(name, value=1):
+    _shared.increment(name, value)
+
+
+def get(name):
+    return _shared.get(name)
+
+
+def snapshot():
+    return _shared.snapshot()
+
+
+def reset():
+    _shared.reset()
+
+
+def cache_report():
+    """Returns a one line summary of the cache efficiency of the run."""
+    c = snapshot()
+    refreshes = c['revalidations'] + c['refetches']
+    return ("Cache: {} hits, {} misses, {} of {} refreshes avoided "
+            "(not modified); memory: {} hits, {} misses, {} evictions; "
+            "{} parsed hits; {} not found, {} negative hits; {} stale hits; "
+            "{} evicted"
+            .format(c['cache_hits'], c['cache_misses'], c['revalidations'],
+                    refreshes, c['memory_hits'], c['memory_misses'],
+                    c['memory_evictions'], c['parsed_hits'], c['not_found'],
+                    c['negative_hits'], c['stale_hits'], c['cache_evictions']))
@@ -26,6 +26,14 @@ class RIPEDBError(Error):
     pass
 
 
+class TransientDBError(RIPEDBError):
+    pass
+
+
+class NotFoundError(RIPEDBError):
+    pass
+
+
 class SendRequestError(Error):
     pass
 
@@ -0,0 +1,55 @@
+import json
+import os
+import tempfile
+
+import xxhash
+
+
+class FixtureArchive(object):
+    """A folder of recorded replies of the RIPE REST API, one file per
+    request path (path and query string). Every file holds a JSON header line
+    (path and status code) followed by the body.
+
+    It is written by a recording Communicator and replayed by
+    mock_ripe_server.py.
+    """
+
+    def __init__(self, folder):
+        self.folder = os.path.expanduser(folder)
+        if not os.path.isdir(self.folder):
+            os.makedirs(self.folder, mode=0o755)
+
+    def _filename(self, path):
+        return os.path.join(self.folder,
+                            xxhash.xxh64(path).hexdigest() + '.fixture')
+
+    def record(self, path, status, body):
+        """Stores the reply for the path, replacing an older recording.
+        The file is written under a temporary name and renamed, since several
+        resolver processes record at the same time.
+        """
+        header = dict(path=path, status=status)
+        fd, tmp_name = tempfile.mkstemp(dir=self.folder, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(json.dumps(header) + '\n')
+            f.write(body or '')
+        os.rename(tmp_name, self._filename(path))
+
+    def load(self, path):
+        """Returns (status, body) recorded for the path or None."""
+        try:
+            with open(self._filename(path), 'rb') as f:
+                header = json.loads(f.readline())
+                body = f.read()
+        except IOError:
+            return None
+        return header['status'], body
+
+    def paths(self):
+        """Returns the recorded paths."""
+        paths = []
+        for name in os.listdir(self.folder):
+            if name.endswith('.fixture'):
+                with open(os.path.join(self.folder, name), 'rb') as f:
+                    paths.append(json.loads(f.readline())['path'])
+        return paths
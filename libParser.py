@@ -1,40 +1,52 @@
+import functools
 import logging
 from xml.dom.minidom import parseString
 
 import communicator
+import counters
+import mirror
 import parsers
 import resolvers
+import rest_cache
 import rpsl
+import whois_communicator
 import xmlGenerator
 import yamlGenerator
 
 
 def selector(rpsl_string, routes_only, aggregate, ipv6=True, output_type='screen', black_list=set(),
-             output_format="XML"):
+             output_format="XML", comm_factory=communicator.Communicator, concurrency=None, pool=None):
+    """Resolves the AS or AS set and returns the output. A long-running
+    caller can pass a resolvers.ResolverPool to be reused by every call.
+    """
     if not rpsl.is_ASN(rpsl_string):
 
-        return build_simple_filter_output(rpsl_string, aggregate, black_list, ipv6, output_type, output_format)
+        return build_simple_filter_output(rpsl_string, aggregate, black_list, ipv6, output_type, output_format,
+                                          comm_factory, concurrency, pool)
 
     else:
         # Looks like we have an AS number for input
 
         if routes_only:
 
-            return build_simple_filter_output(rpsl_string, aggregate, black_list, ipv6, output_type, output_format)
+            return build_simple_filter_output(rpsl_string, aggregate, black_list, ipv6, output_type, output_format,
+                                              comm_factory, concurrency, pool)
 
         else:
             #   Full policy resolving, go ahead then
 
             return build_full_policy_output(rpsl_string, aggregate, ipv6=ipv6, output=output_type,
                                             black_list=black_list,
-                                            policy_format=output_format)
+                                            policy_format=output_format, comm_factory=comm_factory,
+                                            concurrency=concurrency, pool=pool)
 
 
-def build_simple_filter_output(rpsl_string, aggregate, black_list, ipv6, output_type, output_format):
+def build_simple_filter_output(rpsl_string, aggregate, black_list, ipv6, output_type, output_format,
+                               comm_factory=communicator.Communicator, concurrency=None, pool=None):
     pd = rpsl.PeerFilterDir()
     pd.append_filter(rpsl.PeerFilter("", "", rpsl_string))
 
-    fr = resolvers.FilterResolver(pd, ipv6, black_list)
+    fr = resolvers.FilterResolver(pd, ipv6, black_list, comm_factory, concurrency, pool)
     fr.resolve_filters()
 
     if output_format == "YAML":
@@ -45,12 +57,13 @@ def build_simple_filter_output(rpsl_string, aggregate, black_list, ipv6, output_
         return _to_XML("", None, aggregate, fr, output_type)
 
 
-def build_full_policy_output(autnum, aggregate, ipv6=True, output='screen', black_list=set(), policy_format="XML"):
+def build_full_policy_output(autnum, aggregate, ipv6=True, output='screen', black_list=set(), policy_format="XML",
+                             comm_factory=communicator.Communicator, concurrency=None, pool=None):
     #
     # PreProcess section: Get own policy, parse and create necessary Data
     #                     Structures.
     #
-    com = communicator.Communicator()
+    com = comm_factory()
     pp = parsers.PolicyParser(autnum)
 
     pp.assign_content(com.get_policy_by_autnum(autnum))
@@ -59,14 +72,14 @@ def build_full_policy_output(autnum, aggregate, ipv6=True, output='screen', blac
                   "{}".format(pp.filter_expressions.number_of_filters()))
     if pp.filter_expressions.number_of_filters() < 1:
         print("No filter expressions found.")
-        com.session.close()
+        com.close()
         return None
-    com.session.close()
+    com.close()
 
     #
     # Process section: Resolve necessary filter_expressions into prefixes.
     #
-    fr = resolvers.FilterResolver(pp.filter_expressions, ipv6, black_list)
+    fr = resolvers.FilterResolver(pp.filter_expressions, ipv6, black_list, comm_factory, concurrency, pool)
     fr.resolve_filters()
 
     #
@@ -145,6 +158,18 @@ if __name__ == "__main__":
             return "XML"
 
 
+    def read_ttl(string):
+        keyword, _, seconds = string.partition('=')
+        keywords = (communicator.Communicator.policy_keyword,
+                    communicator.Communicator.filterset_keyword,
+                    communicator.Communicator.route_keyword)
+        if keyword not in keywords or not seconds.isdigit():
+            raise argparse.ArgumentTypeError("Invalid TTL '{}'. Expected KEYWORD=SECONDS "
+                                             "where KEYWORD is one of {}"
+                                             .format(string, ', '.join(keywords)))
+        return keyword, int(seconds)
+
+
     parser = argparse.ArgumentParser()
 
     parser.add_argument('OBJECT', type=read_OBJECT,
@@ -165,6 +190,45 @@ if __name__ == "__main__":
                         help="Returns the route objects only that are related to the given AS number.")
     parser.add_argument('-a', '--aggregate', action="store_true",
                         help="Aggregates the routes of a prefix list.")
+    parser.add_argument('-m', '--mirror', nargs='?', const=mirror.MirrorStore.MIRROR_ROOT_FOLDER,
+                        help="Resolve everything from the local IRR mirror (see mirror.py) "
+                             "found in the given folder instead of the RIPE DB.")
+    parser.add_argument('-w', '--whois', nargs='?', metavar='HOST[:PORT]',
+                        const=whois_communicator.WhoisCommunicator.DEFAULT_HOST,
+                        help="Query an IRRd whois server, which expands the sets itself, "
+                             "instead of the RIPE REST API.")
+    parser.add_argument('-j', '--json', action="store_true",
+                        help="Use the JSON instead of the XML search service of the RIPE DB.")
+    parser.add_argument('-c', '--concurrency', type=int,
+                        help="Resolve everything from a single gevent event loop with at most "
+                             "CONCURRENCY requests in flight.")
+    parser.add_argument('--db-url',
+                        help="Send the requests to another RIPE REST API endpoint, e.g. the "
+                             "mock_ripe_server.py replaying recorded fixtures.")
+    parser.add_argument('--cache-backend', choices=sorted(rest_cache.RestCache.BACKENDS),
+                        help="Where the cached RIPE DB replies are stored: one file per "
+                             "reply (default) or a single SQLite database.")
+    parser.add_argument('--cache-codec', choices=sorted(rest_cache.RestCache.CODECS),
+                        help="How new cache entries are compressed (default zlib).")
+    parser.add_argument('--cache-size', type=int, metavar='MB',
+                        help="Maximum size of the cache. The least recently stored replies "
+                             "are removed in the background when it grows larger.")
+    parser.add_argument('--memory-cache', type=int, metavar='MB',
+                        help="Size of the in-memory tier of the cache per process "
+                             "(default 64, 0 disables it).")
+    parser.add_argument('--ttl', type=read_ttl, action='append', metavar='KEYWORD=SECONDS',
+                        help="How long the cached replies of a type (policy, filterset or "
+                             "route) are used (default 86400). May be repeated.")
+    parser.add_argument('--stale-while-revalidate', action="store_true",
+                        help="Use expired cached replies at once and refresh them in the "
+                             "background for the next runs.")
+    parser.add_argument('--no-refresh-wait', action="store_true",
+                        help="With --stale-while-revalidate, do not wait for the background "
+                             "refreshes at the end of the run. The replies left expired are "
+                             "refreshed by a later run.")
+    parser.add_argument('--record', metavar='FOLDER',
+                        help="Record every request and reply to a fixture archive in FOLDER "
+                             "(see mock_ripe_server.py).")
 
     args = parser.parse_args()
     if args.debug:
@@ -174,6 +238,37 @@ if __name__ == "__main__":
     print("Configuration done. Starting...")
 
     logging.getLogger("requests").setLevel(logging.WARNING)
+    if args.mirror:
+        comm_factory = functools.partial(mirror.MirrorCommunicator, args.mirror)
+    elif args.whois:
+        host, _, port = args.whois.partition(':')
+        comm_factory = functools.partial(
+            whois_communicator.WhoisCommunicator, host,
+            int(port or whois_communicator.WhoisCommunicator.DEFAULT_PORT))
+    else:
+        comm_options = dict()
+        if args.json:
+            comm_options['reply_format'] = 'json'
+        if args.db_url:
+            comm_options['db_url'] = args.db_url
+        if args.record:
+            comm_options['record_to'] = args.record
+        if args.cache_backend:
+            comm_options['cache_backend'] = args.cache_backend
+        if args.cache_codec:
+            comm_options['cache_codec'] = args.cache_codec
+        if args.cache_size is not None:
+            comm_options['cache_max_bytes'] = args.cache_size * 1024 * 1024
+        if args.memory_cache is not None:
+            comm_options['memory_cache_bytes'] = args.memory_cache * 1024 * 1024
+        if args.ttl:
+            comm_options['expire_after'] = dict(args.ttl)
+        if args.stale_while_revalidate:
+            comm_options['stale_while_revalidate'] = True
+        if args.no_refresh_wait:
+            comm_options['refresh_on_close'] = False
+        comm_factory = functools.partial(communicator.Communicator, **comm_options)
+
     if args.outputfile:
 
         if not args.outputfile.endswith('.xml') or not args.outputfile.endswith('.yaml'):
@@ -187,7 +282,8 @@ if __name__ == "__main__":
 
         lib_result = selector(args.OBJECT, args.routes_only, args.aggregate, output_type='file',
                               black_list=args.blacklist,
-                              output_format=args.format)
+                              output_format=args.format, comm_factory=comm_factory,
+                              concurrency=args.concurrency)
         if lib_result:
             with open(args.outputfile, mode='w') as f:
                 f.write(lib_result)
@@ -195,10 +291,15 @@ if __name__ == "__main__":
         logging.basicConfig(level=logging_level)
         lib_result = selector(args.OBJECT, args.routes_only, args.aggregate, output_type='screen',
                               black_list=args.blacklist,
-                              output_format=args.format)
+                              output_format=args.format, comm_factory=comm_factory,
+                              concurrency=args.concurrency)
         if lib_result:
             print "\n\n" + lib_result
 
+    logging.info(counters.cache_report())
+    if args.debug:
+        print(counters.cache_report())
+
     if lib_result:
         logging.info("All done. Output is ready.")
         print("All done. Output is ready.")
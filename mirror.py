@@ -0,0 +1,242 @@
+import gzip
+import logging
+import os
+import xml.etree.ElementTree as et
+
+import parsers
+import sqlite_pool
+
+
+# The RPSL object types that are kept in the mirror. Everything else found in
+# the dumps (persons, inetnums etc.) is skipped during ingestion.
+MIRRORED_TYPES = ('aut-num', 'as-set', 'route-set', 'route', 'route6')
+
+# Attributes that hold comma separated lists. They are expanded into one
+# attribute per list item, as the RIPE REST API does.
+LIST_ATTRIBUTES = ('members', 'mp-members')
+
+
+def build_search_reply(rpsl_objects):
+    """Renders the given RPSL objects into the XML format of the RIPE REST
+    search service, so that the replies can be consumed by the parsers
+    exactly like the ones coming from rest.db.ripe.net.
+
+    Parameters
+    ----------
+    rpsl_objects : list
+        Every object is a list of (attribute, value) tuples.
+
+    Returns
+    -------
+    str
+        The XML document.
+    """
+    root = et.Element('whois-resources')
+    objects_root = et.SubElement(root, 'objects')
+    for attributes in rpsl_objects:
+        obj_type = attributes[0][0]
+        obj = et.SubElement(objects_root, 'object', attrib={'type': obj_type})
+        for name, value in attributes:
+            if name == 'source':
+                et.SubElement(obj, 'source', attrib={'id': value.lower()})
+                break
+
+        if obj_type in ('route', 'route6'):
+            primary_key_names = (obj_type, 'origin')
+        else:
+            primary_key_names = (obj_type,)
+        primary_key = et.SubElement(obj, 'primary-key')
+        for name, value in attributes:
+            if name in primary_key_names:
+                et.SubElement(primary_key, 'attribute',
+                              attrib={'name': name, 'value': value})
+
+        attributes_root = et.SubElement(obj, 'attributes')
+        for name, value in attributes:
+            if name in LIST_ATTRIBUTES:
+                items = [i.strip() for i in value.split(',') if i.strip()]
+            else:
+                items = [value]
+            for item in items:
+                et.SubElement(attributes_root, 'attribute',
+                              attrib={'name': name, 'value': item})
+
+    return et.tostring(root, encoding='UTF-8')
+
+
+def _open_dump(path):
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rb')
+    return open(path, 'rb')
+
+
+class MirrorStore(object):
+    """An indexed on-disk store (SQLite) that holds the RPSL objects ingested
+    from bulk database dumps (e.g. ripe.db.route.gz, ripe.db.as-set.gz or the
+    GRS dumps).
+    """
+    # Default folder where the mirror database lives.
+    MIRROR_ROOT_FOLDER = "~/.libParser/mirror/"
+    DB_FILENAME = "irr.sqlite"
+
+    # How many objects are inserted per transaction while ingesting.
+    INGEST_BATCH = 10000
+
+    def __init__(self, mirror_folder=MIRROR_ROOT_FOLDER):
+        self.mirror_folder = os.path.expanduser(mirror_folder)
+        if not os.path.isdir(self.mirror_folder):
+            os.makedirs(self.mirror_folder, mode=0o755)
+        self.db_path = os.path.join(self.mirror_folder, self.DB_FILENAME)
+        self._pool = sqlite_pool.ConnectionPool(self.db_path)
+        self._create_tables()
+
+    def _connection(self):
+        return self._pool.connection()
+
+    def _create_tables(self):
+        with self._connection() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS objects ("
+                         "type TEXT, key TEXT, source TEXT, body TEXT, "
+                         "PRIMARY KEY (type, key, source))")
+            conn.execute("CREATE TABLE IF NOT EXISTS routes ("
+                         "prefix TEXT, origin TEXT, type TEXT, source TEXT, "
+                         "PRIMARY KEY (origin, type, prefix, source))")
+            conn.commit()
+
+    def clear(self):
+        """Removes every object from the store."""
+        with self._connection() as conn:
+            conn.execute("DELETE FROM objects")
+            conn.execute("DELETE FROM routes")
+            conn.commit()
+
+    def ingest(self, path):
+        """Reads an RPSL dump (plain or gzipped) and stores its objects.
+
+        Returns the number of stored objects.
+        """
+        objects, routes = [], []
+        stored = 0
+
+        def _flush():
+            with self._connection() as conn:
+                conn.execute("PRAGMA synchronous = OFF")
+                conn.executemany("INSERT OR REPLACE INTO objects VALUES "
+                                 "(?, ?, ?, ?)", objects)
+                conn.executemany("INSERT OR REPLACE INTO routes VALUES "
+                                 "(?, ?, ?, ?)", routes)
+                conn.commit()
+            del objects[:]
+            del routes[:]
+
+        with _open_dump(path) as dump:
+            for attributes in parsers.iter_rpsl_objects(dump):
+                obj_type, key = attributes[0]
+                if obj_type not in MIRRORED_TYPES:
+                    continue
+                values = dict(attributes)
+                source = values.get('source', '').upper()
+                if obj_type in ('route', 'route6'):
+                    routes.append((key, values.get('origin', '').upper(),
+                                   obj_type, source))
+                else:
+                    body = '\n'.join('{}: {}'.format(n, v)
+                                     for n, v in attributes)
+                    objects.append((obj_type, key.upper(), source, body))
+                stored += 1
+                if len(objects) + len(routes) >= self.INGEST_BATCH:
+                    _flush()
+        _flush()
+        logging.info("Ingested {} objects from {}".format(stored, path))
+        return stored
+
+    def get_objects(self, obj_type, key):
+        """Returns every stored object of the given type and key (one per
+        source) as a list of (attribute, value) tuples.
+        """
+        with self._connection() as conn:
+            rows = conn.execute(
+                "SELECT body FROM objects WHERE type = ? AND key = ?",
+                (obj_type, key.upper())).fetchall()
+        return [list(parsers.iter_rpsl_objects(row[0].splitlines()))[0]
+                for row in rows]
+
+    def get_routes(self, origin, route_types):
+        """Returns the route[6] objects originated by the given AS number."""
+        query = ("SELECT type, prefix, origin, source FROM routes "
+                 "WHERE origin = ? AND type IN ({})"
+                 .format(', '.join('?' * len(route_types))))
+        with self._connection() as conn:
+            rows = conn.execute(query, [origin.upper()] +
+                                list(route_types)).fetchall()
+        return [[(t, prefix), ('origin', o), ('source', source)]
+                for t, prefix, o, source in rows]
+
+
+class MirrorCommunicator(object):
+    """Drop-in replacement of communicator.Communicator that resolves every
+    request from a local MirrorStore instead of the RIPE REST API.
+    """
+
+    # The replies are rendered in the XML format of the RIPE REST API.
+    reply_format = 'xml'
+
+    def __init__(self, mirror_folder=MirrorStore.MIRROR_ROOT_FOLDER):
+        self.store = MirrorStore(mirror_folder)
+
+    def close(self):
+        pass
+
+    def get_policy_by_autnum(self, autnum):
+        objects = self.store.get_objects('aut-num', autnum)
+        if not objects:
+            logging.error("Failed to find policy for {} in the local "
+                          "mirror.".format(autnum))
+            return None
+        logging.debug("Policy for {} found in mirror".format(autnum))
+        return build_search_reply(objects)
+
+    def get_filter_set(self, value):
+        """Makes requests for as-set, route-set."""
+        objects = (self.store.get_objects('as-set', value) +
+                   self.store.get_objects('route-set', value))
+        if not objects:
+            logging.error("Failed to find filter set {} in the local "
+                          "mirror.".format(value))
+            return None
+        return build_search_reply(objects)
+
+    def get_routes_by_autnum(self, autnum, ipv6_enabled=False):
+        """Returns all the route[6] objects for a given AS number."""
+        type_filter = ['route']
+        if ipv6_enabled:
+            type_filter.append('route6')
+
+        objects = self.store.get_routes(autnum, type_filter)
+        if not objects:
+            logging.error("No routes originated by {} found in the local "
+                          "mirror.".format(autnum))
+            return None
+        return build_search_reply(objects)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Ingests RPSL dump files into the local IRR mirror.")
+    parser.add_argument('DUMP', nargs='+',
+                        help="RPSL dump files (plain or gzipped), e.g. "
+                             "ripe.db.route.gz or radb.db.gz.")
+    parser.add_argument('-m', '--mirror', default=MirrorStore.MIRROR_ROOT_FOLDER,
+                        help="The folder of the mirror database.")
+    parser.add_argument('--fresh', action="store_true",
+                        help="Remove all the stored objects before ingesting.")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    store = MirrorStore(args.mirror)
+    if args.fresh:
+        store.clear()
+    for dump_file in args.DUMP:
+        store.ingest(dump_file)
@@ -0,0 +1,151 @@
+"""A minimal IRRd whois server that answers from a local IRR mirror (see
+mirror.py), for testing whois_communicator.WhoisCommunicator offline.
+
+Usage: python mock_irrd_server.py [-p PORT] [-m MIRROR]
+
+Supported queries: !! (persistent connection), !q, !s<sources> (accepted and
+ignored), !g<ASN>, !6<ASN>, !i<set>[,1] and !m<type>,<key>.
+"""
+import SocketServer
+import threading
+
+import mirror
+import rpsl
+
+
+class IRRdHandler(SocketServer.StreamRequestHandler):
+
+    def handle(self):
+        self.server.count_connection()
+        persistent = False
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                break
+            query = line.strip()
+            if not query:
+                continue
+            if query == '!!':
+                persistent = True
+                continue
+            if query == '!q':
+                break
+            self.wfile.write(self.server.answer(query))
+            if not persistent:
+                break
+
+
+class IRRdServer(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, store):
+        SocketServer.TCPServer.__init__(self, address, IRRdHandler)
+        self.store = store
+        self.connections = 0
+        self._connections_lock = threading.Lock()
+
+    def count_connection(self):
+        with self._connections_lock:
+            self.connections += 1
+
+    def answer(self, query):
+        """Returns the IRRd formatted reply of the query."""
+        command, argument = query[:2], query[2:]
+        if command == '!s':
+            return "C\n"
+        elif command == '!g':
+            data = self._prefixes(argument, 'route')
+        elif command == '!6':
+            data = self._prefixes(argument, 'route6')
+        elif command == '!i':
+            name, _, recursive = argument.partition(',')
+            data = self._expand(name, recursive == '1')
+        elif command == '!m':
+            obj_type, _, key = argument.partition(',')
+            data = self._object(obj_type, key)
+        else:
+            return "F Unrecognized command\n"
+
+        if data is None:
+            return "D\n"
+        elif not data:
+            return "C\n"
+        return "A{}\n{}\nC\n".format(len(data) + 1, data)
+
+    def _prefixes(self, autnum, route_type):
+        routes = self.store.get_routes(autnum, [route_type])
+        if not routes:
+            return None
+        return ' '.join(sorted(obj[0][1] for obj in routes))
+
+    def _members(self, name):
+        objects = (self.store.get_objects('as-set', name) or
+                   self.store.get_objects('route-set', name))
+        if not objects:
+            return None
+        members = []
+        for attributes in objects:
+            for attr, value in attributes:
+                if attr in mirror.LIST_ATTRIBUTES:
+                    members.extend(i.strip() for i in value.split(',')
+                                   if i.strip())
+        return members
+
+    def _expand(self, name, recursive):
+        members = self._members(name)
+        if members is None:
+            return None
+        if not recursive:
+            return ' '.join(members)
+
+        # Like IRRd, the ASes of route sets are replaced by their prefixes.
+        route_set = not rpsl.is_AS_set(name)
+        expanded = set()
+        seen = set([name.upper()])
+        while members:
+            member = members.pop()
+            if rpsl.is_AS_set(member) or rpsl.is_rs_set(member):
+                if member.upper() not in seen:
+                    seen.add(member.upper())
+                    members.extend(self._members(member) or [])
+            elif route_set and rpsl.is_ASN(member):
+                for route_type in ('route', 'route6'):
+                    expanded.update(
+                        obj[0][1] for obj in
+                        self.store.get_routes(member, [route_type]))
+            else:
+                expanded.add(member)
+        return ' '.join(sorted(expanded))
+
+    def _object(self, obj_type, key):
+        objects = self.store.get_objects(obj_type, key)
+        if not objects:
+            return None
+        return '\n'.join('{}: {}'.format(attr, value)
+                         for attr, value in objects[0])
+
+
+def start_server(mirror_folder, port=0):
+    """Starts a server in a background thread and returns it."""
+    server = IRRdServer(('127.0.0.1', port), mirror.MirrorStore(mirror_folder))
+    t = threading.Thread(target=server.serve_forever)
+    t.daemon = True
+    t.start()
+    return server
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-p', '--port', type=int, default=4343)
+    parser.add_argument('-m', '--mirror',
+                        default=mirror.MirrorStore.MIRROR_ROOT_FOLDER,
+                        help="The folder of the mirror database.")
+    args = parser.parse_args()
+
+    server = IRRdServer(('127.0.0.1', args.port),
+                        mirror.MirrorStore(args.mirror))
+    print "Serving {} on 127.0.0.1:{}".format(args.mirror, args.port)
+    server.serve_forever()
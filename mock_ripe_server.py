@@ -0,0 +1,174 @@
+"""A small HTTP server that replays a fixture archive (see fixtures.py) in
+place of the RIPE REST API, for reproducible offline benchmarks.
+
+Usage: python mock_ripe_server.py [-p PORT] [--latency MS] [--error-403 P]
+                                  [--error-500 P] [--reset P]
+                                  [--bandwidth BYTES] FIXTURES
+
+Paths that were not recorded are answered with 404, as RIPE does for missing
+objects. Point the resolvers to it with libParser.py --db-url.
+"""
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+import random
+import socket
+from SocketServer import ThreadingMixIn
+import struct
+import threading
+import time
+
+import xxhash
+
+import fixtures
+
+
+class ReplayOptions(object):
+    """The behaviour of the mock server."""
+
+    def __init__(self, latency=0.0, error_403=0.0, error_500=0.0, reset=0.0,
+                 bandwidth=None):
+        # Delay (seconds) before every reply.
+        self.latency = latency
+        # Probabilities of answering with an injected error instead of the
+        # recorded reply.
+        self.error_403 = error_403
+        self.error_500 = error_500
+        self.reset = reset
+        # Bytes per second per connection, unlimited if None.
+        self.bandwidth = bandwidth
+
+
+class ReplayHandler(BaseHTTPRequestHandler):
+    # Keep-alive connections, like rest.db.ripe.net.
+    protocol_version = "HTTP/1.1"
+
+    # Bytes written at once while throttling the bandwidth.
+    CHUNK_SIZE = 4096
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reset_connection(self):
+        """Closes the connection abruptly (RST instead of FIN)."""
+        self.connection.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER,
+                                   struct.pack('ii', 1, 0))
+        self.connection.close()
+        self.close_connection = 1
+
+    def _reply(self, status, body='', headers=None):
+        self.send_response(status)
+        for name, value in (headers or {}).iteritems():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+
+        bandwidth = self.server.options.bandwidth
+        if not bandwidth:
+            self.wfile.write(body)
+            return
+        for i in xrange(0, len(body), self.CHUNK_SIZE):
+            chunk = body[i:i + self.CHUNK_SIZE]
+            self.wfile.write(chunk)
+            self.wfile.flush()
+            time.sleep(len(chunk) / float(bandwidth))
+
+    def do_GET(self):
+        options = self.server.options
+        self.server.count_request()
+        if options.latency:
+            time.sleep(options.latency)
+
+        dice = random.random()
+        if dice < options.reset:
+            self._reset_connection()
+            return
+        dice -= options.reset
+        if dice < options.error_403:
+            self._reply(403)
+            return
+        dice -= options.error_403
+        if dice < options.error_500:
+            self._reply(500)
+            return
+
+        recorded = self.server.archive.load(self.path)
+        if recorded is None:
+            self._reply(404)
+            return
+
+        status, body = recorded
+        etag = '"{}"'.format(xxhash.xxh64(body).hexdigest())
+        if status == 200 and self.headers.get('If-None-Match') == etag:
+            self._reply(304, headers={'ETag': etag})
+            return
+        if self.path.startswith('/search.json'):
+            content_type = 'application/json'
+        else:
+            content_type = 'application/xml'
+        self._reply(status, body, {'Content-Type': content_type,
+                                   'ETag': etag})
+
+    def finish(self):
+        try:
+            BaseHTTPRequestHandler.finish(self)
+        except socket.error:
+            pass
+
+
+class ReplayServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, archive, options):
+        HTTPServer.__init__(self, address, ReplayHandler)
+        self.archive = archive
+        self.options = options
+        self.requests_served = 0
+        self._requests_served_lock = threading.Lock()
+
+    def count_request(self):
+        with self._requests_served_lock:
+            self.requests_served += 1
+
+    def handle_error(self, request, client_address):
+        # Injected resets make the handler fail; that is expected.
+        pass
+
+
+def start_server(fixtures_folder, port=0, options=None):
+    """Starts a replay server in a background thread and returns it. Its URL
+    is 'http://127.0.0.1:{}'.format(server.server_port).
+    """
+    server = ReplayServer(('127.0.0.1', port),
+                          fixtures.FixtureArchive(fixtures_folder),
+                          options or ReplayOptions())
+    t = threading.Thread(target=server.serve_forever)
+    t.daemon = True
+    t.start()
+    return server
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('FIXTURES', help="The folder of the fixture archive.")
+    parser.add_argument('-p', '--port', type=int, default=8043)
+    parser.add_argument('--latency', type=float, default=0,
+                        help="Delay in milliseconds before every reply.")
+    parser.add_argument('--error-403', type=float, default=0,
+                        help="Probability of replying 403 (query limit exceeded).")
+    parser.add_argument('--error-500', type=float, default=0,
+                        help="Probability of replying 500 (internal server error).")
+    parser.add_argument('--reset', type=float, default=0,
+                        help="Probability of resetting the connection.")
+    parser.add_argument('--bandwidth', type=int,
+                        help="Bytes per second per connection.")
+    args = parser.parse_args()
+
+    server = ReplayServer(('127.0.0.1', args.port),
+                          fixtures.FixtureArchive(args.FIXTURES),
+                          ReplayOptions(args.latency / 1000.0, args.error_403,
+                                        args.error_500, args.reset,
+                                        args.bandwidth))
+    print "Replaying {} on http://127.0.0.1:{}".format(args.FIXTURES, args.port)
+    server.serve_forever()
@@ -1,3 +1,5 @@
+from collections import namedtuple
+import json
 import logging
 import re
 try:
@@ -62,7 +64,10 @@ class PolicyParser:
 
     def assign_content(self, xml_text):
         try:
-            self.et_content = et.fromstring(xml_text)
+            if isinstance(xml_text, basestring):
+                self.et_content = et.fromstring(xml_text)
+            else:
+                self.et_content = et.parse(xml_text).getroot()
         except et.ParseError, et.TypeError:
             raise Exception('Failed to load DB content in XML format')
 
@@ -398,10 +403,13 @@ class PolicyParser:
 
 
 def parse_AS_routes(xml_resp, ipv4=True, ipv6=True):
-    """Parses the XML response in-place and returns the ipv4/ipv6 routes."""
+    """Parses the XML response (a string or a file-like object) in-place and
+    returns the ipv4/ipv6 routes.
+    """
     routes = {'ipv4': set(), 'ipv6': set()}
     try:
-        xml_resp = StringIO(xml_resp)
+        if isinstance(xml_resp, basestring):
+            xml_resp = StringIO(xml_resp)
         context = et.iterparse(xml_resp, events=('start', 'end'))
         context = iter(context)
         _, root = context.next()
@@ -431,8 +439,13 @@ def parse_AS_routes(xml_resp, ipv4=True, ipv6=True):
 
 
 def parse_AS_set_members(xml_resp):
-    """Parses the XML response and returns the AS set's members."""
-    db_object = et.fromstring(xml_resp)
+    """Parses the XML response (a string or a file-like object) and returns
+    the AS set's members.
+    """
+    if isinstance(xml_resp, basestring):
+        db_object = et.fromstring(xml_resp)
+    else:
+        db_object = et.parse(xml_resp).getroot()
     AS_sets = set()
     ASNs = set()
     for elem in db_object.iterfind('./objects/object[@type="as-set"]/attributes'):
@@ -446,12 +459,15 @@ def parse_AS_set_members(xml_resp):
 
 
 def parse_RS_members(xml_resp, ipv4=True, ipv6=True):
-    """Parses the XML response in-place and returns the RS' members."""
+    """Parses the XML response (a string or a file-like object) in-place and
+    returns the RS' members.
+    """
     RSes = set()
     routes = {'ipv4': set(), 'ipv6': set()}
 
     try:
-        xml_resp = StringIO(xml_resp)
+        if isinstance(xml_resp, basestring):
+            xml_resp = StringIO(xml_resp)
         context = et.iterparse(xml_resp, events=('start', 'end'))
         context = iter(context)
         _, root = context.next()
@@ -477,3 +493,174 @@ def parse_RS_members(xml_resp, ipv4=True, ipv6=True):
         xml_resp.close()
 
     return RSes, routes
+
+
+def _json_objects(json_resp):
+    """Returns the objects of a JSON reply of the RIPE search service."""
+    if isinstance(json_resp, basestring):
+        reply = json.loads(json_resp)
+    else:
+        reply = json.load(json_resp)
+    return reply.get('objects', {}).get('object', [])
+
+
+def _json_attributes(db_object, names, section='attributes'):
+    """Yields the (name, value) of the attributes of the object that are
+    named one of names, with the value as a UTF-8 encoded string. The other
+    attributes (e.g. descr or remarks) may hold any unicode and are skipped.
+    """
+    for attr in db_object.get(section, {}).get('attribute', []):
+        name = attr.get('name')
+        if name in names:
+            yield str(name), unicode(attr.get('value')).encode('utf-8')
+
+
+def parse_AS_routes_json(json_resp, ipv4=True, ipv6=True):
+    """Parses the JSON response and returns the ipv4/ipv6 routes."""
+    routes = {'ipv4': set(), 'ipv6': set()}
+    for db_object in _json_objects(json_resp):
+        for name, value in _json_attributes(db_object, ('route', 'route6'), 'primary-key'):
+            if ipv4 and name == 'route':
+                routes['ipv4'].add(value)
+            elif ipv6 and name == 'route6':
+                routes['ipv6'].add(value)
+
+    return routes
+
+
+def parse_AS_set_members_json(json_resp):
+    """Parses the JSON response and returns the AS set's members."""
+    AS_sets = set()
+    ASNs = set()
+    for db_object in _json_objects(json_resp):
+        if db_object.get('type') != 'as-set':
+            continue
+        for name, value in _json_attributes(db_object, ('members',)):
+            if name == 'members':
+                if rpsl.is_ASN(value):
+                    ASNs.add(value)
+                elif rpsl.is_AS_set(value):
+                    AS_sets.add(value)
+    return AS_sets, ASNs
+
+
+def parse_RS_members_json(json_resp, ipv4=True, ipv6=True):
+    """Parses the JSON response and returns the RS' members."""
+    RSes = set()
+    routes = {'ipv4': set(), 'ipv6': set()}
+    for db_object in _json_objects(json_resp):
+        for name, member in _json_attributes(db_object, ('members', 'mp-members')):
+            if name == 'members' or name == 'mp-members':
+                if rpsl.is_rs_set(member):
+                    RSes.add(member)
+                elif ipv4 and tools.is_valid_ipv4_with_range(member):
+                    routes['ipv4'].add(member)
+                elif ipv6 and tools.is_valid_ipv6_with_range(member):
+                    routes['ipv6'].add(member)
+
+    return RSes, routes
+
+
+def _as_string(reply):
+    """Returns the reply as a string; replies may also be file-like objects
+    (e.g. streamed from the cache).
+    """
+    if isinstance(reply, basestring):
+        return reply
+    return reply.read()
+
+
+def parse_AS_routes_whois(whois_resp, ipv4=True, ipv6=True):
+    """Parses the prefixes of IRRd !g/!6 replies and returns the ipv4/ipv6
+    routes.
+    """
+    routes = {'ipv4': set(), 'ipv6': set()}
+    for prefix in _as_string(whois_resp).split():
+        if ':' in prefix:
+            if ipv6:
+                routes['ipv6'].add(prefix)
+        elif ipv4:
+            routes['ipv4'].add(prefix)
+
+    return routes
+
+
+def parse_AS_set_members_whois(whois_resp):
+    """Parses an IRRd !i reply and returns the AS set's members."""
+    AS_sets = set()
+    ASNs = set()
+    for member in _as_string(whois_resp).split():
+        if rpsl.is_ASN(member):
+            ASNs.add(member)
+        elif rpsl.is_AS_set(member):
+            AS_sets.add(member)
+    return AS_sets, ASNs
+
+
+def parse_RS_members_whois(whois_resp, ipv4=True, ipv6=True):
+    """Parses an IRRd !i reply and returns the RS' members."""
+    RSes = set()
+    routes = {'ipv4': set(), 'ipv6': set()}
+    for member in _as_string(whois_resp).split():
+        if rpsl.is_rs_set(member):
+            RSes.add(member)
+        elif ipv4 and tools.is_valid_ipv4_with_range(member):
+            routes['ipv4'].add(member)
+        elif ipv6 and tools.is_valid_ipv6_with_range(member):
+            routes['ipv6'].add(member)
+
+    return RSes, routes
+
+
+# The parsers of the set and route replies per reply format (see
+# Communicator.reply_format).
+ReplyParsers = namedtuple('ReplyParsers', 'AS_routes AS_set_members RS_members')
+
+REPLY_PARSERS = {
+    'xml': ReplyParsers(parse_AS_routes, parse_AS_set_members,
+                        parse_RS_members),
+    'json': ReplyParsers(parse_AS_routes_json, parse_AS_set_members_json,
+                         parse_RS_members_json),
+    'whois': ReplyParsers(parse_AS_routes_whois, parse_AS_set_members_whois,
+                          parse_RS_members_whois),
+}
+
+
+def iter_rpsl_objects(stream):
+    """Parses RPSL text (e.g. a bulk database dump) and yields every object as
+    a list of (attribute, value) tuples.
+
+    Objects are separated by empty lines. Continuation lines (starting with a
+    space, a tab or '+') are folded into the preceding attribute, while
+    comments (whole lines starting with '#' or '%' and end-of-line '#'
+    remarks) are dropped.
+    """
+    attributes = []
+    for line in stream:
+        line = line.rstrip('\r\n')
+        if not line.strip():
+            if attributes:
+                yield attributes
+                attributes = []
+            continue
+
+        if line[0] in '#%':
+            continue
+
+        if line[0] in ' \t+':
+            if attributes:
+                value = line[1:].split('#', 1)[0].strip()
+                if value:
+                    name, previous = attributes[-1]
+                    attributes[-1] = (name, (previous + ' ' + value).strip())
+            continue
+
+        name, sep, value = line.partition(':')
+        if not sep:
+            logging.debug("Skipping malformed RPSL line: {}".format(line))
+            continue
+        attributes.append((name.strip().lower(),
+                           value.split('#', 1)[0].strip()))
+
+    if attributes:
+        yield attributes
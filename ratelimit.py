@@ -0,0 +1,89 @@
+import multiprocessing as mp
+import random
+import time
+
+
+class TokenBucket(object):
+    """Token bucket rate limiter with AIMD (additive increase, multiplicative
+    decrease) adjustment of its rate.
+
+    The state lives in shared memory, so a bucket that is created before the
+    resolver processes are forked is shared by all of them (and by all their
+    threads).
+    """
+    # Requests per second that are allowed initially.
+    DEFAULT_RATE = 20.0
+    # Bounds of the adjusted rate.
+    MIN_RATE = 1.0
+    MAX_RATE = 500.0
+    # Rate added after every successful request.
+    ADDITIVE_INCREASE = 0.2
+    # Factor applied to the rate when the server pushes back.
+    MULTIPLICATIVE_DECREASE = 0.5
+    # Pushbacks that arrive within this many seconds after a decrease belong
+    # to the same burst and do not decrease the rate again.
+    DECREASE_COOLDOWN = 1.0
+
+    # Indices of the shared state.
+    _TOKENS, _LAST_REFILL, _RATE, _LAST_DECREASE = range(4)
+
+    def __init__(self, rate=DEFAULT_RATE, burst=None):
+        self.burst = burst if burst is not None else max(rate, 1.0)
+        self._lock = mp.Lock()
+        self._state = mp.RawArray('d', 4)
+        self._state[self._TOKENS] = self.burst
+        self._state[self._LAST_REFILL] = time.time()
+        self._state[self._RATE] = rate
+        self._state[self._LAST_DECREASE] = 0.0
+
+    @property
+    def rate(self):
+        return self._state[self._RATE]
+
+    def _refill(self, now):
+        elapsed = max(now - self._state[self._LAST_REFILL], 0.0)
+        self._state[self._TOKENS] = min(
+            self.burst,
+            self._state[self._TOKENS] + elapsed * self._state[self._RATE])
+        self._state[self._LAST_REFILL] = now
+
+    def acquire(self):
+        """Blocks until a token is available and consumes it."""
+        while True:
+            with self._lock:
+                now = time.time()
+                self._refill(now)
+                if self._state[self._TOKENS] >= 1.0:
+                    self._state[self._TOKENS] -= 1.0
+                    return
+                wait = (1.0 - self._state[self._TOKENS]) / self._state[self._RATE]
+            time.sleep(wait)
+
+    def succeeded(self):
+        """Additive increase after a request that went through."""
+        with self._lock:
+            self._state[self._RATE] = min(
+                self.MAX_RATE, self._state[self._RATE] + self.ADDITIVE_INCREASE)
+
+    def throttled(self):
+        """Multiplicative decrease after the server pushed back (e.g. 403
+        query limit exceeded or 5xx). The tokens are drained so that every
+        worker slows down immediately.
+        """
+        with self._lock:
+            now = time.time()
+            if now - self._state[self._LAST_DECREASE] < self.DECREASE_COOLDOWN:
+                return
+            self._state[self._LAST_DECREASE] = now
+            self._state[self._RATE] = max(
+                self.MIN_RATE,
+                self._state[self._RATE] * self.MULTIPLICATIVE_DECREASE)
+            self._state[self._TOKENS] = 0.0
+            self._state[self._LAST_REFILL] = now
+
+
+def backoff_delay(attempt, base=0.5, cap=30.0):
+    """Exponential backoff with full jitter for the given (1-based) retry
+    attempt.
+    """
+    return random.uniform(0, min(cap, base * 2 ** attempt))
@@ -1,28 +1,226 @@
+import functools
 import logging
 import math
 import multiprocessing as mp
 from multiprocessing.queues import SimpleQueue
+from multiprocessing.util import Finalize
 import sys
 import threading
 from threading import Thread, Lock
 import time
-from Queue import Queue, Empty
+from Queue import Queue
 
 import analyzer
+import asregistry
 import communicator
-import parsers
+import errors
+import ratelimit
+import routestore
 import rpsl
 
 threads_count = 10
 
+# The most ASNs handed to a resolver process at once. The ASes are taken up
+# in such chunks by whichever process has its threads taking up all the
+# ASNs of its previous chunk, so that a few ASes with huge route sets do not
+# hold back a whole static share of the work (see _ASWorkers).
+AS_chunk_size = threads_count
+
+# How many times an object whose lookup was throttled by the DB is put back
+# in the queue before giving up on it.
+max_requeues = 5
+
+
+class _Requeuer(object):
+    """Puts back in the queue the items whose lookup was throttled by the DB
+    (after the communicator's own backoff was exhausted), so that they are
+    retried after the rest of the queued work instead of being dropped.
+    """
+
+    def __init__(self, q):
+        self.q = q
+        self.attempts = dict()
+        self.lock = Lock()
+
+    def __call__(self, key, item):
+        """Re-queues the item and returns True, or returns False if the item
+        has been re-queued too many times.
+        """
+        with self.lock:
+            self.attempts[key] = self.attempts.get(key, 0) + 1
+            if self.attempts[key] > max_requeues:
+                return False
+        self.q.put(item)
+        return True
+
+
+class ResolverPool(object):
+    """Resolver processes that are started once and run the resolving phases
+    of any number of FilterResolvers, e.g. of a long-running service.
+
+    Every process keeps its communicator (with its session and in-memory
+    cache) between the phases. The pool is used by one FilterResolver at a
+    time and has to be closed (or used as a context manager) to stop the
+    processes.
+    """
+
+    def __init__(self, comm_factory=communicator.Communicator, processes=None):
+        # Callable that creates the communicator of every process. It has to
+        # be picklable.
+        self.comm_factory = comm_factory
+
+        # We will devote all but one core to resolving since the main process
+        # will handle the objects' creation.
+        if processes is None:
+            processes = max(mp.cpu_count() - 1, 1)
+        self.processes = processes
+
+        # The routes of the ASes are sent back through this queue, a batch per
+        # chunk of ASes. It is handed to the processes when they start, since it
+        # can not be passed along with a task.
+        self.result_q = SimpleQueue()  # NOTE: Only works with this queue.
+        self._pool = mp.Pool(processes, initializer=_pool_worker_init,
+                             initargs=(comm_factory, self.result_q))
+
+        # The seconds every process spent on tasks since the current
+        # resolving started (see utilisation).
+        # Table scheme: {process name: seconds}
+        self._reset_busy()
+
+    def _reset_busy(self):
+        """Starts measuring the utilisation again, from zero for every
+        process, so that the idle ones are shown as well.
+        """
+        self.busy = dict((process.name, 0) for process in self._pool._pool)
+        self._started = time.time()
+
+    def _request_ASes(self, ASNs):
+        """Queues the ASNs in chunks that are taken up by the idle processes.
+        Their routes are sent back through the result_q. Returns the number of
+        messages to expect (the routes and the busy time of every chunk).
+        """
+        ASNs = list(ASNs)
+        if not ASNs:
+            return 0
+        # Few ASNs are still spread over all the processes.
+        chunk_size = min(AS_chunk_size,
+                         int(math.ceil(len(ASNs) / float(self.processes))))
+        chunks = 0
+        for chunk_start in xrange(0, len(ASNs), chunk_size):
+            self._pool.apply_async(_pooled_AS_resolving,
+                                   (ASNs[chunk_start:chunk_start+chunk_size],
+                                    self.comm_factory))
+            chunks += 1
+        return 2 * chunks
+
+    def utilisation(self):
+        """Returns the fraction of the time since the current resolving
+        started that every process spent on (finished) tasks.
+        Table scheme: {process name: fraction}
+        """
+        elapsed = max(time.time() - self._started, 1e-6)
+        return dict((name, min(busy / elapsed, 1.0))
+                    for name, busy in self.busy.iteritems())
+
+    def resolve_pipelined(self, AS_set_list, AS_list, RS_list, black_list):
+        """Resolves the AS sets and the RSes (recursively) and the routes of
+        the ASes at the same time, and yields the results as they arrive:
+
+        ('AS_sets', AS_set_directory, recursed_ASes) once the AS sets are
+            resolved (see _subprocess_AS_set_resolving),
+        ('RSes', RS_directory) once the RSes are resolved, and
+        ('routes', AS_routes) for every chunk of ASes, where AS_routes is a
+            list of (asn, packed routes) tuples (see routestore.pack_routes)
+            and the packed routes are None if the AS was not found.
+
+        The routes of every AS found in an AS set are requested as soon as
+        the AS set is resolved, so that the whole resolving takes about as
+        long as the longest chain of lookups. Blacklisted ASes are skipped.
+
+        Every finished task (and chunk of ASes) also reports the time it
+        kept its process busy (see utilisation).
+        """
+        self._reset_busy()
+
+        # The messages still to come: the result and the busy time of every
+        # task.
+        pending = 0
+        # The ASes requested so far and the blacklisted ones, as bitsets
+        # (see asregistry).
+        registry = asregistry.registry
+        skipped_ASes = registry.bitset(black_list)
+        if AS_set_list:
+            self._pool.apply_async(_pooled_AS_set_resolving,
+                                   (AS_set_list, self.comm_factory))
+            pending += 2
+        if RS_list:
+            self._pool.apply_async(_pooled_RS_resolving, (RS_list, self.comm_factory))
+            pending += 2
+
+        new_ASes = registry.bitset(AS_list) & ~skipped_ASes
+        while True:
+            if new_ASes:
+                skipped_ASes |= new_ASes
+                pending += self._request_ASes(registry.ASNs(new_ASes))
+            if pending < 1:
+                break
+
+            # The messages are tagged with their kind.
+            message = self.result_q.get()
+            if message[0] == 'ASNs':
+                new_ASes = registry.bitset(message[1]) & ~skipped_ASes
+                continue
+
+            new_ASes = 0
+            pending -= 1
+            if message[0] == 'busy':
+                _, name, seconds = message
+                self.busy[name] = self.busy.get(name, 0) + seconds
+                continue
+            if message[0] == 'AS_sets':
+                # All of them have been streamed already, unless a worker
+                # failed.
+                new_ASes = registry.bitset(message[2]) & ~skipped_ASes
+            yield message
+
+    def resolve_all_async(self, AS_set_list, AS_list, RS_list, black_list, concurrency):
+        """Returns the results of _subprocess_async_resolving."""
+        return self._pool.apply(_subprocess_async_resolving,
+                                (AS_set_list, AS_list, RS_list, black_list,
+                                 self.comm_factory, concurrency))
+
+    def close(self):
+        """Waits for the processes to finish their work and stops them."""
+        self._pool.close()
+        self._pool.join()
+
+    def terminate(self):
+        self._pool.terminate()
+        self._pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.terminate()
+
 
 class FilterResolver:
-    def __init__(self, items, ipv6_enabled, blist):
+    def __init__(self, items, ipv6_enabled, blist,
+                 comm_factory=communicator.Communicator, concurrency=None,
+                 pool=None):
 
         self.peer_filters = items
         self.ipv6_enabled = ipv6_enabled
         self.black_list = blist
 
+        # Callable that creates the communicator (e.g. RIPE REST or local
+        # mirror) used by the resolving processes. It has to be picklable.
+        self.comm_factory = comm_factory
+
         # Set that contains all the AS sets that we discover via filter
         # parsing and need to be translated into prefix-lists.
         self.AS_set_list = set()
@@ -52,6 +250,16 @@ class FilterResolver:
         # interaction with RIPE-DB (double resolving).
         self.recursed_ASes = set()
 
+        # When set, all the lookups are driven by a single gevent event loop
+        # with at most that many requests in flight, instead of the
+        # process/thread based resolvers.
+        self.concurrency = concurrency
+
+        # The ResolverPool that runs the resolving (with its own
+        # communicators). When not given, one is started for every
+        # resolve_filters() call.
+        self.pool = pool
+
     def resolve_filters(self):
         for pf in self.peer_filters.enumerate_objs():
             # The analyser will analyse the filter and recognise the elements
@@ -64,60 +272,35 @@ class FilterResolver:
 
             pf.statements = analyzer.compose_filter(output_queue)
 
-        print "Resolving AS sets..."
-        self._handle_AS_sets()
-        print "Resolving ASes..."
-        self._handle_ASes()
-        print "Resolving RS sets..."
-        self._handle_RSes()
-
-    def _handle_AS_sets(self):
-        """Spawns a process to handle the recursive AS set resolving and
-        creates the necessary objects based on the results.
-        """
-        if len(self.AS_set_list) < 1:
-            return
+        pool = self.pool
+        if pool is None:
+            pool = ResolverPool(self.comm_factory)
+        try:
+            print "Resolving AS sets, ASes and RS sets..."
+            if self.concurrency:
+                self._handle_all_async(pool)
+            else:
+                self._handle_pipelined(pool)
+        finally:
+            if self.pool is None:
+                pool.close()
 
-        pool = mp.Pool(1)
-        AS_set_directory, self.recursed_ASes = pool.apply(_subprocess_AS_set_resolving, (self.AS_set_list,))
+    def _create_AS_set_objects(self, AS_set_directory):
         for setname, children in AS_set_directory.iteritems():
             setObj = rpsl.AsSetObject(setname)
             setObj.AS_set_members.update(children['sets'])
-            setObj.ASN_members.update(children['asns'])
+            setObj.add_ASNs(children['asns'])
             self.AS_set_dir.append_AS_set_obj(setObj)
+        self.AS_set_dir.compute_closures()
 
-    def _handle_ASes(self):
-        """Spawns several processes (based on the available CPUs) to handle the
-        AS resolving and creates the necessary objects based on the results.
+    def _handle_pipelined(self, pool):
+        """Runs the AS set, AS and RS resolving at the same time on the
+        resolver pool (see ResolverPool.resolve_pipelined) and creates the
+        necessary objects based on the results as they arrive.
         """
-        # Gather all the ASNs seen through filter and recursive resolving.
-        all_ASNs = list((self.recursed_ASes | self.AS_list) - self.black_list)
-        all_ASNs_count = len(all_ASNs)
-        if all_ASNs_count < 1:
+        if not (self.AS_set_list or self.AS_list or self.RS_list):
             return
 
-        # We will devote all but one core to resolving since the main process
-        # will handle the objects' creation.
-        number_of_resolvers = mp.cpu_count() - 1
-        if number_of_resolvers < 1:
-            number_of_resolvers = 1
-
-        # The list of ASNs is going to be distributed almost equally to the
-        # available resolvers.
-        if all_ASNs_count >= number_of_resolvers:
-            slice_length = int(math.ceil(all_ASNs_count / float(number_of_resolvers)))
-        else:
-            number_of_resolvers = all_ASNs_count
-            slice_length = 1
-
-        result_q = SimpleQueue()  # NOTE: Only works with this queue.
-        processes = []
-        slice_start = 0
-        for i in xrange(number_of_resolvers):
-            ASN_batch = all_ASNs[slice_start:slice_start+slice_length]
-            processes.append(mp.Process(target=_subprocess_AS_resolving, args=(ASN_batch, result_q)).start())
-            slice_start += slice_length
-
         # PROGRESS START
         # Show progress while running.
         # Can be safely commented out until PROGRESS END.
@@ -127,73 +310,128 @@ class FilterResolver:
         # PROGRESS END
 
         done = 0
-        while done < all_ASNs_count:
-            try:
-                asn, routes = result_q.get()
-            except Empty:
-                # This should never be reached with this queue but left here
-                # just in case.
-                time.sleep(0.2)
+        for message in pool.resolve_pipelined(self.AS_set_list, self.AS_list,
+                                              self.RS_list, self.black_list):
+            if message[0] == 'AS_sets':
+                _, AS_set_directory, self.recursed_ASes = message
+                self._create_AS_set_objects(AS_set_directory)
+                continue
+            elif message[0] == 'RSes':
+                self._create_RS_objects(message[1])
                 continue
 
-            # If the AS has routes create the appropriate ASN object and add it
-            # to the data pool.
-            if routes is not None and (routes['ipv4'] or routes['ipv6']):
-                ASN_object = rpsl.ASObject(asn)
-                for prefix in routes['ipv4']:
-                    route_object = rpsl.RouteObject(prefix, asn)
-                    ASN_object.route_obj_dir.append_route_obj(route_object)
-                for prefix in routes['ipv6']:
-                    route6_object = rpsl.Route6Object(prefix, asn)
-                    ASN_object.route_obj_dir.append_route_obj(route6_object)
-                self.AS_dir.append_ASN_obj(ASN_object)
-            done += 1
+            for asn, packed_routes in message[1]:
+                self._create_AS_object(asn, packed_routes)
+            done += len(message[1])
 
         # PROGRESS START
         # Show progress while running.
         # Can be safely commented out until PROGRESS END.
-            aps_count += 1
+            aps_count += len(message[1])
             time_diff = time.time() - time_start
             if time_diff >= 1:
                 aps = aps_count / time_diff
                 aps_count = 0
                 time_start = time.time()
-            sys.stdout.write("{} of {} ASes | {:.0f} ASes/s          \r"
-                             .format(done, all_ASNs_count, aps))
+            sys.stdout.write("{} ASes | {:.0f} ASes/s | busy: {}          \r"
+                             .format(done, aps, _format_utilisation(pool)))
             sys.stdout.flush()
         print
+        print "Resolver utilisation: {}".format(_format_utilisation(pool))
         # PROGRESS END
 
-    def _handle_RSes(self):
-        """Spawns a process to handle the recursive RS resolving and creates the
-        necessary objects based on the results.
-
-        TODO: We can have ASes and AS sets as children so maybe run it before
-        the other resolving.
+    def _create_AS_object(self, asn, packed_routes):
+        """If the AS has routes create the appropriate ASN object and add it
+        to the data pool. The routes are kept packed (see routestore).
         """
-        if len(self.RS_list) < 1:
-            return
+        if packed_routes is not None and not routestore.is_empty(packed_routes):
+            self.AS_dir.append_ASN_obj(rpsl.ASObject(asn, packed_routes))
 
-        pool = mp.Pool(1)
-        RS_directory = pool.apply(_subprocess_RS_resolving, (self.RS_list,))
+    def _create_RS_objects(self, RS_directory):
         for setname, children in RS_directory.iteritems():
             route_set_obj = rpsl.RouteSetObject(setname)
             route_set_obj.RSes_dir.update(children['sets'])
-            for route in children['routes'].get('ipv4'):
-                route_object = rpsl.RouteObject(route, None)  # XXX Do we need origin?
-                route_set_obj.members.append_route_obj(route_object)
-            for route6 in children['routes'].get('ipv6'):
-                route6_object = rpsl.Route6Object(route6, None)  # XXX Do we need origin?
-                route_set_obj.mp_members.append_route_obj(route6_object)
+            # XXX Do we need origin?
+            route_set_obj.members.extend(children['routes'].get('ipv4'), 'ipv4')
+            route_set_obj.mp_members.extend(children['routes'].get('ipv6'), 'ipv6')
             self.RS_dir.append_route_set_obj(route_set_obj)
 
+    def _handle_all_async(self, pool):
+        """Resolves the AS sets, ASes and RSes from one gevent event loop in a
+        process of the resolver pool and creates the necessary objects based
+        on the results.
+        """
+        if not (self.AS_set_list or self.AS_list or self.RS_list):
+            return
+
+        AS_set_directory, self.recursed_ASes, AS_routes, RS_directory = pool.resolve_all_async(
+            self.AS_set_list, self.AS_list, self.RS_list, self.black_list, self.concurrency)
+
+        self._create_AS_set_objects(AS_set_directory)
+        for asn, packed_routes in AS_routes.iteritems():
+            self._create_AS_object(asn, packed_routes)
+        self._create_RS_objects(RS_directory)
+
+
+def _format_utilisation(pool):
+    """Returns the utilisation of every process of the pool, busiest first,
+    e.g. "98% 97% 40%".
+    """
+    return ' '.join('{:.0f}%'.format(100 * u)
+                    for u in sorted(pool.utilisation().itervalues(), reverse=True))
+
+
+# The communicator and the result queue of a ResolverPool process (see
+# _pool_worker_init), and its AS resolving threads (see _ASWorkers).
+_worker_comm = None
+_worker_result_q = None
+_worker_ASes = None
+
+# Whether the gevent monkey patching was applied to this process.
+_monkey_patched = False
+
+
+def _pool_worker_init(comm_factory, result_q):
+    """Prepares a ResolverPool process: patches it and creates the
+    communicator that it keeps for all its tasks. The communicator is closed
+    when the process stops.
+    """
+    global _worker_comm, _worker_result_q
+    _subprocess_init()
+    _worker_comm = comm_factory()
+    _worker_result_q = result_q
+    Finalize(None, _worker_comm.close, exitpriority=0)
+
+
+def _acquire_comm(comm_factory):
+    """Returns the communicator of this ResolverPool process, or a new one
+    outside of a pool.
+    """
+    if _worker_comm is not None:
+        return _worker_comm
+    return comm_factory()
+
+
+def _release_comm(comm):
+    """Closes a communicator returned by _acquire_comm, except for the one of
+    a ResolverPool process that is kept for the next task. That one is
+    closed (and its pending background refreshes waited for) when the
+    process exits.
+    """
+    if comm is not _worker_comm:
+        comm.close()
+
 
 def _subprocess_init():
-    """Tries to apply gevent monkey patching to the spawned process.
+    """Tries to apply gevent monkey patching to the spawned process, once.
 
     NOTE: The gevent monkey patching is taking place in the spawned process in
     order to not patch the main process' core modules where it is not needed.
     """
+    global _monkey_patched
+    if _monkey_patched:
+        return
+    _monkey_patched = True
 
     try:
         from gevent import monkey
@@ -205,7 +443,8 @@ def _subprocess_init():
                         " otherwise!")
 
 
-def _subprocess_AS_set_resolving(AS_set_list):
+def _subprocess_AS_set_resolving(AS_set_list, comm_factory=communicator.Communicator,
+                                 found_ASNs=None):
     """Resolves the given AS_set_list recursively.
 
     This function is going to be spawned as a process that in turn spawns
@@ -215,6 +454,11 @@ def _subprocess_AS_set_resolving(AS_set_list):
     ----------
     AS_set_list : set
         The AS sets to be resolved.
+    comm_factory : callable
+        Creates the communicator that is used for the DB requests.
+    found_ASNs : callable
+        Called (from the resolving threads) with the set of the ASNs that
+        were seen for the first time, as soon as an AS set is resolved.
 
     Returns
     -------
@@ -225,8 +469,9 @@ def _subprocess_AS_set_resolving(AS_set_list):
     """
     _subprocess_init()
 
-    comm = communicator.Communicator()
+    comm = _acquire_comm(comm_factory)
     q = Queue()
+    requeue = _Requeuer(q)
     recursed_sets = dict.fromkeys(AS_set_list, '')
     recursed_sets_lock = Lock()
     recursed_ASes = set()
@@ -254,10 +499,19 @@ def _subprocess_AS_set_resolving(AS_set_list):
 
             AS_sets, ASNs = '', ''
             try:
-                resp = comm.get_filter_set(setname)
-                if resp is None:
+                members = communicator.get_parsed(comm, 'AS_set_members', setname)
+                if members is None:
                     raise LookupError
-                AS_sets, ASNs = parsers.parse_AS_set_members(resp)
+                AS_sets, ASNs = members
+
+            except errors.TransientDBError:
+                if requeue(setname, current_set):
+                    q.task_done()
+                    continue
+                logging.error("{}: {}: Gave up on {} after {} re-queues"
+                              .format(mp.current_process().name,
+                                      threading.current_thread().name,
+                                      setname, max_requeues))
 
             except LookupError:
                 logging.error("{}: {}: No Object found for {}"
@@ -284,7 +538,10 @@ def _subprocess_AS_set_resolving(AS_set_list):
 
             # Update the seen ASes.
             with recursed_ASes_lock:
-                recursed_ASes.update(ASNs)
+                new_ASNs = set(ASNs) - recursed_ASes
+                recursed_ASes.update(new_ASNs)
+            if new_ASNs and found_ASNs is not None:
+                found_ASNs(new_ASNs)
 
             # Record this AS set's children.
             with AS_set_directory_lock:
@@ -308,11 +565,48 @@ def _subprocess_AS_set_resolving(AS_set_list):
     for t in threads:
         t.join()
     q.join()
+    _release_comm(comm)
 
     return AS_set_directory, recursed_ASes
 
 
-def _subprocess_AS_resolving(ASN_batch, result_q):
+# Returned by _resolve_AS_routes for an AS that was put back in the queue.
+_REQUEUED = object()
+
+
+def _resolve_AS_routes(comm, asn, requeue, item):
+    """Returns the routes of the AS, None if they could not be found or
+    _REQUEUED if the lookup was throttled and `item` was put back in the
+    queue (see _Requeuer).
+    """
+    try:
+        routes = communicator.get_parsed(comm, 'AS_routes', asn)
+        if routes is None:
+            raise LookupError
+    except errors.TransientDBError:
+        if requeue(asn, item):
+            return _REQUEUED
+        logging.error("{}: {}: Gave up on {} after {} re-queues"
+                      .format(mp.current_process().name,
+                              threading.current_thread().name,
+                              asn, max_requeues))
+        routes = None
+    except LookupError:
+        logging.warning("{}: {}: No Object found for {}"
+                        .format(mp.current_process().name,
+                                threading.current_thread().name,
+                                asn))
+        routes = None
+    except Exception as e:
+        logging.error("{}: {}: Failed to resolve DB object {}. {}"
+                      .format(mp.current_process().name,
+                              threading.current_thread().name,
+                              asn, e))
+        routes = None
+    return routes
+
+
+def _subprocess_AS_resolving(ASN_batch, result_q, comm_factory=communicator.Communicator):
     """Resolves the given ASN_batch and returns the results throught the
     result_q to the main process.
 
@@ -326,11 +620,14 @@ def _subprocess_AS_resolving(ASN_batch, result_q):
     result_q : mp.queues.SimpleQueue
         The queue through which the resolving results are communicated back
         to the main process.
+    comm_factory : callable
+        Creates the communicator that is used for the DB requests.
     """
     _subprocess_init()
 
-    comm = communicator.Communicator()
+    comm = _acquire_comm(comm_factory)
     q = Queue()
+    requeue = _Requeuer(q)
 
     def _threaded_resolve_AS():
         """Get an ASN from the queue, resolve it, return its routes to the
@@ -343,31 +640,23 @@ def _subprocess_AS_resolving(ASN_batch, result_q):
                 q.task_done()
                 break
 
-            try:
-                resp = comm.get_routes_by_autnum(current_AS, ipv6_enabled=True)
-                if resp is None:
-                    raise LookupError
-                routes = parsers.parse_AS_routes(resp)
-            except LookupError:
-                logging.warning("{}: {}: No Object found for {}"
-                                .format(mp.current_process().name,
-                                        threading.current_thread().name,
-                                        current_AS))
-                routes = None
-            except Exception as e:
-                logging.error("{}: {}: Failed to resolve DB object {}. {}"
-                              .format(mp.current_process().name,
-                                      threading.current_thread().name,
-                                      current_AS, e))
-                routes = None
-            result_q.put((current_AS, routes))
+            routes = _resolve_AS_routes(comm, current_AS, requeue, current_AS)
+            if routes is not _REQUEUED:
+                result_q.put((current_AS, routes))
             q.task_done()
 
+    # Communicators that can pipeline queries (e.g. the whois one) fetch the
+    # whole batch at once.
+    prefetch = getattr(comm, 'prefetch_routes', None)
+    if prefetch is not None:
+        prefetch(ASN_batch, ipv6_enabled=True)
+
     # Put the ASNs in the queue to be consumed by the threads.
     for AS in ASN_batch:
         q.put(AS)
 
-    threads = [Thread(target=_threaded_resolve_AS) for _ in xrange(threads_count)]
+    threads = [Thread(target=_threaded_resolve_AS)
+               for _ in xrange(max(min(threads_count, len(ASN_batch)), 1))]
     for t in threads:
         t.start()
     q.join()
@@ -378,9 +667,171 @@ def _subprocess_AS_resolving(ASN_batch, result_q):
         q.put('KILL')
     for t in threads:
         t.join()
+    _release_comm(comm)
+
 
+class _RoutesBatch(object):
+    """Collects the (asn, routes) results of a chunk of ASes with the routes
+    packed (see routestore.pack_routes), so that the results of the whole
+    chunk are sent to the main process in one message.
+    """
+
+    def __init__(self, size):
+        self.AS_routes = []
+        self.size = size
+        self.lock = Lock()
+
+    def put(self, item):
+        """Adds the result of an AS and returns whether the chunk is
+        complete.
+        """
+        asn, routes = item
+        if routes is not None:
+            routes = routestore.pack_routes(routes)
+        with self.lock:
+            self.AS_routes.append((asn, routes))
+            return len(self.AS_routes) == self.size
+
+
+class _ASWorkers(object):
+    """The threads of a ResolverPool process that resolve the routes of the
+    ASes, taking single ASNs from a queue of the process.
+
+    They outlive the tasks: a task queues its chunk of ASNs and returns once
+    the threads have taken all of them up, so that the process takes up the
+    next chunk while the slow ASes of the previous ones are still being
+    resolved. The results of a chunk are sent when its last AS is done,
+    along with the time since the last report that any of the threads was
+    busy (see ResolverPool.utilisation).
+    """
+
+    def __init__(self, comm):
+        self.comm = comm
+        self.q = Queue()
+        self.requeue = _Requeuer(self.q)
+        # The ASNs queued but not taken up yet, the threads resolving one
+        # and their busy time not reported yet.
+        self.queued = 0
+        self.active = 0
+        self.busy = 0.0
+        self.busy_since = None
+        self.cond = threading.Condition()
+        for i in xrange(threads_count):
+            t = Thread(target=self._run, name='AS-resolver-{}'.format(i))
+            t.daemon = True
+            t.start()
+
+    def resolve(self, ASN_batch):
+        """Queues the chunk of ASNs and waits until they are all taken up."""
+        # Communicators that can pipeline queries (e.g. the whois one) fetch
+        # the whole chunk at once.
+        prefetch = getattr(self.comm, 'prefetch_routes', None)
+        if prefetch is not None:
+            prefetch(ASN_batch, ipv6_enabled=True)
+
+        batch = _RoutesBatch(len(ASN_batch))
+        with self.cond:
+            self.queued += len(ASN_batch)
+        for asn in ASN_batch:
+            self.q.put((asn, batch))
+        with self.cond:
+            # A re-queued ASN may be taken up again before it is counted.
+            while self.queued > 0:
+                self.cond.wait()
+
+    def _take_busy(self):
+        """Returns the busy time not reported yet. Needs the cond."""
+        now = time.time()
+        busy = self.busy
+        if self.active:
+            busy += now - self.busy_since
+            self.busy_since = now
+        self.busy = 0.0
+        return busy
+
+    def _run(self):
+        while True:
+            item = self.q.get()
+            asn, batch = item
+            with self.cond:
+                self.queued -= 1
+                if not self.active:
+                    self.busy_since = time.time()
+                self.active += 1
+                self.cond.notify_all()
+
+            routes = None
+            try:
+                routes = _resolve_AS_routes(self.comm, asn, self.requeue, item)
+            finally:
+                with self.cond:
+                    if routes is _REQUEUED:
+                        self.queued += 1
+                    self.active -= 1
+                    if not self.active:
+                        self.busy += time.time() - self.busy_since
+                    self.cond.notify_all()
+            if routes is _REQUEUED:
+                continue
 
-def _subprocess_RS_resolving(RS_list):
+            if batch.put((asn, routes)):
+                with self.cond:
+                    busy = self._take_busy()
+                _worker_result_q.put(('routes', batch.AS_routes))
+                _worker_result_q.put(('busy', mp.current_process().name, busy))
+
+
+def _report_busy(start):
+    """Sends the time a task of a ResolverPool process took since `start`."""
+    _worker_result_q.put(('busy', mp.current_process().name, time.time() - start))
+
+
+def _pooled_AS_set_resolving(AS_set_list, comm_factory=communicator.Communicator):
+    """Runs _subprocess_AS_set_resolving in a ResolverPool process, streaming
+    the newly found ASNs and then the results through the queue of the pool.
+    """
+    def _found_ASNs(ASNs):
+        _worker_result_q.put(('ASNs', ASNs))
+
+    start = time.time()
+    try:
+        AS_set_directory, recursed_ASes = _subprocess_AS_set_resolving(
+            AS_set_list, comm_factory, _found_ASNs)
+    except Exception as e:
+        logging.error("{}: Failed to resolve the AS sets. {}"
+                      .format(mp.current_process().name, e))
+        AS_set_directory, recursed_ASes = dict(), set()
+    _worker_result_q.put(('AS_sets', AS_set_directory, recursed_ASes))
+    _report_busy(start)
+
+
+def _pooled_AS_resolving(ASN_batch, comm_factory=communicator.Communicator):
+    """Hands a chunk of ASes to the threads of a ResolverPool process (see
+    _ASWorkers), which send the results of the whole chunk through the
+    queue of the pool in one message.
+    """
+    global _worker_ASes
+    if _worker_ASes is None:
+        _worker_ASes = _ASWorkers(_acquire_comm(comm_factory))
+    _worker_ASes.resolve(ASN_batch)
+
+
+def _pooled_RS_resolving(RS_list, comm_factory=communicator.Communicator):
+    """Runs _subprocess_RS_resolving in a ResolverPool process, sending the
+    results through the queue of the pool.
+    """
+    start = time.time()
+    try:
+        RS_directory = _subprocess_RS_resolving(RS_list, comm_factory)
+    except Exception as e:
+        logging.error("{}: Failed to resolve the RSes. {}"
+                      .format(mp.current_process().name, e))
+        RS_directory = dict()
+    _worker_result_q.put(('RSes', RS_directory))
+    _report_busy(start)
+
+
+def _subprocess_RS_resolving(RS_list, comm_factory=communicator.Communicator):
     """Resolves the given RS_list recursively.
 
     This function is going to be spawned as a process that in turn spawns
@@ -390,6 +841,8 @@ def _subprocess_RS_resolving(RS_list):
     ----------
     RS_list : set
         The RSes to be resolved.
+    comm_factory : callable
+        Creates the communicator that is used for the DB requests.
 
     Returns
     -------
@@ -398,8 +851,9 @@ def _subprocess_RS_resolving(RS_list):
     """
     _subprocess_init()
 
-    comm = communicator.Communicator()
+    comm = _acquire_comm(comm_factory)
     q = Queue()
+    requeue = _Requeuer(q)
     recursed_sets = dict.fromkeys(RS_list, '')
     recursed_sets_lock = Lock()
     RS_directory = dict()
@@ -425,10 +879,19 @@ def _subprocess_RS_resolving(RS_list):
 
             RSes, routes = '', ''
             try:
-                resp = comm.get_filter_set(setname)
-                if resp is None:
+                members = communicator.get_parsed(comm, 'RS_members', setname)
+                if members is None:
                     raise LookupError
-                RSes, routes = parsers.parse_RS_members(resp)
+                RSes, routes = members
+
+            except errors.TransientDBError:
+                if requeue(setname, current_set):
+                    q.task_done()
+                    continue
+                logging.error("{}: {}: Gave up on {} after {} re-queues"
+                              .format(mp.current_process().name,
+                                      threading.current_thread().name,
+                                      setname, max_requeues))
 
             except LookupError:
                 logging.error("{}: {}: No Object found for {}"
@@ -477,5 +940,154 @@ def _subprocess_RS_resolving(RS_list):
     for t in threads:
         t.join()
     q.join()
+    _release_comm(comm)
 
     return RS_directory
+
+
+def _subprocess_async_resolving(AS_set_list, AS_list, RS_list, black_list,
+                                comm_factory=communicator.Communicator,
+                                concurrency=None):
+    """Resolves the AS sets (recursively), the ASes and the RSes (recursively)
+    from a single gevent event loop.
+
+    This function is going to be spawned as a process. Every lookup runs in
+    its own greenlet and the routes of an AS are requested as soon as the AS
+    is discovered, while the AsyncCommunicator bounds the requests that are
+    in flight.
+
+    Parameters
+    ----------
+    AS_set_list : set
+        The AS sets to be resolved.
+    AS_list : set
+        The ASNs present in the filters.
+    RS_list : set
+        The RSes to be resolved.
+    black_list : set
+        The ASNs whose routes are not going to be resolved.
+    comm_factory : callable
+        Creates the communicator that is used for the DB requests.
+    concurrency : int
+        The maximum number of requests in flight.
+
+    Returns
+    -------
+    AS_set_directory : dict
+        Contains information (children) for all the encountered AS sets.
+    recursed_ASes : set
+        The ASNs that were found through recursive resolving.
+    AS_routes : dict
+        The packed routes (see routestore.pack_routes) of every resolved ASN.
+    RS_directory : dict
+        Contains information (children) for all the encountered RSes.
+    """
+    _subprocess_init()
+
+    # Imported here since gevent is only required for this mode.
+    import gevent
+    import gevent.pool
+    import async_communicator
+
+    if not concurrency:
+        concurrency = async_communicator.AsyncCommunicator.DEFAULT_CONCURRENCY
+    comm = async_communicator.AsyncCommunicator(
+        functools.partial(_acquire_comm, comm_factory), concurrency)
+    group = gevent.pool.Group()
+
+    recursed_AS_sets = set(AS_set_list)
+    recursed_ASes = set()
+    AS_set_directory = dict()
+    requested_ASes = set()
+    AS_routes = dict()
+    recursed_RSes = set(RS_list)
+    RS_directory = dict()
+
+    def _fetch(request, *args, **kwargs):
+        """Sends the request through the AsyncCommunicator and waits for the
+        reply, trying again later if the lookup was throttled by the DB.
+        """
+        for attempt in xrange(1, max_requeues + 1):
+            try:
+                return request(*args, **kwargs).get()
+            except errors.TransientDBError:
+                gevent.sleep(ratelimit.backoff_delay(attempt))
+        return request(*args, **kwargs).get()
+
+    def _resolve_AS(asn):
+        try:
+            routes = _fetch(comm.get_parsed, 'AS_routes', asn)
+            if routes is None:
+                raise LookupError
+            AS_routes[asn] = routestore.pack_routes(routes)
+        except LookupError:
+            logging.warning("No Object found for {}".format(asn))
+        except Exception as e:
+            logging.error("Failed to resolve DB object {}. {}".format(asn, e))
+
+    def _request_AS(asn):
+        if asn not in requested_ASes and asn not in black_list:
+            requested_ASes.add(asn)
+            group.spawn(_resolve_AS, asn)
+
+    def _resolve_AS_set(setname, depth):
+        AS_sets, ASNs = set(), set()
+        try:
+            members = _fetch(comm.get_parsed, 'AS_set_members', setname)
+            if members is None:
+                raise LookupError
+            AS_sets, ASNs = members
+        except LookupError:
+            logging.error("No Object found for {}".format(setname))
+        except Exception as e:
+            logging.warning("Failed to resolve DB object {}. {}"
+                            .format(setname, e))
+
+        logging.debug("({})>Found {} ASNs and {} AS-SETs in {}"
+                      .format(depth, len(ASNs), len(AS_sets), setname))
+
+        for AS_set in AS_sets - recursed_AS_sets:
+            recursed_AS_sets.add(AS_set)
+            group.spawn(_resolve_AS_set, AS_set, depth + 1)
+
+        recursed_ASes.update(ASNs)
+        for asn in ASNs:
+            _request_AS(asn)
+
+        AS_set_directory[setname] = dict(sets=AS_sets, asns=ASNs)
+
+    def _resolve_RS(setname, depth):
+        RSes, routes = set(), {'ipv4': set(), 'ipv6': set()}
+        try:
+            members = _fetch(comm.get_parsed, 'RS_members', setname)
+            if members is None:
+                raise LookupError
+            RSes, routes = members
+        except LookupError:
+            logging.error("No Object found for {}".format(setname))
+        except Exception as e:
+            logging.warning("Failed to resolve DB object {}. {}"
+                            .format(setname, e))
+
+        logging.debug("({})>Found {} RSes and {} routes in {}"
+                      .format(depth, len(RSes),
+                              len(routes['ipv4']) + len(routes['ipv6']),
+                              setname))
+
+        for route_set in RSes - recursed_RSes:
+            recursed_RSes.add(route_set)
+            group.spawn(_resolve_RS, route_set, depth + 1)
+
+        RS_directory[setname] = dict(sets=RSes, routes=routes)
+
+    for AS_set in AS_set_list:
+        group.spawn(_resolve_AS_set, AS_set, 1)
+    for asn in AS_list:
+        _request_AS(asn)
+    for route_set in RS_list:
+        group.spawn(_resolve_RS, route_set, 1)
+
+    group.join()
+    _release_comm(comm.comm)
+
+    return AS_set_directory, recursed_ASes, AS_routes, RS_directory
@@ -1,7 +1,27 @@
+from collections import OrderedDict
+from contextlib import contextmanager
+try:
+    from cStringIO import StringIO
+except ImportError:
+    from StringIO import StringIO
+import errno
+import fcntl
+import gzip
+import json
+import marshal
+import mmap
 import os
+import re
+import sqlite3
+import tempfile
+import threading
 import time
 import logging
 import xxhash
+import zlib
+
+import counters
+import sqlite_pool
 
 
 # Metaclass to provide Singleton to RestCache
@@ -15,6 +35,433 @@ class SingletonRestCache(type):
         return cls._instances[cls]
 
 
+class MemoryLRU(object):
+    """Bounded in-process tier of the least recently used cache entries in
+    front of the backend. Its size is the total length of the cached bodies.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Returns (stored, body) of the entry or None."""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                # Re-inserted as the most recently used.
+                self._entries[key] = entry
+        return entry
+
+    def put(self, key, stored, body):
+        evicted = 0
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old[1])
+            if len(body) > self.max_bytes:
+                return
+            self._entries[key] = (stored, body)
+            self.size += len(body)
+            while self.size > self.max_bytes:
+                _, (_, old_body) = self._entries.popitem(last=False)
+                self.size -= len(old_body)
+                evicted += 1
+        if evicted:
+            counters.increment('memory_evictions', evicted)
+
+    def discard(self, key):
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old[1])
+
+
+class _ZlibReader(object):
+    """Read-only file-like object that decompresses a zlib stream while it is
+    read, without holding more than one chunk of it in memory.
+    """
+    CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self._decompressor = zlib.decompressobj()
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            data = self._decompressor.decompress(
+                self._decompressor.unconsumed_tail + self.fileobj.read())
+            return data + self._decompressor.flush()
+
+        chunks = []
+        while size > 0:
+            compressed = (self._decompressor.unconsumed_tail or
+                          self.fileobj.read(self.CHUNK_SIZE))
+            if not compressed:
+                chunks.append(self._decompressor.flush())
+                break
+            data = self._decompressor.decompress(compressed, size)
+            chunks.append(data)
+            size -= len(data)
+        return ''.join(chunks)
+
+    def close(self):
+        self.fileobj.close()
+
+
+class _GzipReader(gzip.GzipFile):
+    """gzip.GzipFile that also closes the file object it reads from."""
+
+    def __init__(self, fileobj):
+        gzip.GzipFile.__init__(self, fileobj=fileobj, mode='rb')
+
+    def close(self):
+        fileobj = self.fileobj
+        gzip.GzipFile.close(self)
+        if fileobj is not None:
+            fileobj.close()
+
+
+class _MappedFile(mmap.mmap):
+    """Read-only memory map whose read() also takes no size, like a file's."""
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = len(self) - self.tell()
+        return mmap.mmap.read(self, size)
+
+
+def _gzip_compress(body):
+    buf = StringIO()
+    with gzip.GzipFile(fileobj=buf, mode='wb', mtime=0) as _f:
+        _f.write(body)
+    return buf.getvalue()
+
+
+class FileCacheBackend(object):
+    """Stores every cache entry in its own file, named after the entry's key.
+    The response validators and the codec of the body, if any, are kept in
+    a header line in front of the body and the file's mtime is the time the
+    entry was stored.
+
+    The files are spread over sub-folders named after the last characters of
+    the keys' hash, so that no folder grows to millions of entries.
+    """
+
+    # Prefix of the files that are being written.
+    TMP_PREFIX = ".tmp-"
+
+    # Length of the names of the sub-folders (256 of them).
+    SHARD_LENGTH = 2
+
+    # The names of the entries, i.e. [<prefix>_]<xxhash64 hex digest>.
+    KEY_PATTERN = re.compile(r'^(?:[\w.-]+_)?[0-9a-f]{16}$')
+
+    def __init__(self, folder):
+        self.folder = folder
+        self._migrate_flat_entries()
+
+    def _shard(self, key):
+        return self.folder + key[-self.SHARD_LENGTH:] + "/"
+
+    def _path(self, key):
+        return self._shard(key) + key
+
+    def _migrate_flat_entries(self):
+        """Moves the entries of older versions, stored directly in the cache
+        folder, to their sub-folders.
+        """
+        for name in os.listdir(self.folder):
+            if not self.KEY_PATTERN.match(name):
+                continue
+            try:
+                if not os.path.isdir(self._shard(name)):
+                    os.makedirs(self._shard(name), mode=0o755)
+                os.rename(self.folder + name, self._path(name))
+            except OSError:
+                # Moved by another process meanwhile.
+                continue
+
+    def _files(self):
+        """Yields the paths of all the files (entries and temporary ones)."""
+        for shard in os.listdir(self.folder):
+            if len(shard) != self.SHARD_LENGTH or not os.path.isdir(self.folder + shard):
+                continue
+            try:
+                names = os.listdir(self.folder + shard)
+            except OSError:
+                continue
+            for name in names:
+                yield self.folder + shard + "/" + name
+
+    def open_entry(self, key):
+        """Returns (stored, validators, codec, stream) of the entry or None.
+        The stream is positioned at the (encoded) body and has to be closed by
+        the caller.
+
+        The stream is a read-only memory map of the file, so the parsers read
+        the body straight from the page cache. This is safe since entries are
+        never modified in place (see write).
+        """
+        try:
+            _f = open(self._path(key), "rb")
+        except IOError as e:
+            if e.errno == errno.ENOENT:
+                return None
+            raise
+        try:
+            st = os.fstat(_f.fileno())
+            if st.st_size == 0:
+                # Empty files can not be mapped.
+                return st.st_mtime, {}, RestCache.IDENTITY, _f
+            stream = _MappedFile(_f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (IOError, OSError, ValueError, mmap.error):
+            _f.close()
+            raise
+        # The map holds its own reference to the file.
+        _f.close()
+        try:
+            if stream[:len(RestCache.HEADER_MAGIC)] != RestCache.HEADER_MAGIC:
+                return st.st_mtime, {}, RestCache.IDENTITY, stream
+            header = json.loads(stream.readline()[len(RestCache.HEADER_MAGIC):])
+        except ValueError:
+            stream.close()
+            raise
+        codec = str(header.pop('codec', RestCache.IDENTITY))
+        validators = dict((str(k), str(v)) for k, v in header.iteritems())
+        return st.st_mtime, validators, codec, stream
+
+    def write(self, key, body, validators=None, obj_type='', codec=None):
+        """Writes the entry to a temporary file that is renamed over the old
+        one, so that concurrent readers see either of them in whole and never
+        a missing or half-written entry.
+        """
+        header = dict(validators or {})
+        if codec and codec != RestCache.IDENTITY:
+            header['codec'] = codec
+        try:
+            fd, tmp_name = tempfile.mkstemp(dir=self._shard(key), prefix=self.TMP_PREFIX)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            try:
+                os.makedirs(self._shard(key), mode=0o755)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+            fd, tmp_name = tempfile.mkstemp(dir=self._shard(key), prefix=self.TMP_PREFIX)
+        try:
+            os.fchmod(fd, 0o644)
+            with os.fdopen(fd, "wb") as _f:
+                if header:
+                    _f.write(RestCache.HEADER_MAGIC + json.dumps(header) + "\n")
+                _f.write(body)
+            os.rename(tmp_name, self._path(key))
+        except:
+            try:
+                os.remove(tmp_name)
+            except OSError:
+                pass
+            raise
+
+    def stored(self, key):
+        """Returns when the entry was stored or None."""
+        try:
+            return os.path.getmtime(self._path(key))
+        except OSError:
+            return None
+
+    def touch(self, key):
+        os.utime(self._path(key), None)
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+
+    def sweep(self, oldest, keep_validated=True, oldest_by_type=None,
+              oldest_by_type_prefix=None):
+        """Removes the entries stored before `oldest` (epoch seconds), or
+        before the time given for their type in oldest_by_type (or else for
+        the beginning of their type in oldest_by_type_prefix), except for
+        the ones that carry validators if keep_validated is set. Returns how
+        many were removed.
+        """
+        oldest_by_type = oldest_by_type or {}
+        oldest_by_type_prefix = oldest_by_type_prefix or {}
+        removed = 0
+        for path in self._files():
+            key = os.path.basename(path)
+            obj_type = ''
+            if not key.startswith(self.TMP_PREFIX) and '_' in key:
+                obj_type = key.rsplit('_', 1)[0]
+            type_oldest = oldest_by_type.get(obj_type)
+            if type_oldest is None:
+                type_oldest = oldest
+                for type_prefix, prefix_oldest in oldest_by_type_prefix.iteritems():
+                    if obj_type.startswith(type_prefix):
+                        type_oldest = prefix_oldest
+                        break
+            try:
+                if os.path.getmtime(path) > type_oldest:
+                    continue
+                # Old temporary files are left over by crashed writers.
+                if keep_validated and not key.startswith(self.TMP_PREFIX):
+                    entry = self.open_entry(key)
+                    if entry is None:
+                        continue
+                    entry[3].close()
+                    if entry[1]:
+                        continue
+                os.remove(path)
+                removed += 1
+            except (IOError, OSError):
+                # Removed or replaced by another process meanwhile.
+                continue
+        return removed
+
+    def evict(self, max_bytes):
+        """Removes the least recently stored entries until the entries take
+        at most max_bytes. Returns how many were removed.
+        """
+        entries = []
+        size = 0
+        for path in self._files():
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+            size += st.st_size
+        removed = 0
+        entries.sort()
+        for _, entry_size, path in entries:
+            if size <= max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            size -= entry_size
+            removed += 1
+        return removed
+
+
+class SQLiteCacheBackend(object):
+    """Stores the cache entries in a single SQLite database in WAL mode, so
+    that the resolving processes read concurrently while one of them writes.
+    The entries are indexed by key and by the time they were stored.
+    """
+    DB_FILENAME = "cache.sqlite"
+
+    def __init__(self, folder):
+        self.db_path = folder + self.DB_FILENAME
+        self._pool = sqlite_pool.ConnectionPool(
+            self.db_path, pragmas=("PRAGMA synchronous = NORMAL",))
+        with self._pool.connection() as conn:
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS entries ("
+                         "key TEXT PRIMARY KEY, type TEXT, stored REAL, "
+                         "validators TEXT, codec TEXT, body BLOB)")
+            conn.execute("CREATE INDEX IF NOT EXISTS entries_stored "
+                         "ON entries (stored)")
+            conn.commit()
+
+    def open_entry(self, key):
+        """Returns (stored, validators, codec, stream) of the entry or None.
+        The stream holds the (encoded) body.
+        """
+        with self._pool.connection() as conn:
+            row = conn.execute("SELECT stored, validators, codec, body FROM entries "
+                               "WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        stored, validators, codec, body = row
+        if validators:
+            validators = dict((str(k), str(v)) for k, v in
+                              json.loads(validators).iteritems())
+        # cStringIO reads the buffer of the row without copying it.
+        return stored, validators or {}, codec or RestCache.IDENTITY, StringIO(body)
+
+    def write(self, key, body, validators=None, obj_type='', codec=None):
+        row = (key, obj_type, time.time(), json.dumps(validators) if validators else None,
+               codec, sqlite3.Binary(body))
+        with self._pool.connection() as conn:
+            conn.execute("INSERT OR REPLACE INTO entries VALUES "
+                         "(?, ?, ?, ?, ?, ?)", row)
+            conn.commit()
+
+    def stored(self, key):
+        """Returns when the entry was stored or None."""
+        with self._pool.connection() as conn:
+            row = conn.execute("SELECT stored FROM entries WHERE key = ?",
+                               (key,)).fetchone()
+        return row[0] if row else None
+
+    def touch(self, key):
+        with self._pool.connection() as conn:
+            conn.execute("UPDATE entries SET stored = ? WHERE key = ?",
+                         (time.time(), key))
+            conn.commit()
+
+    def delete(self, key):
+        with self._pool.connection() as conn:
+            conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+            conn.commit()
+
+    def sweep(self, oldest, keep_validated=True, oldest_by_type=None,
+              oldest_by_type_prefix=None):
+        """Removes the entries stored before `oldest` (epoch seconds), or
+        before the time given for their type in oldest_by_type (or else for
+        the beginning of their type in oldest_by_type_prefix), except for
+        the ones that carry validators if keep_validated is set. Returns how
+        many were removed.
+        """
+        params = []
+        if oldest_by_type or oldest_by_type_prefix:
+            query = "DELETE FROM entries WHERE stored <= CASE"
+            for obj_type, type_oldest in (oldest_by_type or {}).iteritems():
+                query += " WHEN type = ? THEN ?"
+                params.extend((obj_type, type_oldest))
+            for type_prefix, prefix_oldest in (oldest_by_type_prefix or {}).iteritems():
+                query += " WHEN substr(type, 1, ?) = ? THEN ?"
+                params.extend((len(type_prefix), type_prefix, prefix_oldest))
+            query += " ELSE ? END"
+        else:
+            query = "DELETE FROM entries WHERE stored <= ?"
+        params.append(oldest)
+        if keep_validated:
+            query += " AND validators IS NULL"
+        with self._pool.connection() as conn:
+            removed = conn.execute(query, params).rowcount
+            conn.commit()
+        return removed
+
+    def evict(self, max_bytes):
+        """Removes the least recently stored entries until their bodies take
+        at most max_bytes. Returns how many were removed.
+        """
+        with self._pool.connection() as conn:
+            size = conn.execute("SELECT TOTAL(LENGTH(body)) FROM entries").fetchone()[0]
+            if size <= max_bytes:
+                return 0
+            keys = []
+            rows = conn.execute("SELECT key, LENGTH(body) FROM entries "
+                                "ORDER BY stored").fetchall()
+            for key, entry_size in rows:
+                if size <= max_bytes:
+                    break
+                keys.append((key,))
+                size -= entry_size or 0
+            conn.executemany("DELETE FROM entries WHERE key = ?", keys)
+            conn.commit()
+        return len(keys)
+
+
 class RestCache(object):
     __metaclass__ = SingletonRestCache
     # Default folder where to store cached entries
@@ -24,10 +471,146 @@ class RestCache(object):
     # How old, in seconds, cached files are to be used?
     DEFAULT_EXPIRE_AFTER = 86400
 
-    def __init__(self, timeout=DEFAULT_EXPIRE_AFTER, caching_folder=CACHED_ROOT_FOLDER):
+    # Marks the header line that holds the response validators of an entry.
+    HEADER_MAGIC = "#libParser-cache "
+
+    # Sub-folder holding the per-URL lock files.
+    LOCKS_FOLDER = "locks/"
+
+    # Bounds (in seconds) of the polling interval while waiting for a lock.
+    LOCK_POLL_MIN = 0.005
+    LOCK_POLL_MAX = 0.1
+
+    # The storage backends of the cached entries.
+    BACKENDS = {
+        'file': FileCacheBackend,
+        'sqlite': SQLiteCacheBackend,
+    }
+    DEFAULT_BACKEND = 'file'
+
+    # Size (bytes) of the in-memory tier in front of the backend; 0 disables
+    # it.
+    DEFAULT_MEMORY_BYTES = 64 * 1024 * 1024
+
+    # The codecs the entries can be stored with. The codec is recorded per
+    # entry, so changing it leaves the existing entries readable.
+    IDENTITY = 'identity'
+    CODECS = {
+        IDENTITY: (lambda body: body, lambda stream: stream),
+        'zlib': (zlib.compress, _ZlibReader),
+        'gzip': (_gzip_compress, _GzipReader),
+    }
+    DEFAULT_CODEC = 'zlib'
+
+    # Negative entries (see update_negative) expire sooner than the others.
+    DEFAULT_NEGATIVE_EXPIRE_AFTER = 4 * 3600
+    NEGATIVE_PREFIX = "negative-"
+
+    # Prefix of the keys of the parsed elements (see update_parsed).
+    PARSED_PREFIX = "parsed-"
+
+    # Seconds between two garbage collections (see collect) of a size bounded
+    # cache, by any of the processes using it.
+    GC_INTERVAL = 600
+    # Marks the last garbage collection by its mtime.
+    GC_STAMP = ".gc-stamp"
+    # A garbage collection evicts down to this fraction of the maximum size,
+    # so that it is not needed again right away.
+    GC_LOW_WATERMARK = 0.9
+
+    # The errors a backend raises when an entry can not be read or stored.
+    BACKEND_ERRORS = (IOError, OSError, ValueError, mmap.error, sqlite3.Error, zlib.error)
+
+    def __init__(self, timeout=DEFAULT_EXPIRE_AFTER, caching_folder=CACHED_ROOT_FOLDER,
+                 backend=DEFAULT_BACKEND, memory_bytes=DEFAULT_MEMORY_BYTES,
+                 codec=DEFAULT_CODEC, negative_timeout=DEFAULT_NEGATIVE_EXPIRE_AFTER,
+                 timeouts=None, keep_expired=False, max_bytes=None):
         self.cached_main_folder = os.path.expanduser(caching_folder)
+        self.locks_folder = self.cached_main_folder + self.LOCKS_FOLDER
         self.setup_cache_folders()
-        self.oldest_mtime = round(time.time() - timeout)
+        self.timeout = timeout
+        # Per prefix (object type) timeouts that override the one above.
+        # Table scheme: {prefix: timeout}
+        self.timeouts = dict(timeouts or {})
+        self.negative_timeout = negative_timeout
+        self._update_cutoffs()
+        # Expired entries are kept (until they are stored again or swept) so
+        # that they can still be served with get_expired.
+        self.keep_expired = keep_expired
+        self.backend = self.BACKENDS[backend](self.cached_main_folder)
+        self.memory = MemoryLRU(memory_bytes) if memory_bytes else None
+        self.codec = codec
+
+        # When a maximum size (bytes) is given, a background thread of every
+        # process that stores entries collects the garbage periodically.
+        self.max_bytes = max_bytes
+        self._collector_pid = None
+        self._collector_lock = threading.Lock()
+        self._start_collector()
+
+    def _update_cutoffs(self):
+        """Sets the times before which the elements expire from the timeouts,
+        as of now. It is done again on every sweep, so that a long running
+        process keeps expiring the elements it stored itself.
+        """
+        now = time.time()
+        self.oldest_mtime = round(now - self.timeout)
+        # Table scheme: {prefix: oldest_mtime}
+        self.oldest_mtimes = dict((prefix, round(now - prefix_timeout))
+                                  for prefix, prefix_timeout in self.timeouts.iteritems())
+        self.oldest_negative_mtime = round(now - self.negative_timeout)
+
+    def _start_collector(self):
+        """Starts the garbage collecting thread of this process, if needed.
+        Threads do not survive a fork, so the forked processes start their
+        own.
+        """
+        if not self.max_bytes or self._collector_pid == os.getpid():
+            return
+        with self._collector_lock:
+            if self._collector_pid == os.getpid():
+                return
+            self._collector_pid = os.getpid()
+            collector = threading.Thread(target=self._collect_periodically,
+                                         name='cache-collector')
+            collector.daemon = True
+            collector.start()
+
+    def _collect_periodically(self):
+        while True:
+            try:
+                self.collect()
+            except Exception as e:
+                logging.error('RestCache: Garbage collection failed: {}'.format(e))
+            time.sleep(self.GC_INTERVAL)
+
+    def collect(self, force=False):
+        """Removes the expired entries and, if the cache is larger than its
+        maximum size, the least recently stored ones. It is skipped if another
+        process is collecting or did so in the last GC_INTERVAL seconds,
+        unless `force` is set. Returns how many entries were removed.
+        """
+        stamp = self.cached_main_folder + self.GC_STAMP
+        with self._key_lock(self.GC_STAMP, blocking=False) as locked:
+            if not locked:
+                return 0
+            try:
+                last = os.path.getmtime(stamp)
+            except OSError:
+                last = 0
+            if not force and last > time.time() - self.GC_INTERVAL:
+                return 0
+            with open(stamp, 'w'):
+                pass
+
+            removed = self.sweep()
+            if self.max_bytes:
+                evicted = self.backend.evict(int(self.max_bytes * self.GC_LOW_WATERMARK))
+                if evicted:
+                    counters.increment('cache_evictions', evicted)
+                removed += evicted
+        logging.debug('RestCache: Garbage collection removed {} entries'.format(removed))
+        return removed
 
     @staticmethod
     def __make_hash(value, prefix=''):
@@ -37,49 +620,337 @@ class RestCache(object):
             prefix += '_'
         return prefix + _hash
 
+    def _oldest_mtime(self, prefix):
+        """Returns the time before which the elements of the prefix expire."""
+        return self.oldest_mtimes.get(prefix, self.oldest_mtime)
+
+    def _encode(self, body):
+        return self.CODECS[self.codec][0](body)
+
+    def _open(self, key):
+        """Returns (stored, validators, stream) of the entry, where the stream
+        decodes the body while it is read, or None.
+        """
+        entry = self.backend.open_entry(key)
+        if entry is None:
+            return None
+        stored, validators, codec, stream = entry
+        try:
+            return stored, validators, self.CODECS[codec][1](stream)
+        except KeyError:
+            stream.close()
+            raise ValueError("Unknown codec {}".format(codec))
+
+    def _read(self, key):
+        """Returns (stored, validators, body) of the entry or None."""
+        entry = self._open(key)
+        if entry is None:
+            return None
+        stored, validators, stream = entry
+        try:
+            return stored, validators, stream.read()
+        finally:
+            stream.close()
+
+    def _memory_get(self, key, prefix):
+        """Returns the fresh body of the entry from the in-memory tier or
+        None.
+        """
+        if self.memory is None:
+            return None
+        entry = self.memory.get(key)
+        if entry is not None and entry[0] > self._oldest_mtime(prefix):
+            counters.increment('memory_hits')
+            return entry[1]
+        counters.increment('memory_misses')
+        if entry is not None:
+            self.memory.discard(key)
+        return None
+
+    def _open_fresh(self, key, url, prefix):
+        """Returns (stored, stream) of the entry if it is fresh, or None."""
+        entry = self._open(key)
+        if entry is None:
+            return None
+        stored, validators, stream = entry
+        oldest = self._oldest_mtime(prefix)
+        if stored <= oldest:
+            # cached data is too old. Remove it unless it can be revalidated
+            # (see get_stale) or served while expired (see get_expired).
+            stream.close()
+            if not validators and not self.keep_expired:
+                self._delete_expired(key, oldest)
+            return None
+        logging.debug('RestCase: Reading entry {} for url {}'.format(key, url))
+        return stored, stream
+
+    def _delete_expired(self, key, oldest):
+        """Deletes the entry if it is (still) stored before `oldest`. It is
+        left alone while the key's lock is held, since the holder is refilling
+        it (see key_lock) and a deletion could remove the new entry.
+        """
+        with self._key_lock(key, blocking=False) as locked:
+            if not locked:
+                return
+            stored = self.backend.stored(key)
+            if stored is not None and stored <= oldest:
+                self.backend.delete(key)
+
     def get_or(self, url, prefix='', default=''):
         """Returns cached element designated by URL hash, or contents of 'default' parameter"""
         _reply = default
-        _f = None
-        filename = self.cached_main_folder + self.__make_hash(url, prefix)
+        key = self.__make_hash(url, prefix)
+
+        body = self._memory_get(key, prefix)
+        if body is not None:
+            return body
 
         try:
-            if os.path.exists(filename):
-                if os.path.getmtime(filename) <= self.oldest_mtime:
-                    # cached data is too old: remove and return default response
-                    os.remove(filename)
-                else:
-                    logging.debug('RestCase.get_or: Reading file {} for url {}'.format(filename, url))
-                    _f = open(filename, "r")
-                    ll = _f.readlines()
-                    _reply = "".join(ll)
-        except IOError as (_, strerror):
-            logging.error('RestCache.get_or: Error reading file {} for {}: {}'.format(filename, url, strerror))
+            entry = self._open_fresh(key, url, prefix)
+            if entry is not None:
+                stored, stream = entry
+                try:
+                    _reply = stream.read()
+                finally:
+                    stream.close()
+                if self.memory is not None:
+                    self.memory.put(key, stored, _reply)
+        except self.BACKEND_ERRORS as e:
+            logging.error('RestCache.get_or: Error reading entry {} for {}: {}'.format(key, url, e))
             _reply = default
-        finally:
-            if _f is not None:
-                        _f.close()
 
         return _reply
 
-    def update(self, url, value, prefix=''):
-        """Updates/creates cache file designated by URL hash with the contents of 'value'"""
-        _success = True
-        filename = self.cached_main_folder + self.__make_hash(url, prefix)
-        if os.path.exists(filename):
-            os.remove(filename)
-        _f = None
-        try:
-            _f = open(filename, "w")
-            _f.write(value)
-        except IOError as (_, strerror):
-            logging.error('RestCache.update: Error updating file {} for {}: {}'.format(filename, url, strerror))
-            _success = False
-        finally:
-            if _f is not None:
-                _f.close()
+    def get_stream(self, url, prefix=''):
+        """Like get_or, but returns the fresh cached element as a file-like
+        object that decodes it while it is read (e.g. by a parser), so that
+        the whole body is never built in memory. Returns None if there is no
+        such element. The caller closes the stream.
+        """
+        key = self.__make_hash(url, prefix)
+
+        body = self._memory_get(key, prefix)
+        if body is not None:
+            return StringIO(body)
 
-        return _success
+        try:
+            entry = self._open_fresh(key, url, prefix)
+        except self.BACKEND_ERRORS as e:
+            logging.error('RestCache.get_stream: Error reading entry {} for {}: {}'.format(key, url, e))
+            return None
+        if entry is None:
+            return None
+        return entry[1]
+
+    def get_stale(self, url, prefix=''):
+        """Returns (body, validators) of the cached element designated by URL
+        hash when it carries response validators (ETag/Last-Modified), even
+        if it has expired. Returns None otherwise.
+        """
+        try:
+            entry = self._read(self.__make_hash(url, prefix))
+        except self.BACKEND_ERRORS:
+            return None
+        if entry is None or not entry[1]:
+            return None
+        return entry[2], entry[1]
+
+    def get_expired(self, url, prefix=''):
+        """Returns the cached element designated by URL hash regardless of
+        its age, or None. Expired elements are only kept around for this when
+        the cache was created with keep_expired (or if they carry validators).
+        """
+        try:
+            entry = self._read(self.__make_hash(url, prefix))
+        except self.BACKEND_ERRORS as e:
+            logging.error('RestCache.get_expired: Error reading entry for {}: {}'.format(url, e))
+            return None
+        if entry is None:
+            return None
+        return entry[2]
+
+    def touch(self, url, prefix=''):
+        """Marks the cached element designated by URL hash as fresh again,
+        e.g. after the server replied that it was not modified.
+        """
+        key = self.__make_hash(url, prefix)
+        if self.memory is not None:
+            self.memory.discard(key)
+        try:
+            self.backend.touch(key)
+            return True
+        except self.BACKEND_ERRORS as e:
+            logging.error('RestCache.touch: Error touching entry {} for {}: {}'.format(key, url, e))
+            return False
+
+    def update(self, url, value, prefix='', validators=None):
+        """Updates/creates cache entry designated by URL hash with the contents of 'value'.
+        The response validators (ETag/Last-Modified), if any, are stored along
+        with the contents.
+        """
+        self._start_collector()
+        key = self.__make_hash(url, prefix)
+        try:
+            self.backend.write(key, self._encode(value), validators, prefix, self.codec)
+        except self.BACKEND_ERRORS as e:
+            logging.error('RestCache.update: Error updating entry {} for {}: {}'.format(key, url, e))
+            if self.memory is not None:
+                self.memory.discard(key)
+            return False
+        if self.memory is not None:
+            self.memory.put(key, time.time(), value)
+        self._discard_negative(url, prefix)
+        return True
+
+    def is_negative(self, url, prefix=''):
+        """Returns True if the element designated by URL hash was recently
+        found not to exist (see update_negative).
+        """
+        try:
+            stored = self.backend.stored(self.__make_hash(url, self.NEGATIVE_PREFIX + prefix))
+        except self.BACKEND_ERRORS:
+            return False
+        return stored is not None and stored > self.oldest_negative_mtime
+
+    def update_negative(self, url, prefix=''):
+        """Records that the element designated by URL hash does not exist
+        (e.g. the DB replied 404). It is remembered for the negative timeout,
+        which is shorter than the one of the stored elements, or until the
+        element is stored. A (stale) stored element is removed.
+        """
+        key = self.__make_hash(url, self.NEGATIVE_PREFIX + prefix)
+        stored_key = self.__make_hash(url, prefix)
+        if self.memory is not None:
+            self.memory.discard(stored_key)
+        try:
+            self.backend.delete(stored_key)
+            self.backend.write(key, '', None, self.NEGATIVE_PREFIX + prefix)
+        except self.BACKEND_ERRORS as e:
+            logging.error('RestCache.update_negative: Error updating entry {} for {}: {}'.format(key, url, e))
+            return False
+        return True
+
+    def _discard_negative(self, url, prefix):
+        negative_key = self.__make_hash(url, self.NEGATIVE_PREFIX + prefix)
+        try:
+            # Most updates have no negative entry to replace.
+            if self.backend.stored(negative_key) is not None:
+                self.backend.delete(negative_key)
+        except self.BACKEND_ERRORS as e:
+            logging.error('RestCache: Error removing the negative entry for {}: {}'.format(url, e))
+
+    def _stored_with_validators(self, url, prefix):
+        """Returns (stored, validators) of the cached element designated by
+        URL hash or None.
+        """
+        entry = self.backend.open_entry(self.__make_hash(url, prefix))
+        if entry is None:
+            return None
+        entry[3].close()
+        return entry[0], entry[1]
+
+    def get_parsed(self, url, prefix, kind):
+        """Returns the parsed form (see update_parsed) of the cached element
+        designated by URL hash, or None. It is only used while the element it
+        was parsed from is fresh and, if the element carries validators, still
+        has the validators it was parsed with (so it outlives a revalidation
+        that found the element not modified), or else has not been stored
+        again since.
+        """
+        parsed_key = self.__make_hash(url, self.PARSED_PREFIX + kind)
+        try:
+            entry = self._read(parsed_key)
+            if entry is None:
+                return None
+            source = self._stored_with_validators(url, prefix)
+            if source is None or source[0] <= self._oldest_mtime(prefix):
+                return None
+            if source[1]:
+                if entry[1] != source[1]:
+                    return None
+            elif source[0] > entry[0]:
+                return None
+            return marshal.loads(entry[2])
+        except self.BACKEND_ERRORS + (EOFError, ValueError, TypeError) as e:
+            logging.error('RestCache.get_parsed: Error reading entry {} for {}: {}'.format(parsed_key, url, e))
+            return None
+
+    def update_parsed(self, url, prefix, kind, value):
+        """Stores the parsed form of the cached element designated by URL hash
+        (e.g. the route sets returned by a parser), so that it does not have
+        to be parsed again. `kind` tells apart the parsers of the same element.
+        The value is serialised with marshal, hence it may only consist of
+        built-in types. It is stored with the validators of the element.
+        """
+        parsed_key = self.__make_hash(url, self.PARSED_PREFIX + kind)
+        try:
+            source = self._stored_with_validators(url, prefix)
+            self.backend.write(parsed_key, marshal.dumps(value),
+                               source[1] if source is not None else None,
+                               self.PARSED_PREFIX + kind)
+        except self.BACKEND_ERRORS as e:
+            logging.error('RestCache.update_parsed: Error updating entry {} for {}: {}'.format(parsed_key, url, e))
+            return False
+        return True
+
+    def sweep(self, everything=False):
+        """Removes the expired entries. The ones that can be revalidated are
+        kept unless `everything` is set. Returns how many were removed.
+        """
+        self._update_cutoffs()
+        return self.backend.sweep(
+            self.oldest_mtime, keep_validated=not everything,
+            oldest_by_type=self.oldest_mtimes,
+            oldest_by_type_prefix={self.NEGATIVE_PREFIX: self.oldest_negative_mtime})
+
+    def key_lock(self, url, prefix=''):
+        """Exclusive, cross-process lock on the cached element designated by
+        URL hash. Used to let only one process fill a given element.
+
+        The lock is an flock() on a lock file that is polled (instead of
+        blocking) so that gevent patched processes keep serving their other
+        greenlets while waiting. The holder removes the lock file on release,
+        hence a waiter that locked an already removed file tries again.
+        Readers do not take it; the backends replace entries atomically.
+        """
+        return self._key_lock(self.__make_hash(url, prefix))
+
+    @contextmanager
+    def _key_lock(self, key, blocking=True):
+        """Yields whether the lock was acquired, which is always the case
+        unless `blocking` is False and the lock is held (by anyone, including
+        the caller).
+        """
+        filename = self.locks_folder + key
+        poll = self.LOCK_POLL_MIN
+        while True:
+            fd = os.open(filename, os.O_CREAT | os.O_RDWR, 0o644)
+            while True:
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    break
+                except IOError as e:
+                    if e.errno not in (errno.EAGAIN, errno.EACCES):
+                        os.close(fd)
+                        raise
+                    if not blocking:
+                        os.close(fd)
+                        yield False
+                        return
+                    time.sleep(poll)
+                    poll = min(poll * 2, self.LOCK_POLL_MAX)
+            try:
+                if os.fstat(fd).st_ino == os.stat(filename).st_ino:
+                    break
+            except OSError:
+                pass
+            os.close(fd)
+
+        try:
+            yield True
+        finally:
+            os.unlink(filename)
+            os.close(fd)
 
     def setup_cache_folders(self):
         """Check if folders exist and create otherwise"""
@@ -93,4 +964,24 @@ class RestCache(object):
                 os.makedirs(path, mode=0o755)
 
         create_if_not_there(self.cached_main_folder)
+        create_if_not_there(self.locks_folder)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Removes the expired cache entries.")
+    parser.add_argument('-f', '--folder', default=RestCache.CACHED_ROOT_FOLDER)
+    parser.add_argument('-b', '--backend', choices=sorted(RestCache.BACKENDS),
+                        default=RestCache.DEFAULT_BACKEND)
+    parser.add_argument('--all', action="store_true",
+                        help="Also remove the expired entries that could be revalidated.")
+    parser.add_argument('--max-size', type=int, metavar='MB',
+                        help="Also remove the least recently stored entries until the cache "
+                             "takes at most MB.")
+    args = parser.parse_args()
 
+    cache = RestCache(caching_folder=args.folder, backend=args.backend)
+    print "Removed {} expired entries.".format(cache.sweep(everything=args.all))
+    if args.max_size is not None:
+        print "Evicted {} entries.".format(cache.backend.evict(args.max_size * 1024 * 1024))
@@ -0,0 +1,231 @@
+"""Compact encoding of the routes (prefixes) of an AS or a route set: packed
+integer arrays of the networks and prefix lengths per AFI instead of one
+Python object per prefix. It is used to send the routes from the resolver
+processes to the main process and to keep them there (see CompactRouteStore).
+"""
+from array import array
+from bisect import bisect_left
+from itertools import izip
+import socket
+import struct
+
+AFIS = ('ipv4', 'ipv6')
+
+
+def _parse_v4(prefix):
+    """Returns (network, length) of an IPv4 prefix, or None if it is not in
+    the plain form that _format_v4 gives back.
+    """
+    try:
+        address, length = prefix.split('/')
+        network = struct.unpack('!I', socket.inet_aton(address))[0]
+        length = int(length)
+    except (ValueError, socket.error, struct.error):
+        return None
+    if not 0 <= length <= 32 or _format_v4(network, length) != prefix:
+        return None
+    return network, length
+
+
+def _format_v4(network, length):
+    return '{}/{}'.format(socket.inet_ntoa(struct.pack('!I', network)), length)
+
+
+def _parse_v6(prefix):
+    """Returns (words, length) of an IPv6 prefix, where words are the four
+    32-bit words of the network, or None if it is not in the canonical form
+    that _format_v6 gives back.
+    """
+    try:
+        address, length = prefix.split('/')
+        words = struct.unpack('!4I', socket.inet_pton(socket.AF_INET6, address))
+        length = int(length)
+    except (ValueError, socket.error, struct.error):
+        return None
+    if not 0 <= length <= 128 or _format_v6(words, length) != prefix:
+        return None
+    return words, length
+
+
+def _format_v6(words, length):
+    return '{}/{}'.format(socket.inet_ntop(socket.AF_INET6, struct.pack('!4I', *words)),
+                          length)
+
+
+class CompactRouteStore(object):
+    """The unique IPv4 and IPv6 prefixes of an AS or a route set.
+
+    The IPv4 networks are kept in an array of unsigned 32-bit integers and
+    the IPv6 ones in an array of four such words per network, with the
+    prefix lengths in byte arrays next to them. Prefixes that would not be
+    given back exactly as they are (e.g. with range operators) are kept as
+    strings. The prefixes are sorted and the duplicates dropped the first
+    time they are read after a change.
+    """
+    __slots__ = ('_networks4', '_lengths4', '_words6', '_lengths6',
+                 '_other4', '_other6', '_compacted')
+
+    def __init__(self, packed=None):
+        self._networks4, self._lengths4 = array('I'), array('B')
+        self._words6, self._lengths6 = array('I'), array('B')
+        self._other4, self._other6 = [], []
+        self._compacted = True
+        if packed is not None:
+            self.extend_packed(packed)
+
+    def add(self, prefix, afi):
+        if afi == 'ipv6':
+            parsed = _parse_v6(prefix)
+            if parsed is None:
+                self._other6.append(prefix)
+            else:
+                self._words6.extend(parsed[0])
+                self._lengths6.append(parsed[1])
+        else:
+            parsed = _parse_v4(prefix)
+            if parsed is None:
+                self._other4.append(prefix)
+            else:
+                self._networks4.append(parsed[0])
+                self._lengths4.append(parsed[1])
+        self._compacted = False
+
+    def extend(self, prefixes, afi):
+        for prefix in prefixes:
+            self.add(prefix, afi)
+
+    def extend_packed(self, packed):
+        """Adds packed routes (see pack_routes) without decoding them."""
+        networks4, lengths4, words6, lengths6, other4, other6 = packed
+        self._networks4.fromstring(networks4)
+        self._lengths4.fromstring(lengths4)
+        self._words6.fromstring(words6)
+        self._lengths6.fromstring(lengths6)
+        self._other4.extend(other4)
+        self._other6.extend(other6)
+        self._compacted = False
+
+    def pack(self):
+        """Returns the routes encoded as by pack_routes."""
+        self._compact()
+        return (self._networks4.tostring(), self._lengths4.tostring(),
+                self._words6.tostring(), self._lengths6.tostring(),
+                tuple(self._other4), tuple(self._other6))
+
+    def _compact(self):
+        if self._compacted:
+            return
+        routes4 = sorted(set(izip(self._networks4, self._lengths4)))
+        self._networks4 = array('I', (network for network, _ in routes4))
+        self._lengths4 = array('B', (length for _, length in routes4))
+
+        words6 = self._words6
+        routes6 = sorted(set(tuple(words6[4 * i:4 * i + 4]) + (length,)
+                             for i, length in enumerate(self._lengths6)))
+        self._words6 = array('I', (word for route in routes6 for word in route[:4]))
+        self._lengths6 = array('B', (route[4] for route in routes6))
+
+        self._other4 = sorted(set(self._other4))
+        self._other6 = sorted(set(self._other6))
+        self._compacted = True
+
+    def prefixes(self, afi):
+        """Yields the prefixes of the AFI ('ipv4' or 'ipv6') as strings."""
+        self._compact()
+        if afi == 'ipv6':
+            words6 = self._words6
+            for i, length in enumerate(self._lengths6):
+                yield _format_v6(words6[4 * i:4 * i + 4], length)
+            for prefix in self._other6:
+                yield prefix
+        else:
+            for network, length in izip(self._networks4, self._lengths4):
+                yield _format_v4(network, length)
+            for prefix in self._other4:
+                yield prefix
+
+    def count(self, afi):
+        self._compact()
+        if afi == 'ipv6':
+            return len(self._lengths6) + len(self._other6)
+        return len(self._lengths4) + len(self._other4)
+
+    def _index6(self, words, length):
+        """Returns the index of the first IPv6 prefix that does not sort
+        before the given one (a binary search over the sorted arrays).
+        """
+        key = tuple(words) + (length,)
+        words6, lengths6 = self._words6, self._lengths6
+        low, high = 0, len(lengths6)
+        while low < high:
+            middle = (low + high) // 2
+            if tuple(words6[4 * middle:4 * middle + 4]) + (lengths6[middle],) < key:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def contains(self, prefix, afi):
+        """Returns whether the prefix is one of the AFI's, without going
+        through all of them.
+        """
+        self._compact()
+        if afi == 'ipv6':
+            parsed = _parse_v6(prefix)
+            other = self._other6
+        else:
+            parsed = _parse_v4(prefix)
+            other = self._other4
+        if parsed is None:
+            i = bisect_left(other, prefix)
+            return i < len(other) and other[i] == prefix
+
+        if afi == 'ipv6':
+            i = self._index6(*parsed)
+            return (i < len(self._lengths6) and self._lengths6[i] == parsed[1] and
+                    tuple(self._words6[4 * i:4 * i + 4]) == parsed[0])
+
+        network, length = parsed
+        i = bisect_left(self._networks4, network)
+        while i < len(self._networks4) and self._networks4[i] == network:
+            if self._lengths4[i] == length:
+                return True
+            i += 1
+        return False
+
+    def __contains__(self, prefix):
+        return self.contains(prefix, 'ipv6' if ':' in prefix else 'ipv4')
+
+    def __len__(self):
+        return self.count('ipv4') + self.count('ipv6')
+
+
+def pack_routes(routes):
+    """Encodes the routes of a parser ({'ipv4': set, 'ipv6': set}) into a
+    tuple of byte strings (cheap to pickle) and returns it:
+
+    (IPv4 networks, IPv4 lengths, IPv6 network words, IPv6 lengths,
+     other IPv4 prefixes, other IPv6 prefixes)
+
+    The networks are unsigned 32-bit integers (four of them per IPv6
+    network) and the lengths bytes. Prefixes that would not be given back
+    exactly as they are (e.g. with range operators) are kept as strings.
+    """
+    store = CompactRouteStore()
+    for afi in AFIS:
+        store.extend(routes[afi], afi)
+    return store.pack()
+
+
+def iter_routes(packed):
+    """Yields the IPv4 and then the IPv6 prefixes of packed routes as
+    (afi, prefix) tuples, where afi is 'ipv4' or 'ipv6'.
+    """
+    store = CompactRouteStore(packed)
+    for afi in AFIS:
+        for prefix in store.prefixes(afi):
+            yield afi, prefix
+
+
+def is_empty(packed):
+    return not (packed[1] or packed[3] or packed[4] or packed[5])
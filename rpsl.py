@@ -1,6 +1,8 @@
 import re
 
+import asregistry
 import errors
+import routestore
 
 
 # TODO Recheck all regex later for fine tuning.
@@ -135,23 +137,75 @@ class Route6Object(RouteObject):
     ROUTE_ATTR = 'ROUTE6'
 
 
-class RouteObjectDir(object):
-    """A Class for storing Route objects in a dictionary."""
+class RouteTable(object):
+    """Read-only view of the routes of one AFI of a RouteObjectDir, keyed
+    on the prefix. Its values are route objects created on the fly.
+    """
+
+    def __init__(self, route_dir, afi, route_class):
+        self.route_dir = route_dir
+        self.afi = afi
+        self.route_class = route_class
+
+    def __len__(self):
+        return self.route_dir.count(self.afi)
+
+    def __iter__(self):
+        return self.route_dir.prefixes(self.afi)
+
+    def __contains__(self, prefix):
+        return self.route_dir.contains(prefix, self.afi)
+
+    iterkeys = __iter__
+
+    def itervalues(self):
+        for prefix in self:
+            yield self.route_class(prefix, self.route_dir.origin)
+
+    def iteritems(self):
+        for route_object in self.itervalues():
+            yield route_object.route, route_object
+
+    def keys(self):
+        return list(self.iterkeys())
+
+    def values(self):
+        return list(self.itervalues())
+
+    def items(self):
+        return list(self.iteritems())
+
+
+class RouteObjectDir(routestore.CompactRouteStore):
+    """A Class for storing the routes of an AS or a route set compactly (see
+    routestore.CompactRouteStore). The routes of every AFI are read through
+    the origin_table and origin_table_v6 views.
+    """
     # Thanks to Tomas.
+    __slots__ = ('ipv6', 'origin')
 
     # TODO: Extend with a RouteTree to store routes in a tree based structure
     # and provide functions for fast lookup.
-    def __init__(self, ipv6=True):
-        self.origin_table = {}
+    def __init__(self, ipv6=True, origin=None):
+        routestore.CompactRouteStore.__init__(self)
         self.ipv6 = ipv6
-        if self.ipv6:
-            self.origin_table_v6 = {}
+        self.origin = origin
+
+    @property
+    def origin_table(self):
+        return RouteTable(self, 'ipv4', RouteObject)
+
+    @property
+    def origin_table_v6(self):
+        if not self.ipv6:
+            raise AttributeError('origin_table_v6')
+        return RouteTable(self, 'ipv6', Route6Object)
 
     def append_route_obj(self, route_object):
-        if route_object.ROUTE_ATTR == 'ROUTE6':
-            self.origin_table_v6[route_object.get_key] = route_object
+        if route_object.ROUTE_ATTR == 'ROUTE6' and self.ipv6:
+            self.add(route_object.get_key(), 'ipv6')
         elif route_object.ROUTE_ATTR == 'ROUTE':
-            self.origin_table[route_object.get_key] = route_object
+            self.add(route_object.get_key(), 'ipv4')
         else:
             raise errors.AppendFilterError('Failed to insert Route object '
                                            'to dictionary')
@@ -160,9 +214,11 @@ class RouteObjectDir(object):
 class ASObject(RpslObject):
     """Internal representation of an AS."""
 
-    def __init__(self, asnum):
+    def __init__(self, asnum, packed_routes=None):
         self.origin = asnum
-        self.route_obj_dir = RouteObjectDir()
+        self.route_obj_dir = RouteObjectDir(origin=asnum)
+        if packed_routes is not None:
+            self.route_obj_dir.extend_packed(packed_routes)
 
     def get_key(self):
         return self.origin
@@ -171,7 +227,7 @@ class ASObject(RpslObject):
         return str(self.origin)
 
     def append_route_obj(self, route_object):
-        self.route_obj_dir[route_object.get_key()] = route_object
+        self.route_obj_dir.append_route_obj(route_object)
 
 
 class AsnObjectDir:
@@ -214,9 +270,18 @@ class AsSetObject(RpslObject):
     def __init__(self, setname):
         RpslObject.__init__(self)
         self.as_set = setname
-        self.ASN_members = set()
+        # The bitset of the member ASNs (see asregistry).
+        self.ASN_bits = 0
         self.AS_set_members = set()
 
+    @property
+    def ASN_members(self):
+        """The member ASNs, read-only (see add_ASNs)."""
+        return frozenset(asregistry.registry.ASNs(self.ASN_bits))
+
+    def add_ASNs(self, ASNs):
+        self.ASN_bits |= asregistry.registry.bitset(ASNs)
+
     def get_key(self):
         return self.as_set
 
@@ -227,9 +292,86 @@ class AsSetObject(RpslObject):
 class AsSetObjectDir:
     def __init__(self):
         self.data = {}
+        # The bitset of all the ASNs of every AS set, including the ones of
+        # its nested AS sets (see compute_closures).
+        # Table scheme: {AS set: bitset}
+        self.ASN_closures = {}
 
     def append_AS_set_obj(self, AS_set_object):
         self.data[AS_set_object.get_key()] = AS_set_object
+        self.ASN_closures = {}
+
+    def _children(self, setname):
+        return [child for child in self.data[setname].AS_set_members
+                if child in self.data]
+
+    def compute_closures(self):
+        """Computes the ASN closure of every AS set once.
+
+        The graph of the nested AS sets is condensed into its strongly
+        connected components (Tarjan's algorithm, without recursion, since
+        the nesting can be deep). The components come out after all the
+        ones they refer to, so the closure of a component is the union of
+        the ASNs of its AS sets and of the closures it refers to. All the
+        AS sets of a cycle share the same closure.
+        """
+        closures = {}
+        index = {}
+        lowlink = {}
+        stack = []
+        on_stack = set()
+
+        for root in self.data:
+            if root in index:
+                continue
+            index[root] = lowlink[root] = len(index)
+            stack.append(root)
+            on_stack.add(root)
+            work = [(root, iter(self._children(root)))]
+
+            while work:
+                setname, children = work[-1]
+                for child in children:
+                    if child not in index:
+                        index[child] = lowlink[child] = len(index)
+                        stack.append(child)
+                        on_stack.add(child)
+                        work.append((child, iter(self._children(child))))
+                        break
+                    elif child in on_stack:
+                        lowlink[setname] = min(lowlink[setname], index[child])
+                else:
+                    work.pop()
+                    if work:
+                        parent = work[-1][0]
+                        lowlink[parent] = min(lowlink[parent], lowlink[setname])
+                    if lowlink[setname] != index[setname]:
+                        continue
+
+                    # setname is the root of a component.
+                    component = set()
+                    while setname not in component:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        component.add(member)
+                    bits = 0
+                    for member in component:
+                        bits |= self.data[member].ASN_bits
+                        for child in self._children(member):
+                            if child not in component:
+                                bits |= closures[child]
+                    for member in component:
+                        closures[member] = bits
+
+        self.ASN_closures = closures
+
+    def ASN_closure(self, setname):
+        """Returns the bitset of all the ASNs of the AS set and its nested AS
+        sets (see asregistry).
+        """
+        if setname not in self.ASN_closures and setname in self.data:
+            self.compute_closures()
+        return self.ASN_closures.get(setname, 0)
 
 
 class PeeringSetObject(RpslObject):
@@ -0,0 +1,49 @@
+from contextlib import contextmanager
+import os
+import sqlite3
+import threading
+
+
+class ConnectionPool(object):
+    """Hands out SQLite connections to one caller (thread or greenlet) at a
+    time. SQLite connections can not be used concurrently nor survive a
+    fork, so the idle ones are kept in a per-process free list.
+    """
+
+    # Seconds a connection waits for a lock held by another process.
+    BUSY_TIMEOUT = 30
+
+    def __init__(self, db_path, pragmas=()):
+        self.db_path = db_path
+        # Statements (e.g. "PRAGMA synchronous = NORMAL") run on every new
+        # connection.
+        self.pragmas = pragmas
+        self._free_connections = []
+        self._free_connections_lock = threading.Lock()
+        self._pid = os.getpid()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=self.BUSY_TIMEOUT,
+                               check_same_thread=False)
+        conn.text_factory = str
+        for pragma in self.pragmas:
+            conn.execute(pragma)
+        return conn
+
+    @contextmanager
+    def connection(self):
+        with self._free_connections_lock:
+            if self._pid != os.getpid():
+                self._free_connections = []
+                self._pid = os.getpid()
+            if self._free_connections:
+                conn = self._free_connections.pop()
+            else:
+                conn = None
+        if conn is None:
+            conn = self._connect()
+        try:
+            yield conn
+        finally:
+            with self._free_connections_lock:
+                self._free_connections.append(conn)
@@ -0,0 +1,31 @@
+import unittest
+
+import asregistry
+
+
+class ASRegistryTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = asregistry.ASRegistry()
+
+    def test_ids_are_dense(self):
+        self.assertEqual([self.registry.id_of(asn) for asn in ('AS3', 'AS1', 'AS3', 'AS2')],
+                         [0, 1, 0, 2])
+        self.assertEqual(len(self.registry), 3)
+        self.assertEqual(self.registry.ASN_of(1), 'AS1')
+
+    def test_bitsets(self):
+        ASNs = ['AS{}'.format(64500 + i) for i in xrange(100)]
+        bits = self.registry.bitset(ASNs)
+        self.assertEqual(list(self.registry.ASNs(bits)), ASNs)
+        self.assertEqual(asregistry.count(bits), 100)
+
+        black = self.registry.bitset(['AS64500', 'AS64599', 'AS1'])
+        self.assertEqual(list(self.registry.ASNs(bits & ~black)), ASNs[1:-1])
+        self.assertEqual(list(self.registry.ASNs(black & ~bits)), ['AS1'])
+        self.assertEqual(self.registry.bitset([]), 0)
+        self.assertEqual(list(self.registry.ASNs(0)), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,333 @@
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+import async_communicator
+import communicator
+import counters
+import errors
+import mirror
+import ratelimit
+import rest_cache
+
+
+class FakeResponse(object):
+    def __init__(self, status_code, content='', headers=None):
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers or {}
+
+
+class FakeSession(object):
+    """Stands in for requests.Session and serves canned replies."""
+
+    def __init__(self, replies, delay=0):
+        self.replies = replies
+        self.delay = delay
+        self.requested = []
+        self.request_headers = []
+        self.lock = threading.Lock()
+
+    def get(self, url, headers=None, **kwargs):
+        with self.lock:
+            self.requested.append(url)
+            self.request_headers.append(headers or {})
+            reply = self.replies.get(url, FakeResponse(404))
+            # A list of replies is served in order, repeating the last one.
+            if isinstance(reply, list):
+                reply = reply.pop(0) if len(reply) > 1 else reply[0]
+        time.sleep(self.delay)
+        return reply
+
+    def close(self):
+        pass
+
+
+class CommunicatorTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.saved_backoff_delay = ratelimit.backoff_delay
+        ratelimit.backoff_delay = lambda attempt: 0
+        self.folder = tempfile.mkdtemp() + '/'
+        rest_cache.SingletonRestCache._instances.clear()
+        self.saved_folder = communicator.Communicator.CACHING_ROOT_FOLDER
+        communicator.Communicator.CACHING_ROOT_FOLDER = self.folder
+        self.comm = communicator.Communicator()
+        self.comm.rate_limiter = ratelimit.TokenBucket(rate=1000)
+        counters.reset()
+
+    def tearDown(self):
+        ratelimit.backoff_delay = self.saved_backoff_delay
+        communicator.Communicator.CACHING_ROOT_FOLDER = self.saved_folder
+        rest_cache.SingletonRestCache._instances.clear()
+        shutil.rmtree(self.folder)
+
+    def serve(self, replies, delay=0):
+        self.comm.session = FakeSession(replies, delay)
+        return self.comm.session
+
+    def filter_set_url(self, value):
+        return self.comm._search_URL_builder(value, None, (), self.comm.flags)
+
+
+class CoalescingTestCase(CommunicatorTestCase):
+
+    def test_concurrent_requests_are_coalesced(self):
+        url = self.filter_set_url('AS-FOO')
+        session = self.serve({url: FakeResponse(200, '<xml/>')}, delay=0.2)
+        replies = []
+        threads = [threading.Thread(
+            target=lambda: replies.append(self.comm.get_filter_set('AS-FOO')))
+            for _ in range(5)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(session.requested, [url])
+        self.assertEqual(replies, ['<xml/>'] * 5)
+
+    def test_reply_is_cached(self):
+        url = self.filter_set_url('AS-FOO')
+        session = self.serve({url: FakeResponse(200, '<xml/>')})
+        self.comm.get_filter_set('AS-FOO')
+        self.assertEqual(self.comm.get_filter_set('AS-FOO'), '<xml/>')
+        self.assertEqual(len(session.requested), 1)
+
+    def test_key_lock_is_exclusive(self):
+        cache = self.comm.cache
+        events = []
+
+        def _hold():
+            with cache.key_lock('url', 'prefix'):
+                events.append('start')
+                time.sleep(0.1)
+                events.append('end')
+
+        threads = [threading.Thread(target=_hold) for _ in range(3)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(events, ['start', 'end'] * 3)
+
+
+class BackoffTestCase(CommunicatorTestCase):
+
+    def test_query_limit_is_retried(self):
+        url = self.filter_set_url('AS-FOO')
+        session = self.serve({url: [FakeResponse(403), FakeResponse(500),
+                                    FakeResponse(200, '<xml/>')]})
+        self.assertEqual(self.comm.get_filter_set('AS-FOO'), '<xml/>')
+        self.assertEqual(len(session.requested), 3)
+
+    def test_exhausted_retries_raise_transient_error(self):
+        url = self.filter_set_url('AS-FOO')
+        session = self.serve({url: FakeResponse(403)})
+        self.assertRaises(errors.TransientDBError,
+                          self.comm.get_filter_set, 'AS-FOO')
+        self.assertEqual(len(session.requested),
+                         self.comm.MAX_BACKOFF_RETRIES + 1)
+
+    def test_not_found_is_not_retried(self):
+        session = self.serve({})
+        self.assertIsNone(self.comm.get_filter_set('AS-FOO'))
+        self.assertEqual(len(session.requested), 1)
+
+
+class RevalidationTestCase(CommunicatorTestCase):
+
+    def expire_cache(self):
+        self.comm.cache.oldest_mtime = time.time() + 1
+
+    def test_not_modified_reply_refreshes_entry(self):
+        url = self.filter_set_url('AS-FOO')
+        session = self.serve({url: [
+            FakeResponse(200, '<xml/>', {'etag': '"v1"'}),
+            FakeResponse(304)]})
+        self.comm.get_filter_set('AS-FOO')
+        self.expire_cache()
+
+        self.assertEqual(self.comm.get_filter_set('AS-FOO'), '<xml/>')
+        self.assertEqual(session.request_headers[1],
+                         {'If-None-Match': '"v1"'})
+        self.assertEqual(counters.get('revalidations'), 1)
+        self.assertEqual(counters.get('downloads'), 1)
+
+    def test_modified_reply_replaces_entry(self):
+        url = self.filter_set_url('AS-FOO')
+        self.serve({url: [
+            FakeResponse(200, '<old/>', {'last-modified': 'yesterday'}),
+            FakeResponse(200, '<new/>', {'last-modified': 'today'})]})
+        self.comm.get_filter_set('AS-FOO')
+        self.expire_cache()
+
+        self.assertEqual(self.comm.get_filter_set('AS-FOO'), '<new/>')
+        self.assertEqual(self.comm.cache.get_stale(url, 'filterset'),
+                         ('<new/>', {'last-modified': 'today'}))
+        self.assertEqual(counters.get('refetches'), 1)
+
+    def test_entry_without_validators_is_refetched(self):
+        url = self.filter_set_url('AS-FOO')
+        session = self.serve({url: FakeResponse(200, '<xml/>')})
+        self.comm.get_filter_set('AS-FOO')
+        self.expire_cache()
+
+        self.comm.get_filter_set('AS-FOO')
+        self.assertEqual(session.request_headers[1], {})
+
+
+class NegativeCacheTestCase(CommunicatorTestCase):
+
+    def test_not_found_is_not_requested_again(self):
+        session = self.serve({})
+        self.assertIsNone(self.comm.get_filter_set('AS-FOO'))
+        self.assertIsNone(self.comm.get_filter_set('AS-FOO'))
+        self.assertIsNone(self.comm.get_parsed('AS_set_members', 'AS-FOO'))
+        self.assertEqual(len(session.requested), 1)
+        self.assertEqual(counters.get('not_found'), 1)
+        self.assertEqual(counters.get('negative_hits'), 2)
+
+    def test_negative_entry_expires(self):
+        session = self.serve({})
+        self.comm.get_filter_set('AS-FOO')
+        self.comm.cache.oldest_negative_mtime = time.time() + 1
+        self.comm.get_filter_set('AS-FOO')
+        self.assertEqual(len(session.requested), 2)
+
+    def test_stored_reply_replaces_negative_entry(self):
+        url = self.filter_set_url('AS-FOO')
+        self.serve({})
+        self.comm.get_filter_set('AS-FOO')
+        self.comm.cache.update(url, '<xml/>', 'filterset')
+        self.assertFalse(self.comm.cache.is_negative(url, 'filterset'))
+        self.assertEqual(self.comm.get_filter_set('AS-FOO'), '<xml/>')
+
+
+class StaleWhileRevalidateTestCase(CommunicatorTestCase):
+
+    def setUp(self):
+        super(StaleWhileRevalidateTestCase, self).setUp()
+        rest_cache.SingletonRestCache._instances.clear()
+        self.comm = communicator.Communicator(stale_while_revalidate=True)
+        self.comm.rate_limiter = ratelimit.TokenBucket(rate=1000)
+        self.url = self.filter_set_url('AS-FOO')
+        self.comm.cache.update(self.url, '<old/>', 'filterset')
+        self.comm.cache.oldest_mtime = time.time() + 1
+
+    def test_expired_reply_is_served_and_refreshed(self):
+        session = self.serve({self.url: FakeResponse(200, '<new/>')}, delay=0.1)
+        self.assertEqual(self.comm.get_filter_set('AS-FOO'), '<old/>')
+        self.assertEqual(self.comm.get_filter_set('AS-FOO'), '<old/>')
+        self.comm.close()
+        self.assertEqual(len(session.requested), 1)
+        self.assertEqual(counters.get('stale_hits'), 2)
+
+        self.comm.cache.oldest_mtime = time.time() - 60
+        self.assertEqual(self.comm.get_filter_set('AS-FOO'), '<new/>')
+
+    def test_refreshes_run_on_several_threads(self):
+        urls = [self.filter_set_url('AS-FOO{}'.format(i)) for i in xrange(3)]
+        for url in urls:
+            self.comm.cache.update(url, '<old/>', 'filterset')
+        self.serve(dict((url, FakeResponse(200, '<new/>')) for url in urls), delay=0.1)
+        for i in xrange(3):
+            self.assertEqual(self.comm.get_filter_set('AS-FOO{}'.format(i)), '<old/>')
+        self.assertEqual(len(self.comm._refreshers), 3)
+        self.comm.close()
+
+    def test_close_without_waiting_for_refreshes(self):
+        self.comm.refresh_on_close = False
+        self.serve({self.url: FakeResponse(200, '<new/>')}, delay=0.2)
+        self.assertEqual(self.comm.get_filter_set('AS-FOO'), '<old/>')
+        self.comm.close()
+        self.assertEqual(self.comm._refresh_q.unfinished_tasks, 1)
+        self.comm.wait_for_refreshes()
+
+    def test_reply_that_is_no_longer_found_is_dropped(self):
+        self.serve({})
+        self.assertEqual(self.comm.get_filter_set('AS-FOO'), '<old/>')
+        self.comm.close()
+        self.assertIsNone(self.comm.get_filter_set('AS-FOO'))
+        self.assertEqual(counters.get('negative_hits'), 1)
+
+
+class ParsedCacheTestCase(CommunicatorTestCase):
+
+    def reply(self, *members):
+        return mirror.build_search_reply(
+            [[('as-set', 'AS-FOO')] + [('members', m) for m in members]])
+
+    def test_warm_lookup_skips_the_reply(self):
+        url = self.filter_set_url('AS-FOO')
+        session = self.serve({url: FakeResponse(200, self.reply('AS1', 'AS-BAR'))})
+        expected = (set(['AS-BAR']), set(['AS1']))
+        self.assertEqual(self.comm.get_parsed('AS_set_members', 'AS-FOO'), expected)
+        self.assertEqual(self.comm.get_parsed('AS_set_members', 'AS-FOO'), expected)
+        self.assertEqual(len(session.requested), 1)
+        self.assertEqual(counters.get('parsed_hits'), 1)
+        self.assertEqual(counters.get('cache_hits'), 0)
+
+    def test_stored_again_reply_is_parsed_again(self):
+        url = self.filter_set_url('AS-FOO')
+        self.serve({url: FakeResponse(200, self.reply('AS1'))})
+        self.comm.get_parsed('AS_set_members', 'AS-FOO')
+        time.sleep(0.01)
+        self.comm.cache.update(url, self.reply('AS2'), 'filterset')
+
+        self.assertEqual(self.comm.get_parsed('AS_set_members', 'AS-FOO'),
+                         (set(), set(['AS2'])))
+        self.assertEqual(counters.get('parsed_hits'), 0)
+
+    def expire_cache(self):
+        """Expires the stored replies, but not the ones stored (or touched)
+        from now on, allowing for the coarser clock of the file times.
+        """
+        time.sleep(0.05)
+        self.comm.cache.oldest_mtime = time.time()
+        time.sleep(0.05)
+
+    def test_not_modified_reply_is_not_parsed_again(self):
+        url = self.filter_set_url('AS-FOO')
+        session = self.serve({url: [
+            FakeResponse(200, self.reply('AS1'), {'etag': '"v1"'}),
+            FakeResponse(304),
+            FakeResponse(200, self.reply('AS2'), {'etag': '"v2"'})]})
+        self.comm.get_parsed('AS_set_members', 'AS-FOO')
+        self.expire_cache()
+
+        expected = (set(), set(['AS1']))
+        self.assertEqual(self.comm.get_parsed('AS_set_members', 'AS-FOO'), expected)
+        self.assertEqual(self.comm.get_parsed('AS_set_members', 'AS-FOO'), expected)
+        self.assertEqual(counters.get('revalidations'), 1)
+        self.assertEqual(counters.get('parsed_hits'), 2)
+        self.assertEqual(len(session.requested), 2)
+
+        self.expire_cache()
+        self.assertEqual(self.comm.get_parsed('AS_set_members', 'AS-FOO'),
+                         (set(), set(['AS2'])))
+        self.assertEqual(counters.get('parsed_hits'), 2)
+
+    def test_not_found(self):
+        self.serve({})
+        self.assertIsNone(self.comm.get_parsed('AS_routes', 'AS1'))
+
+
+class AsyncCommunicatorTestCase(CommunicatorTestCase):
+
+    def test_connection_pool_is_mounted_once(self):
+        url = self.comm.ripe_db_url
+        async_communicator.AsyncCommunicator(lambda: self.comm, 10)
+        adapter = self.comm.session.get_adapter(url)
+        self.assertEqual(adapter._pool_maxsize, 10)
+        async_communicator.AsyncCommunicator(lambda: self.comm, 10)
+        self.assertIs(self.comm.session.get_adapter(url), adapter)
+        async_communicator.AsyncCommunicator(lambda: self.comm, 20)
+        self.assertEqual(self.comm.session.get_adapter(url)._pool_maxsize, 20)
+
+
+if __name__ == '__main__':
+    unittest.main()
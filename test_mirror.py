@@ -0,0 +1,103 @@
+import gzip
+import os
+import shutil
+import tempfile
+import unittest
+
+import mirror
+import parsers
+
+
+DUMP = """\
+# RIPE database dump
+%
+% The objects are in RPSL format.
+
+aut-num:        AS64500
+as-name:        EXAMPLE-AS
+import:         from AS64501 accept AS-CUSTOMERS
+export:         to AS64501
+                announce AS64500   # continuation line
+source:         RIPE
+
+as-set:         AS-CUSTOMERS
+members:        AS64502, AS64503,
++               AS-NESTED
+source:         RIPE
+
+as-set:         AS-NESTED
+members:        AS64504
+source:         RADB-GRS
+
+route-set:      RS-EXAMPLE
+members:        192.0.2.0/24^+, RS-OTHER
+mp-members:     2001:db8::/32
+source:         RIPE
+
+route:          192.0.2.0/24
+origin:         AS64502
+source:         RIPE
+
+route6:         2001:db8::/32
+origin:         AS64502
+source:         RIPE
+
+person:         John Doe
+source:         RIPE
+"""
+
+
+class MirrorTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        dump_path = os.path.join(self.folder, 'ripe.db.gz')
+        with gzip.open(dump_path, 'wb') as f:
+            f.write(DUMP)
+        self.comm = mirror.MirrorCommunicator(self.folder)
+        self.stored = self.comm.store.ingest(dump_path)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_ingest_skips_unmirrored_types(self):
+        self.assertEqual(self.stored, 6)
+
+    def test_routes_by_autnum(self):
+        routes = parsers.parse_AS_routes(
+            self.comm.get_routes_by_autnum('AS64502', ipv6_enabled=True))
+        self.assertEqual(routes, {'ipv4': set(['192.0.2.0/24']),
+                                  'ipv6': set(['2001:db8::/32'])})
+
+    def test_routes_ipv4_only(self):
+        routes = parsers.parse_AS_routes(
+            self.comm.get_routes_by_autnum('AS64502'))
+        self.assertEqual(routes['ipv6'], set())
+
+    def test_AS_set_members(self):
+        AS_sets, ASNs = parsers.parse_AS_set_members(
+            self.comm.get_filter_set('AS-CUSTOMERS'))
+        self.assertEqual(AS_sets, set(['AS-NESTED']))
+        self.assertEqual(ASNs, set(['AS64502', 'AS64503']))
+
+    def test_RS_members(self):
+        RSes, routes = parsers.parse_RS_members(
+            self.comm.get_filter_set('RS-EXAMPLE'))
+        self.assertEqual(RSes, set(['RS-OTHER']))
+        self.assertEqual(routes, {'ipv4': set(['192.0.2.0/24^+']),
+                                  'ipv6': set(['2001:db8::/32'])})
+
+    def test_policy(self):
+        pp = parsers.PolicyParser('AS64500')
+        pp.assign_content(self.comm.get_policy_by_autnum('AS64500'))
+        pp.read_policy()
+        self.assertEqual(pp.filter_expressions.number_of_filters(), 2)
+
+    def test_missing_objects(self):
+        self.assertIsNone(self.comm.get_routes_by_autnum('AS1'))
+        self.assertIsNone(self.comm.get_filter_set('AS-MISSING'))
+        self.assertIsNone(self.comm.get_policy_by_autnum('AS1'))
+
+
+if __name__ == '__main__':
+    unittest.main()
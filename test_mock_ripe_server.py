@@ -0,0 +1,75 @@
+import shutil
+import tempfile
+import unittest
+
+import communicator
+import counters
+import errors
+import fixtures
+import mock_ripe_server
+import ratelimit
+import rest_cache
+
+REPLY = '<whois-resources><objects></objects></whois-resources>'
+
+
+class RecordReplayTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_folder = tempfile.mkdtemp() + '/'
+        self.fixtures_folder = tempfile.mkdtemp()
+        rest_cache.SingletonRestCache._instances.clear()
+        self.saved_folder = communicator.Communicator.CACHING_ROOT_FOLDER
+        communicator.Communicator.CACHING_ROOT_FOLDER = self.cache_folder
+        self.saved_backoff_delay = ratelimit.backoff_delay
+        ratelimit.backoff_delay = lambda attempt: 0
+        counters.reset()
+
+        self.options = mock_ripe_server.ReplayOptions()
+        self.server = mock_ripe_server.start_server(self.fixtures_folder,
+                                                    options=self.options)
+        self.url = 'http://127.0.0.1:{}'.format(self.server.server_port)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        ratelimit.backoff_delay = self.saved_backoff_delay
+        communicator.Communicator.CACHING_ROOT_FOLDER = self.saved_folder
+        rest_cache.SingletonRestCache._instances.clear()
+        shutil.rmtree(self.cache_folder)
+        shutil.rmtree(self.fixtures_folder)
+
+    def new_comm(self, **kwargs):
+        comm = communicator.Communicator(db_url=self.url, **kwargs)
+        comm.rate_limiter = ratelimit.TokenBucket(rate=1000)
+        return comm
+
+    def test_recorded_reply_is_replayed(self):
+        recorder = self.new_comm(record_to=self.fixtures_folder)
+        url = recorder._search_URL_builder('AS-FOO', None, (), recorder.flags)
+        recorder.cache.update(url, REPLY, recorder.filterset_keyword)
+        self.assertEqual(recorder.get_filter_set('AS-FOO'), REPLY)
+        self.assertEqual(fixtures.FixtureArchive(self.fixtures_folder).paths(),
+                         [url[len(self.url):]])
+
+        rest_cache.SingletonRestCache._instances.clear()
+        shutil.rmtree(self.cache_folder)
+        comm = self.new_comm()
+        self.assertEqual(comm.get_filter_set('AS-FOO'), REPLY)
+        self.assertEqual(self.server.requests_served, 1)
+
+    def test_missing_fixture_is_not_found(self):
+        comm = self.new_comm()
+        self.assertIsNone(comm.get_filter_set('AS-MISSING'))
+
+    def test_injected_errors_are_retried(self):
+        self.options.error_500 = 1.0
+        comm = self.new_comm()
+        self.assertRaises(errors.TransientDBError,
+                          comm.get_filter_set, 'AS-FOO')
+        self.assertEqual(self.server.requests_served,
+                         communicator.Communicator.MAX_BACKOFF_RETRIES + 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
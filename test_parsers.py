@@ -0,0 +1,86 @@
+import json
+import unittest
+
+import mirror
+import parsers
+
+
+def _object(obj_type, attributes, primary_key):
+    return {
+        'type': obj_type,
+        'source': {'id': 'ripe'},
+        'primary-key': {'attribute': [{'name': n, 'value': v}
+                                      for n, v in attributes
+                                      if n in primary_key]},
+        'attributes': {'attribute': [{'name': n, 'value': v}
+                                     for n, v in attributes]},
+    }
+
+
+ROUTES = [
+    [('route', '192.0.2.0/24'), ('origin', 'AS64500'), ('source', 'RIPE')],
+    [('route6', '2001:db8::/32'), ('origin', 'AS64500'), ('source', 'RIPE')],
+]
+AS_SET = [
+    [('as-set', 'AS-FOO'), ('members', 'AS64500'), ('members', 'AS-BAR'),
+     ('members', 'AS64501'), ('source', 'RIPE')],
+]
+ROUTE_SET = [
+    [('route-set', 'RS-FOO'), ('members', '192.0.2.0/24^+'),
+     ('members', 'RS-BAR'), ('mp-members', '2001:db8::/32'),
+     ('source', 'RIPE')],
+]
+
+
+def to_json(rpsl_objects):
+    objects = []
+    for attributes in rpsl_objects:
+        obj_type = attributes[0][0]
+        if obj_type in ('route', 'route6'):
+            primary_key = (obj_type, 'origin')
+        else:
+            primary_key = (obj_type,)
+        objects.append(_object(obj_type, attributes, primary_key))
+    return json.dumps({'objects': {'object': objects}})
+
+
+class JSONParsersTestCase(unittest.TestCase):
+    """The JSON parsers have to give the same results as the XML ones."""
+
+    def assertSameResult(self, rpsl_objects, parser_name):
+        xml_parser = getattr(parsers.REPLY_PARSERS['xml'], parser_name)
+        json_parser = getattr(parsers.REPLY_PARSERS['json'], parser_name)
+        xml_result = xml_parser(mirror.build_search_reply(rpsl_objects))
+        json_result = json_parser(to_json(rpsl_objects))
+        self.assertEqual(xml_result, json_result)
+        return json_result
+
+    def test_AS_routes(self):
+        routes = self.assertSameResult(ROUTES, 'AS_routes')
+        self.assertEqual(routes, {'ipv4': set(['192.0.2.0/24']),
+                                  'ipv6': set(['2001:db8::/32'])})
+
+    def test_AS_set_members(self):
+        AS_sets, ASNs = self.assertSameResult(AS_SET, 'AS_set_members')
+        self.assertEqual(AS_sets, set(['AS-BAR']))
+        self.assertEqual(ASNs, set(['AS64500', 'AS64501']))
+
+    def test_RS_members(self):
+        RSes, routes = self.assertSameResult(ROUTE_SET, 'RS_members')
+        self.assertEqual(RSes, set(['RS-BAR']))
+
+    def test_non_ASCII_attributes(self):
+        descr = ('descr', u'M\xfcnchen IX')
+        reply = to_json([ROUTES[0] + [descr], AS_SET[0] + [descr], ROUTE_SET[0] + [descr]])
+        self.assertEqual(parsers.parse_AS_routes_json(reply)['ipv4'], set(['192.0.2.0/24']))
+        self.assertEqual(parsers.parse_AS_set_members_json(reply),
+                         (set(['AS-BAR']), set(['AS64500', 'AS64501'])))
+        self.assertEqual(parsers.parse_RS_members_json(reply)[0], set(['RS-BAR']))
+
+    def test_empty_reply(self):
+        self.assertEqual(parsers.parse_AS_routes_json('{}'),
+                         {'ipv4': set(), 'ipv6': set()})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+import time
+import unittest
+
+import ratelimit
+
+
+class TokenBucketTestCase(unittest.TestCase):
+
+    def test_burst_is_not_delayed(self):
+        bucket = ratelimit.TokenBucket(rate=10, burst=5)
+        start = time.time()
+        for _ in range(5):
+            bucket.acquire()
+        self.assertLess(time.time() - start, 0.05)
+
+    def test_rate_is_enforced(self):
+        bucket = ratelimit.TokenBucket(rate=50, burst=1)
+        start = time.time()
+        for _ in range(6):
+            bucket.acquire()
+        self.assertGreaterEqual(time.time() - start, 0.09)
+
+    def test_additive_increase(self):
+        bucket = ratelimit.TokenBucket(rate=10)
+        bucket.succeeded()
+        self.assertAlmostEqual(bucket.rate, 10 + bucket.ADDITIVE_INCREASE)
+
+    def test_multiplicative_decrease_once_per_burst(self):
+        bucket = ratelimit.TokenBucket(rate=10)
+        bucket.throttled()
+        bucket.throttled()
+        self.assertAlmostEqual(bucket.rate, 10 * bucket.MULTIPLICATIVE_DECREASE)
+
+    def test_rate_bounds(self):
+        bucket = ratelimit.TokenBucket(rate=ratelimit.TokenBucket.MAX_RATE)
+        bucket.succeeded()
+        self.assertEqual(bucket.rate, bucket.MAX_RATE)
+
+    def test_backoff_delay_is_capped(self):
+        for attempt in range(1, 20):
+            self.assertLessEqual(ratelimit.backoff_delay(attempt, cap=5), 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
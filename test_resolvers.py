@@ -0,0 +1,204 @@
+from collections import Counter
+import functools
+import os
+from Queue import Queue
+import shutil
+import tempfile
+import threading
+import unittest
+
+import errors
+import mirror
+import resolvers
+import routestore
+import rpsl
+
+
+DUMP = """\
+as-set:         AS-CUSTOMERS
+members:        AS64502, AS-NESTED
+source:         RIPE
+
+as-set:         AS-NESTED
+members:        AS64504
+source:         RIPE
+
+route:          192.0.2.0/24
+origin:         AS64502
+source:         RIPE
+
+route:          198.51.100.0/24
+origin:         AS64504
+source:         RIPE
+
+route6:         2001:db8::/32
+origin:         AS64504
+source:         RIPE
+
+route-set:      RS-EDGE
+members:        203.0.113.0/24^+, RS-NESTED
+mp-members:     2001:db8:1::/48
+source:         RIPE
+
+route-set:      RS-NESTED
+members:        192.0.2.128/25
+source:         RIPE
+"""
+
+
+class ResolverPoolTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        dump = os.path.join(self.folder, 'dump.db')
+        with open(dump, 'w') as f:
+            f.write(DUMP)
+        mirror.MirrorStore(self.folder).ingest(dump)
+        self.pool = resolvers.ResolverPool(
+            functools.partial(mirror.MirrorCommunicator, self.folder), processes=2)
+
+    def tearDown(self):
+        self.pool.close()
+        shutil.rmtree(self.folder)
+
+    def resolve(self, obj, concurrency=None):
+        pd = rpsl.PeerFilterDir()
+        pd.append_filter(rpsl.PeerFilter("", "", obj))
+        fr = resolvers.FilterResolver(pd, True, set(), concurrency=concurrency, pool=self.pool)
+        fr.resolve_filters()
+        return fr
+
+    def results(self, fr):
+        """Returns the resolved AS sets, ASes and RSes in plain types."""
+        AS_sets = dict((name, (sorted(s.AS_set_members), sorted(s.ASN_members)))
+                       for name, s in fr.AS_set_dir.data.iteritems())
+        ASes = dict((asn, (list(AS_object.route_obj_dir.origin_table),
+                           list(AS_object.route_obj_dir.origin_table_v6)))
+                    for asn, AS_object in fr.AS_dir.data.iteritems())
+        RSes = dict((name, (sorted(rs.RSes_dir), list(rs.members.origin_table),
+                            list(rs.mp_members.origin_table_v6)))
+                    for name, rs in fr.RS_dir.data.iteritems())
+        return AS_sets, ASes, RSes
+
+    def worker_pids(self):
+        return sorted(p.pid for p in self.pool._pool._pool)
+
+    def test_pool_is_reused(self):
+        pids = self.worker_pids()
+        for _ in xrange(2):
+            fr = self.resolve('AS-CUSTOMERS')
+            self.assertEqual(sorted(fr.AS_set_dir.data), ['AS-CUSTOMERS', 'AS-NESTED'])
+            self.assertEqual(sorted(fr.AS_dir.data), ['AS64502', 'AS64504'])
+        self.assertEqual(self.worker_pids(), pids)
+
+    def test_pipelined_results(self):
+        messages = list(self.pool.resolve_pipelined(set(['AS-CUSTOMERS']), set(['AS64999']),
+                                                    set(), set(['AS64504'])))
+        kinds = [m[0] for m in messages]
+        self.assertEqual(kinds.count('AS_sets'), 1)
+        AS_routes = dict(r for m in messages if m[0] == 'routes' for r in m[1])
+        self.assertEqual(sorted(AS_routes), ['AS64502', 'AS64999'])
+        self.assertIsNone(AS_routes['AS64999'])
+        self.assertEqual(list(routestore.iter_routes(AS_routes['AS64502'])),
+                         [('ipv4', '192.0.2.0/24')])
+
+    def test_ASes_are_dispatched_in_chunks(self):
+        saved_chunk_size = resolvers.AS_chunk_size
+        resolvers.AS_chunk_size = 1
+        self.addCleanup(setattr, resolvers, 'AS_chunk_size', saved_chunk_size)
+        ASNs = set('AS{}'.format(64500 + i) for i in xrange(20))
+        messages = list(self.pool.resolve_pipelined(set(), ASNs, set(), set()))
+        self.assertEqual(len(messages), len(ASNs))
+        self.assertEqual(set(asn for m in messages for asn, _ in m[1]), ASNs)
+        utilisation = self.pool.utilisation()
+        self.assertTrue(utilisation)
+        self.assertTrue(all(0 <= u <= 1 for u in utilisation.itervalues()))
+
+    def test_idle_processes_are_in_the_utilisation(self):
+        list(self.pool.resolve_pipelined(set(), set(['AS64502']), set(), set()))
+        self.assertEqual(sorted(self.pool.utilisation()),
+                         sorted(p.name for p in self.pool._pool._pool))
+
+    def test_async_resolving_gives_the_same_results(self):
+        threaded = self.results(self.resolve('AS-CUSTOMERS OR RS-EDGE'))
+        self.assertEqual(sorted(threaded[0]), ['AS-CUSTOMERS', 'AS-NESTED'])
+        self.assertEqual(threaded[1]['AS64504'], (['198.51.100.0/24'], ['2001:db8::/32']))
+        self.assertEqual(threaded[2]['RS-EDGE'],
+                         (['RS-NESTED'], ['203.0.113.0/24^+'], ['2001:db8:1::/48']))
+        self.assertEqual(self.results(self.resolve('AS-CUSTOMERS OR RS-EDGE', concurrency=5)),
+                         threaded)
+
+    def test_close_stops_the_processes(self):
+        processes = list(self.pool._pool._pool)
+        self.pool.close()
+        self.assertFalse(any(p.is_alive() for p in processes))
+
+
+class ThrottlingCommunicator(object):
+    """Always throttled for AS64501 and the first two times for AS64502."""
+
+    def __init__(self):
+        self.calls = Counter()
+
+    def get_parsed(self, kind, name):
+        self.calls[name] += 1
+        if name == 'AS64501' or (name == 'AS64502' and self.calls[name] <= 2):
+            raise errors.TransientDBError("Throttled")
+        return {'ipv4': set(['192.0.2.0/24']), 'ipv6': set()}
+
+    def close(self):
+        pass
+
+
+class BlockingCommunicator(object):
+    """Finds AS64501 only once it is released."""
+
+    def __init__(self):
+        self.released = threading.Event()
+
+    def get_parsed(self, kind, name):
+        if name == 'AS64501':
+            self.released.wait()
+        return {'ipv4': set(['192.0.2.0/24']), 'ipv6': set()}
+
+
+class ASWorkersTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.addCleanup(setattr, resolvers, '_worker_result_q', resolvers._worker_result_q)
+        resolvers._worker_result_q = Queue()
+
+    def test_slow_AS_does_not_hold_back_the_next_chunk(self):
+        comm = BlockingCommunicator()
+        workers = resolvers._ASWorkers(comm)
+        workers.resolve(['AS64501', 'AS64502'])
+        workers.resolve(['AS64503'])
+        message = resolvers._worker_result_q.get(timeout=5)
+        self.assertEqual([asn for asn, _ in message[1]], ['AS64503'])
+        self.assertEqual(resolvers._worker_result_q.get(timeout=5)[0], 'busy')
+
+        comm.released.set()
+        message = resolvers._worker_result_q.get(timeout=5)
+        self.assertEqual(sorted(asn for asn, _ in message[1]), ['AS64501', 'AS64502'])
+
+
+class RequeueTestCase(unittest.TestCase):
+
+    def setUp(self):
+        # Keeps the test process from being monkey patched.
+        self.addCleanup(setattr, resolvers, '_monkey_patched', resolvers._monkey_patched)
+        resolvers._monkey_patched = True
+
+    def test_throttled_ASes_are_requeued_until_given_up(self):
+        comm = ThrottlingCommunicator()
+        q = Queue()
+        resolvers._subprocess_AS_resolving(['AS64501', 'AS64502'], q, lambda: comm)
+        results = dict(q.get() for _ in xrange(q.qsize()))
+        self.assertEqual(results, {'AS64501': None,
+                                   'AS64502': {'ipv4': set(['192.0.2.0/24']), 'ipv6': set()}})
+        self.assertEqual(comm.calls['AS64501'], resolvers.max_requeues + 1)
+        self.assertEqual(comm.calls['AS64502'], 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
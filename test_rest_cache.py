@@ -0,0 +1,317 @@
+import mmap
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+import xxhash
+
+import counters
+import parsers
+import rest_cache
+
+
+class FileBackendTestCase(unittest.TestCase):
+    backend = 'file'
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp() + '/'
+        rest_cache.SingletonRestCache._instances.clear()
+        self.cache = rest_cache.RestCache(caching_folder=self.folder,
+                                          backend=self.backend)
+
+    def tearDown(self):
+        rest_cache.SingletonRestCache._instances.clear()
+        shutil.rmtree(self.folder)
+
+    def expire_all(self):
+        self.cache.timeout = -1
+        self.cache._update_cutoffs()
+
+    def test_update_and_get(self):
+        self.assertEqual(self.cache.get_or('url', 'route'), '')
+        self.assertTrue(self.cache.update('url', 'body', 'route'))
+        self.assertEqual(self.cache.get_or('url', 'route'), 'body')
+        self.assertEqual(self.cache.get_or('url', 'policy'), '')
+
+    def test_expired_entry_is_removed(self):
+        self.cache.update('url', 'body', 'route')
+        self.expire_all()
+        self.assertEqual(self.cache.get_or('url', 'route'), '')
+        self.assertIsNone(self.cache.get_stale('url', 'route'))
+
+    def test_expired_entry_with_validators_is_kept(self):
+        validators = {'etag': '"1"'}
+        self.cache.update('url', 'body', 'route', validators)
+        self.expire_all()
+        self.assertEqual(self.cache.get_or('url', 'route'), '')
+        self.assertEqual(self.cache.get_stale('url', 'route'),
+                         ('body', validators))
+        self.assertTrue(self.cache.touch('url', 'route'))
+        self.cache.oldest_mtime = time.time() - 60
+        self.assertEqual(self.cache.get_or('url', 'route'), 'body')
+
+    def test_sweep(self):
+        self.cache.update('plain', 'body', 'route')
+        self.cache.update('validated', 'body', 'route', {'etag': '"1"'})
+        self.expire_all()
+        self.assertEqual(self.cache.sweep(), 1)
+        self.assertIsNotNone(self.cache.get_stale('validated', 'route'))
+        self.assertEqual(self.cache.sweep(everything=True), 1)
+        self.assertIsNone(self.cache.get_stale('validated', 'route'))
+
+    def test_timeout_per_prefix(self):
+        self.cache.update('url', 'body', 'route')
+        self.cache.update('url', 'body', 'policy')
+        self.cache.oldest_mtimes['route'] = time.time() + 1
+        self.assertEqual(self.cache.get_or('url', 'route'), '')
+        self.assertEqual(self.cache.get_or('url', 'policy'), 'body')
+
+    def test_sweep_per_prefix(self):
+        self.cache.update('url', 'body', 'route')
+        self.cache.update('url', 'body', 'policy')
+        self.cache.timeouts['route'] = -1
+        self.assertEqual(self.cache.sweep(), 1)
+        self.assertEqual(self.cache.get_or('url', 'policy'), 'body')
+
+    def test_sweep_negative_entries(self):
+        self.cache.update_negative('missing', 'route')
+        self.cache.update_negative('found', 'route')
+        self.cache.update('found', 'body', 'route')
+        self.assertFalse(self.cache.is_negative('found', 'route'))
+        self.assertEqual(self.cache.sweep(), 0)
+        self.cache.negative_timeout = -1
+        self.assertEqual(self.cache.sweep(), 1)
+        self.assertEqual(self.cache.get_or('found', 'route'), 'body')
+
+    def test_evict(self):
+        keys = ['route_' + xxhash.xxh64('url{}'.format(i)).hexdigest() for i in xrange(10)]
+        for i in xrange(10):
+            # Incompressible bodies of about 1000 bytes each.
+            self.cache.update('url{}'.format(i), os.urandom(1000), 'route')
+            time.sleep(0.01)
+        self.assertEqual(self.cache.backend.evict(5500), 5)
+        self.assertIsNone(self.cache.backend.stored(keys[4]))
+        self.assertIsNotNone(self.cache.backend.stored(keys[5]))
+
+    def test_collect(self):
+        self.cache.update('old', 'body', 'route')
+        self.cache.max_bytes = 5500
+        self.expire_all()
+        self.assertEqual(self.cache.collect(force=True), 1)
+        self.assertEqual(self.cache.collect(), 0)
+
+    def test_collect_evicts(self):
+        keys = ['route_' + xxhash.xxh64('url{}'.format(i)).hexdigest() for i in xrange(10)]
+        for i in xrange(10):
+            self.cache.update('url{}'.format(i), os.urandom(1000), 'route')
+            time.sleep(0.01)
+        self.cache.max_bytes = 5500
+        # Down to the low watermark, below the maximum size.
+        self.assertGreaterEqual(self.cache.collect(force=True), 6)
+        self.assertIsNone(self.cache.backend.stored(keys[5]))
+        self.assertIsNotNone(self.cache.backend.stored(keys[9]))
+
+    def test_collector_thread(self):
+        def collectors():
+            return [t for t in threading.enumerate() if t.name == 'cache-collector']
+        running = len(collectors())
+        key = 'route_' + xxhash.xxh64('old').hexdigest()
+        self.cache.update('old', 'body', 'route')
+        self.cache.timeout = -1
+        self.cache.max_bytes = 5500
+        self.cache._start_collector()
+        self.cache._start_collector()
+        self.assertEqual(len(collectors()), running + 1)
+        lock = self.cache.locks_folder + self.cache.GC_STAMP
+        for _ in xrange(100):
+            # Done when the entry is gone and the collection lock released.
+            if self.cache.backend.stored(key) is None and not os.path.exists(lock):
+                break
+            time.sleep(0.02)
+        self.assertIsNone(self.cache.backend.stored(key))
+
+    def test_kept_expired_entry(self):
+        self.cache.keep_expired = True
+        self.cache.update('url', 'body', 'route')
+        self.expire_all()
+        self.assertEqual(self.cache.get_or('url', 'route'), '')
+        self.assertEqual(self.cache.get_expired('url', 'route'), 'body')
+
+
+class SQLiteBackendTestCase(FileBackendTestCase):
+    backend = 'sqlite'
+
+
+class FileLayoutTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp() + '/'
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_flat_entries_are_migrated(self):
+        key = 'route_' + xxhash.xxh64('url').hexdigest()
+        for name in (key, 'unrelated'):
+            with open(self.folder + name, 'w') as f:
+                f.write('body')
+        backend = rest_cache.FileCacheBackend(self.folder)
+        self.assertFalse(os.path.exists(self.folder + key))
+        self.assertIsNotNone(backend.stored(key))
+        self.assertTrue(os.path.exists(self.folder + 'unrelated'))
+
+
+class CodecTestCase(unittest.TestCase):
+    BODY = ''.join('<attribute name="members" value="AS{}"/>\n'.format(i)
+                   for i in xrange(20000))
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp() + '/'
+
+    def tearDown(self):
+        rest_cache.SingletonRestCache._instances.clear()
+        shutil.rmtree(self.folder)
+
+    def new_cache(self, codec, backend='file'):
+        rest_cache.SingletonRestCache._instances.clear()
+        return rest_cache.RestCache(caching_folder=self.folder, backend=backend,
+                                    memory_bytes=0, codec=codec)
+
+    def test_codecs(self):
+        for backend in sorted(rest_cache.RestCache.BACKENDS):
+            for codec in sorted(rest_cache.RestCache.CODECS):
+                cache = self.new_cache(codec, backend)
+                cache.update(codec, self.BODY, 'route', {'etag': '"1"'})
+                self.assertEqual(cache.get_or(codec, 'route'), self.BODY)
+                self.assertEqual(cache.get_stale(codec, 'route'),
+                                 (self.BODY, {'etag': '"1"'}))
+                stream = cache.get_stream(codec, 'route')
+                chunks = iter(lambda: stream.read(1000), '')
+                self.assertEqual(''.join(chunks), self.BODY)
+                stream.close()
+
+    def test_file_entries_are_memory_mapped(self):
+        body = ('<whois-resources><objects><object type="route"><primary-key>'
+                '<attribute name="route" value="192.0.2.0/24"/>'
+                '</primary-key></object></objects></whois-resources>')
+        cache = self.new_cache('identity')
+        cache.update('url', body, 'route', {'etag': '"1"'})
+        stream = cache.get_stream('url', 'route')
+        self.assertIsInstance(stream, mmap.mmap)
+        self.assertEqual(parsers.parse_AS_routes(stream),
+                         {'ipv4': set(['192.0.2.0/24']), 'ipv6': set()})
+
+    def test_entries_keep_their_codec(self):
+        self.new_cache('gzip').update('url', self.BODY, 'route')
+        cache = self.new_cache('zlib')
+        self.assertEqual(cache.get_or('url', 'route'), self.BODY)
+
+    def test_compressed_entry_is_smaller(self):
+        self.new_cache('zlib').update('url', self.BODY, 'route')
+        self.new_cache('identity').update('url', self.BODY, 'policy')
+        backend = rest_cache.FileCacheBackend(self.folder)
+        zlib_file = backend._path('route_' + xxhash.xxh64('url').hexdigest())
+        plain_file = backend._path('policy_' + xxhash.xxh64('url').hexdigest())
+        self.assertLess(os.path.getsize(zlib_file) * 10,
+                        os.path.getsize(plain_file))
+
+    def test_legacy_entry(self):
+        with open(self.folder + 'route_' + xxhash.xxh64('url').hexdigest(), 'w') as f:
+            f.write(self.BODY)
+        self.assertEqual(self.new_cache('zlib').get_or('url', 'route'), self.BODY)
+
+
+class ConcurrentAccessTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp() + '/'
+        rest_cache.SingletonRestCache._instances.clear()
+        self.cache = rest_cache.RestCache(caching_folder=self.folder,
+                                          memory_bytes=0)
+
+    def tearDown(self):
+        rest_cache.SingletonRestCache._instances.clear()
+        shutil.rmtree(self.folder)
+
+    def test_readers_never_see_partial_entries(self):
+        bodies = [c * 200000 for c in 'abc']
+        self.cache.update('url', bodies[0], 'route')
+        seen = []
+        stop = threading.Event()
+
+        def _write():
+            i = 0
+            while not stop.is_set():
+                i += 1
+                self.cache.update('url', bodies[i % 3], 'route')
+
+        def _read():
+            for _ in xrange(200):
+                seen.append(self.cache.get_or('url', 'route'))
+
+        writer = threading.Thread(target=_write)
+        writer.start()
+        readers = [threading.Thread(target=_read) for _ in xrange(4)]
+        for t in readers:
+            t.start()
+        for t in readers:
+            t.join()
+        stop.set()
+        writer.join()
+
+        self.assertEqual(len(seen), 800)
+        self.assertTrue(all(body in bodies for body in seen))
+        self.assertEqual([n for _, _, files in os.walk(self.folder) for n in files
+                          if n.startswith('.tmp-')], [])
+
+    def test_expired_entry_being_refilled_is_kept(self):
+        self.cache.update('url', 'body', 'route')
+        self.cache.oldest_mtime = time.time() + 1
+        with self.cache.key_lock('url', 'route'):
+            self.assertEqual(self.cache.get_or('url', 'route'), '')
+        self.cache.oldest_mtime = 0
+        self.assertEqual(self.cache.get_or('url', 'route'), 'body')
+
+
+class MemoryLRUTestCase(unittest.TestCase):
+
+    def setUp(self):
+        counters.reset()
+
+    def test_least_recently_used_are_evicted(self):
+        lru = rest_cache.MemoryLRU(10)
+        lru.put('a', 0, 'xxxx')
+        lru.put('b', 0, 'xxxx')
+        lru.get('a')
+        lru.put('c', 0, 'xxxx')
+        self.assertIsNone(lru.get('b'))
+        self.assertIsNotNone(lru.get('a'))
+        self.assertEqual(lru.size, 8)
+        self.assertEqual(counters.get('memory_evictions'), 1)
+
+    def test_oversized_entry_is_not_kept(self):
+        lru = rest_cache.MemoryLRU(10)
+        lru.put('a', 0, 'xxxx')
+        lru.put('a', 0, 'x' * 11)
+        self.assertIsNone(lru.get('a'))
+        self.assertEqual(lru.size, 0)
+
+    def test_hits_skip_the_backend(self):
+        folder = tempfile.mkdtemp() + '/'
+        self.addCleanup(shutil.rmtree, folder)
+        rest_cache.SingletonRestCache._instances.clear()
+        self.addCleanup(rest_cache.SingletonRestCache._instances.clear)
+        cache = rest_cache.RestCache(caching_folder=folder)
+        cache.update('url', 'body', 'route')
+        cache.backend.delete('route_' + xxhash.xxh64('url').hexdigest())
+        self.assertEqual(cache.get_or('url', 'route'), 'body')
+        self.assertEqual(counters.get('memory_hits'), 1)
+        cache.oldest_mtime = time.time() + 1
+        self.assertEqual(cache.get_or('url', 'route'), '')
+
+
+if __name__ == '__main__':
+    unittest.main()
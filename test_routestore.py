@@ -0,0 +1,68 @@
+import pickle
+import unittest
+
+import routestore
+import rpsl
+
+
+class RouteStoreTestCase(unittest.TestCase):
+
+    def test_pack_routes(self):
+        routes = {'ipv4': set(['192.0.2.0/24', '198.51.100.128/25', '0.0.0.0/0']),
+                  'ipv6': set(['2001:db8::/32', '2001:db8:1:2::/64'])}
+        packed = pickle.loads(pickle.dumps(routestore.pack_routes(routes), 2))
+        unpacked = {'ipv4': set(), 'ipv6': set()}
+        for afi, prefix in routestore.iter_routes(packed):
+            unpacked[afi].add(prefix)
+        self.assertEqual(unpacked, routes)
+        self.assertEqual(packed[4:], ((), ()))
+        self.assertFalse(routestore.is_empty(packed))
+
+    def test_other_prefixes_are_kept_as_they_are(self):
+        routes = {'ipv4': set(['192.0.2.0/24^+', '010.0.0.0/8']),
+                  'ipv6': set(['2001:DB8::/32', '2001:0db8::/32^48-56'])}
+        packed = routestore.pack_routes(routes)
+        self.assertEqual(sorted(routestore.iter_routes(packed)),
+                         sorted((afi, prefix) for afi in routes for prefix in routes[afi]))
+        self.assertEqual(packed[:4], ('', '', '', ''))
+        store = routestore.CompactRouteStore(packed)
+        self.assertIn('192.0.2.0/24^+', store)
+        self.assertNotIn('192.0.2.0/24', store)
+
+    def test_empty(self):
+        packed = routestore.pack_routes({'ipv4': set(), 'ipv6': set()})
+        self.assertTrue(routestore.is_empty(packed))
+        self.assertEqual(list(routestore.iter_routes(packed)), [])
+
+    def test_store_keeps_unique_sorted_prefixes(self):
+        store = routestore.CompactRouteStore()
+        store.extend(['198.51.100.0/24', '192.0.2.0/25', '192.0.2.0/24', '198.51.100.0/24'],
+                     'ipv4')
+        store.extend(['2001:db8:1::/48', '2001:db8::/32', '2001:db8::/32'], 'ipv6')
+        self.assertEqual(list(store.prefixes('ipv4')),
+                         ['192.0.2.0/24', '192.0.2.0/25', '198.51.100.0/24'])
+        self.assertEqual(list(store.prefixes('ipv6')), ['2001:db8::/32', '2001:db8:1::/48'])
+        self.assertEqual(len(store), 5)
+        for prefix in ('192.0.2.0/24', '192.0.2.0/25', '198.51.100.0/24',
+                       '2001:db8::/32', '2001:db8:1::/48'):
+            self.assertIn(prefix, store)
+        for prefix in ('192.0.2.0/26', '10.0.0.0/8', '2001:db8::/48', '2001:db8:2::/48'):
+            self.assertNotIn(prefix, store)
+        self.assertEqual(list(routestore.CompactRouteStore(store.pack()).prefixes('ipv4')),
+                         list(store.prefixes('ipv4')))
+
+    def test_route_object_dir_tables(self):
+        AS_object = rpsl.ASObject('AS64500', routestore.pack_routes(
+            {'ipv4': set(['192.0.2.0/24']), 'ipv6': set(['2001:db8::/32'])}))
+        AS_object.append_route_obj(rpsl.RouteObject('192.0.2.0/24', 'AS64500'))
+        route_dir = AS_object.route_obj_dir
+        self.assertEqual(route_dir.origin_table.keys(), ['192.0.2.0/24'])
+        self.assertIn('192.0.2.0/24', route_dir.origin_table)
+        self.assertNotIn('192.0.2.0/24', route_dir.origin_table_v6)
+        self.assertIn('2001:db8::/32', route_dir.origin_table_v6)
+        r, = route_dir.origin_table_v6.itervalues()
+        self.assertEqual((r.route, r.origin, r.ROUTE_ATTR), ('2001:db8::/32', 'AS64500', 'ROUTE6'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+import unittest
+
+import asregistry
+import rpsl
+
+
+class AsSetObjectDirTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.AS_set_dir = rpsl.AsSetObjectDir()
+
+    def add(self, setname, sets, ASNs):
+        AS_set = rpsl.AsSetObject(setname)
+        AS_set.AS_set_members.update(sets)
+        AS_set.add_ASNs(ASNs)
+        self.AS_set_dir.append_AS_set_obj(AS_set)
+
+    def closure(self, setname):
+        return sorted(asregistry.registry.ASNs(self.AS_set_dir.ASN_closure(setname)))
+
+    def test_closures(self):
+        # AS-A -> AS-B <-> AS-C -> AS-D, AS-E -> AS-D, AS-C -> AS-MISSING
+        self.add('AS-A', ['AS-B'], ['AS1'])
+        self.add('AS-B', ['AS-C'], ['AS2'])
+        self.add('AS-C', ['AS-B', 'AS-D', 'AS-MISSING'], ['AS3'])
+        self.add('AS-D', [], ['AS4', 'AS2'])
+        self.add('AS-E', ['AS-D'], [])
+        self.add('AS-SELF', ['AS-SELF'], ['AS5'])
+
+        self.assertEqual(self.closure('AS-A'), ['AS1', 'AS2', 'AS3', 'AS4'])
+        self.assertEqual(self.closure('AS-B'), ['AS2', 'AS3', 'AS4'])
+        self.assertIs(self.AS_set_dir.ASN_closures['AS-B'],
+                      self.AS_set_dir.ASN_closures['AS-C'])
+        self.assertEqual(self.closure('AS-E'), ['AS2', 'AS4'])
+        self.assertEqual(self.closure('AS-SELF'), ['AS5'])
+        self.assertEqual(self.closure('AS-MISSING'), [])
+
+    def test_ASN_members_are_read_only(self):
+        self.add('AS-A', [], ['AS1'])
+        members = self.AS_set_dir.data['AS-A'].ASN_members
+        self.assertEqual(members, frozenset(['AS1']))
+        self.assertRaises(AttributeError, lambda: members.add('AS2'))
+
+    def test_deep_nesting(self):
+        depth = 5000
+        for i in xrange(depth):
+            self.add('AS-{}'.format(i), ['AS-{}'.format(i + 1)], ['AS{}'.format(i)])
+        self.assertEqual(len(self.closure('AS-0')), depth)
+
+
+if __name__ == '__main__':
+    unittest.main()
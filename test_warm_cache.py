@@ -0,0 +1,66 @@
+import functools
+import os
+import shutil
+import tempfile
+import unittest
+
+import counters
+import mirror
+import warm_cache
+
+
+DUMP = """\
+aut-num:        AS64500
+as-name:        EXAMPLE-AS
+import:         from AS64501 accept AS-CUSTOMERS
+import:         from AS64501 accept RS-EXAMPLE
+source:         RIPE
+
+as-set:         AS-CUSTOMERS
+members:        AS64502, AS-NESTED, AS-MISSING
+source:         RIPE
+
+as-set:         AS-NESTED
+members:        AS64504
+source:         RIPE
+
+route-set:      RS-EXAMPLE
+members:        192.0.2.0/24^+
+source:         RIPE
+
+route:          192.0.2.0/24
+origin:         AS64502
+source:         RIPE
+
+route:          198.51.100.0/24
+origin:         AS64504
+source:         RIPE
+"""
+
+
+class WarmCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        dump = os.path.join(self.folder, 'dump.db')
+        with open(dump, 'w') as f:
+            f.write(DUMP)
+        mirror.MirrorStore(self.folder).ingest(dump)
+        self.comm_factory = functools.partial(mirror.MirrorCommunicator, self.folder)
+        counters.reset()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_everything_referred_to_is_looked_up(self):
+        report = warm_cache.warm(['AS64500'], self.comm_factory)
+        self.assertEqual(report.found['policies'], 1)
+        self.assertEqual((report.found['AS sets'], report.total['AS sets']), (2, 3))
+        self.assertEqual((report.found['RS sets'], report.total['RS sets']), (1, 1))
+        # AS64500 itself, AS64502 and AS64504.
+        self.assertEqual((report.found['ASes'], report.total['ASes']), (2, 3))
+        self.assertIn('AS sets 2/3', str(report))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,120 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import mirror
+import mock_irrd_server
+import parsers
+import whois_communicator
+
+
+DUMP = """\
+aut-num:        AS64500
+as-name:        EXAMPLE-AS
+import:         from AS64501 accept AS-CUSTOMERS
+source:         RIPE
+
+as-set:         AS-CUSTOMERS
+members:        AS64502, AS64503, AS-NESTED
+source:         RIPE
+
+as-set:         AS-NESTED
+members:        AS64504, AS-CUSTOMERS
+source:         RIPE
+
+route-set:      RS-EXAMPLE
+members:        192.0.2.0/24^+, RS-OTHER, AS64504
+source:         RIPE
+
+route-set:      RS-OTHER
+mp-members:     2001:db8::/32
+source:         RIPE
+
+route:          192.0.2.0/24
+origin:         AS64502
+source:         RIPE
+
+route:          198.51.100.0/24
+origin:         AS64504
+source:         RIPE
+
+route6:         2001:db8:1::/48
+origin:         AS64502
+source:         RIPE
+"""
+
+
+class WhoisCommunicatorTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        dump = os.path.join(self.folder, 'dump.db')
+        with open(dump, 'w') as f:
+            f.write(DUMP)
+        mirror.MirrorStore(self.folder).ingest(dump)
+        self.server = mock_irrd_server.start_server(self.folder)
+        self.comm = whois_communicator.WhoisCommunicator(
+            '127.0.0.1', self.server.server_address[1])
+        self.parse = parsers.REPLY_PARSERS[self.comm.reply_format]
+
+    def tearDown(self):
+        self.comm.close()
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.folder)
+
+    def test_AS_set_is_expanded_by_the_server(self):
+        AS_sets, ASNs = self.parse.AS_set_members(
+            self.comm.get_filter_set('AS-CUSTOMERS'))
+        self.assertEqual(AS_sets, set())
+        self.assertEqual(ASNs, set(['AS64502', 'AS64503', 'AS64504']))
+
+    def test_AS_set_one_level(self):
+        self.comm.expand_sets = False
+        AS_sets, ASNs = self.parse.AS_set_members(
+            self.comm.get_filter_set('AS-CUSTOMERS'))
+        self.assertEqual(AS_sets, set(['AS-NESTED']))
+        self.assertEqual(ASNs, set(['AS64502', 'AS64503']))
+
+    def test_RS_is_expanded_by_the_server(self):
+        RSes, routes = self.parse.RS_members(
+            self.comm.get_filter_set('RS-EXAMPLE'))
+        self.assertEqual(RSes, set())
+        self.assertEqual(routes, {'ipv4': set(['192.0.2.0/24^+',
+                                               '198.51.100.0/24']),
+                                  'ipv6': set(['2001:db8::/32'])})
+
+    def test_routes(self):
+        routes = self.parse.AS_routes(
+            self.comm.get_routes_by_autnum('AS64502', ipv6_enabled=True))
+        self.assertEqual(routes, {'ipv4': set(['192.0.2.0/24']),
+                                  'ipv6': set(['2001:db8:1::/48'])})
+        self.assertIsNone(self.comm.get_routes_by_autnum('AS64999'))
+
+    def test_prefetched_routes_use_one_connection(self):
+        self.comm.PIPELINE_DEPTH = 3
+        self.comm.prefetch_routes(['AS64502', 'AS64503', 'AS64504'],
+                                  ipv6_enabled=True)
+        self.assertIsNone(self.comm.get_routes_by_autnum('AS64503', True))
+        self.assertEqual(self.comm.get_routes_by_autnum('AS64504', True),
+                         '198.51.100.0/24')
+        self.assertEqual(self.comm.get_routes_by_autnum('AS64502', False),
+                         '192.0.2.0/24')
+        self.assertEqual(self.server.connections, 1)
+
+    def test_policy(self):
+        pp = parsers.PolicyParser('AS64500')
+        pp.assign_content(self.comm.get_policy_by_autnum('AS64500'))
+        pp.read_policy()
+        pf, = pp.filter_expressions.enumerate_objs()
+        self.assertEqual((pf.expression, pf.afi), ('AS-CUSTOMERS', 'IPV4.UNICAST'))
+        peer, = pp.peerings.enumerate_objs()
+        self.assertEqual(peer.origin, 'AS64501')
+        self.assertEqual(peer.filters, {pf.hash_value: 'import'})
+        self.assertEqual(peer.mp_filters, {})
+        self.assertIsNone(self.comm.get_policy_by_autnum('AS64999'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,195 @@
+"""Pre-populates the cache of the RIPE DB replies, so that a later libParser
+run is served (almost) entirely from the cache.
+
+Usage: python warm_cache.py [-f FILE] [-j] [--db-url DB_URL]
+                            [--cache-backend BACKEND] [--cache-codec CODEC]
+                            [OBJECT [OBJECT ...]]
+
+The objects are AS numbers and AS sets, given on the command line and/or in
+FILE (one per line, '#' starts a comment). For every AS number its policy is
+fetched and the AS sets, ASes and RS sets of its filters are warmed as well.
+The AS sets and RS sets are resolved recursively and the routes of all the
+ASes found along the way are fetched, on the same resolver pool as libParser
+(the shared rate limiter keeps the request rate safe).
+"""
+import argparse
+import functools
+from multiprocessing.pool import ThreadPool
+import time
+
+import analyzer
+import communicator
+import counters
+import parsers
+import resolvers
+import rest_cache
+import rpsl
+
+
+class WarmReport(object):
+    """How many of the objects of every type were found, out of the ones
+    that were looked up.
+    """
+    TYPES = ('policies', 'AS sets', 'RS sets', 'ASes')
+
+    def __init__(self):
+        self.found = dict.fromkeys(self.TYPES, 0)
+        self.total = dict.fromkeys(self.TYPES, 0)
+        self.elapsed = 0
+
+    def add(self, obj_type, found, total):
+        self.found[obj_type] += found
+        self.total[obj_type] += total
+
+    def __str__(self):
+        c = counters.snapshot()
+        fetched = c['downloads'] + c['revalidations']
+        rate = fetched / self.elapsed if self.elapsed else 0
+        coverage = ', '.join('{} {}/{}'.format(obj_type, self.found[obj_type],
+                                               self.total[obj_type])
+                             for obj_type in self.TYPES)
+        return ("Warmed {} objects in {:.1f}s: {} fetched ({:.1f}/s), "
+                "{} already cached\nFound: {}\n{}"
+                .format(sum(self.total.itervalues()), self.elapsed, fetched,
+                        rate, c['cache_hits'], coverage, counters.cache_report()))
+
+
+def _warm_policies(ASNs, comm_factory):
+    """Fetches the policies of the ASNs and returns the number found and the
+    ASes, AS sets and RS sets of their filters.
+    """
+    comm = comm_factory()
+    ASes, AS_sets, RSes = set(), set(), set()
+
+    def _fetch(autnum):
+        return autnum, comm.get_policy_by_autnum(autnum)
+
+    found = 0
+    pool = ThreadPool(resolvers.threads_count)
+    try:
+        for autnum, reply in pool.imap_unordered(_fetch, ASNs):
+            if reply is None:
+                continue
+            found += 1
+            pp = parsers.PolicyParser(autnum)
+            try:
+                pp.assign_content(reply)
+                pp.read_policy()
+            except Exception as e:
+                print "Failed to parse the policy of {}. {}".format(autnum, e)
+                continue
+            for pf in pp.filter_expressions.enumerate_objs():
+                _, new_ASNs, new_AS_sets, new_RSets = analyzer.analyze_filter(pf.expression)
+                ASes.update(new_ASNs)
+                AS_sets.update(new_AS_sets)
+                RSes.update(new_RSets)
+    finally:
+        pool.close()
+        pool.join()
+        comm.close()
+    return found, ASes, AS_sets, RSes
+
+
+def _found(directory):
+    """Returns how many entries of an AS set or RS directory were found. The
+    children of the ones whose lookup failed are left empty strings.
+    """
+    return sum(1 for children in directory.itervalues() if children['sets'] != '')
+
+
+def warm(objects, comm_factory=communicator.Communicator):
+    """Fetches the given AS numbers and AS sets and everything they refer to
+    through the communicator (which caches the replies) and returns a
+    WarmReport.
+
+    Parameters
+    ----------
+    objects : iterable
+        The AS numbers and AS sets to start from.
+    comm_factory : callable
+        Creates the communicator that is used for the DB requests. It has to
+        be picklable.
+    """
+    start = time.time()
+    report = WarmReport()
+    objects = set(objects)
+    ASNs = set(o for o in objects if rpsl.is_ASN(o))
+    AS_sets = objects - ASNs
+
+    print "Warming policies..."
+    found, policy_ASNs, policy_AS_sets, RSes = _warm_policies(ASNs, comm_factory)
+    report.add('policies', found, len(ASNs))
+    ASNs.update(policy_ASNs)
+    AS_sets.update(policy_AS_sets)
+
+    print "Warming AS sets, ASes and RS sets..."
+    with resolvers.ResolverPool(comm_factory) as pool:
+        for message in pool.resolve_pipelined(AS_sets, ASNs, RSes, set()):
+            if message[0] == 'AS_sets':
+                report.add('AS sets', _found(message[1]), len(message[1]))
+            elif message[0] == 'RSes':
+                report.add('RS sets', _found(message[1]), len(message[1]))
+            else:
+                report.add('ASes', sum(1 for _, routes in message[1] if routes is not None),
+                           len(message[1]))
+
+    report.elapsed = time.time() - start
+    return report
+
+
+def read_objects(path):
+    objects = []
+    with open(path) as f:
+        for line in f:
+            line = line.split('#', 1)[0].strip()
+            if line:
+                objects.append(line)
+    return objects
+
+
+def main():
+    def read_OBJECT(string):
+        if not (rpsl.is_ASN(string) or rpsl.is_AS_set(string)):
+            raise argparse.ArgumentTypeError("Invalid Object '{}'. Expected AS<number> or AS-<value>"
+                                             .format(string))
+        return string
+
+    parser = argparse.ArgumentParser(description="Pre-populates the cache of the RIPE DB replies.")
+    parser.add_argument('OBJECT', type=read_OBJECT, nargs='*',
+                        help="An AS number (its policy is warmed as well) or an AS set.")
+    parser.add_argument('-f', '--file',
+                        help="Read more objects from FILE, one per line.")
+    parser.add_argument('-j', '--json', action="store_true",
+                        help="Use the JSON instead of the XML search service of the RIPE DB.")
+    parser.add_argument('--db-url',
+                        help="Send the requests to another RIPE REST API endpoint.")
+    parser.add_argument('--cache-backend', choices=sorted(rest_cache.RestCache.BACKENDS))
+    parser.add_argument('--cache-codec', choices=sorted(rest_cache.RestCache.CODECS))
+    args = parser.parse_args()
+
+    objects = list(args.OBJECT)
+    if args.file:
+        for obj in read_objects(args.file):
+            try:
+                objects.append(read_OBJECT(obj))
+            except argparse.ArgumentTypeError as e:
+                parser.error(str(e))
+    if not objects:
+        parser.error("No objects given.")
+
+    comm_options = dict()
+    if args.json:
+        comm_options['reply_format'] = 'json'
+    if args.db_url:
+        comm_options['db_url'] = args.db_url
+    if args.cache_backend:
+        comm_options['cache_backend'] = args.cache_backend
+    if args.cache_codec:
+        comm_options['cache_codec'] = args.cache_codec
+    comm_factory = functools.partial(communicator.Communicator, **comm_options)
+
+    print warm(objects, comm_factory)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+import logging
+import socket
+import threading
+
+import errors
+import mirror
+import parsers
+
+
+class WhoisCommunicator(object):
+    """Alternative to communicator.Communicator that queries an IRRd whois
+    server over a single persistent TCP connection (`!!`).
+
+    The AS sets and route sets are expanded by the server (`!i<set>,1`) and
+    the prefixes originated by an AS are requested with `!g`/`!6`, so a set
+    costs one query instead of one REST search per nested set and member
+    AS. Several queries can be pipelined with query_many().
+    """
+    reply_format = 'whois'
+
+    DEFAULT_HOST = "whois.radb.net"
+    DEFAULT_PORT = 43
+    DEFAULT_SOURCES = ("RIPE", "RADB", "APNIC", "ARIN")
+
+    # Socket timeout in seconds.
+    TIMEOUT = 30
+    # How many queries are written before their replies are read. It keeps
+    # both ends from blocking on full socket buffers.
+    PIPELINE_DEPTH = 100
+
+    def __init__(self, host=DEFAULT_HOST, port=DEFAULT_PORT,
+                 sources=DEFAULT_SOURCES, expand_sets=True):
+        self.host = host
+        self.port = port
+        self.sources = sources
+        # When False the sets are requested one level at a time (`!i<set>`)
+        # and the resolvers recurse into the nested sets themselves.
+        self.expand_sets = expand_sets
+        self._sock = None
+        self._reader = None
+        # The connection serves one batch of queries at a time.
+        self._lock = threading.Lock()
+        # Route replies fetched ahead by prefetch_routes().
+        self._prefetched = dict()
+        self._prefetched_lock = threading.Lock()
+
+    def _connect(self):
+        self._sock = socket.create_connection((self.host, self.port),
+                                              self.TIMEOUT)
+        self._reader = self._sock.makefile('rb')
+        self._sock.sendall("!!\n")
+        if self.sources:
+            self._sock.sendall("!s{}\n".format(','.join(self.sources)))
+            self._read_reply()
+
+    def _disconnect(self):
+        if self._sock is None:
+            return
+        try:
+            self._sock.sendall("!q\n")
+        except socket.error:
+            pass
+        self._reader.close()
+        self._sock.close()
+        self._sock = None
+        self._reader = None
+
+    def _read_reply(self):
+        """Reads the reply of one query. Returns its data, '' if there is
+        none or None if the key was not found.
+        """
+        line = self._reader.readline()
+        if not line:
+            raise socket.error("Connection closed by the whois server")
+        if line.startswith('A'):
+            data = self._reader.read(int(line[1:]))
+            self._reader.readline()
+            return data.strip()
+        elif line.startswith('C'):
+            return ''
+        elif line.startswith('D'):
+            return None
+        # E (multiple copies of a key) and F (error) replies.
+        logging.warning("IRRd: {}".format(line.strip()))
+        return None
+
+    def query_many(self, queries):
+        """Sends the queries pipelined over the persistent connection and
+        returns their replies in the same order.
+        """
+        with self._lock:
+            for attempt in xrange(2):
+                replies = []
+                try:
+                    if self._sock is None:
+                        self._connect()
+                    for i in xrange(0, len(queries), self.PIPELINE_DEPTH):
+                        window = queries[i:i + self.PIPELINE_DEPTH]
+                        self._sock.sendall(''.join(q + '\n' for q in window))
+                        for _ in window:
+                            replies.append(self._read_reply())
+                    return replies
+                except (socket.error, ValueError) as e:
+                    # The server may have dropped an idle connection; retry
+                    # once on a fresh one.
+                    logging.debug("Whois connection to {} failed. {}"
+                                  .format(self.host, e))
+                    self._disconnect()
+            raise errors.SendRequestError(
+                "Failed to query {}:{}".format(self.host, self.port))
+
+    def query(self, query):
+        return self.query_many([query])[0]
+
+    def close(self):
+        with self._lock:
+            self._disconnect()
+
+    def get_policy_by_autnum(self, autnum):
+        try:
+            reply = self.query("!maut-num,{}".format(autnum))
+        except errors.SendRequestError as e:
+            logging.error('Get policy failed. {}'.format(e))
+            return None
+        if not reply:
+            logging.error("Failed to receive policy for {}.".format(autnum))
+            return None
+        # The policy parser consumes the XML format of the RIPE REST API.
+        return mirror.build_search_reply(
+            list(parsers.iter_rpsl_objects(reply.splitlines())))
+
+    def get_filter_set(self, value):
+        """Makes requests for as-set, route-set."""
+        if self.expand_sets:
+            query = "!i{},1".format(value)
+        else:
+            query = "!i{}".format(value)
+        try:
+            return self.query(query)
+        except errors.SendRequestError as e:
+            logging.error('Get Filter failed for {}. {}'.format(value, e))
+            return None
+
+    def _route_queries(self, autnum, ipv6_enabled):
+        queries = ["!g{}".format(autnum)]
+        if ipv6_enabled:
+            queries.append("!6{}".format(autnum))
+        return queries
+
+    @staticmethod
+    def _join_routes(replies):
+        if all(r is None for r in replies):
+            return None
+        return ' '.join(r for r in replies if r)
+
+    def prefetch_routes(self, autnums, ipv6_enabled=False):
+        """Requests the prefixes of all the given ASes in a single pipelined
+        batch. The following get_routes_by_autnum() calls for them are served
+        from the prefetched replies.
+        """
+        autnums = list(autnums)
+        queries = []
+        for autnum in autnums:
+            queries.extend(self._route_queries(autnum, ipv6_enabled))
+        try:
+            replies = self.query_many(queries)
+        except errors.SendRequestError as e:
+            logging.warning('Prefetching routes failed. {}'.format(e))
+            return
+        step = len(queries) / max(len(autnums), 1)
+        with self._prefetched_lock:
+            for i, autnum in enumerate(autnums):
+                self._prefetched[(autnum, ipv6_enabled)] = self._join_routes(
+                    replies[i * step:(i + 1) * step])
+
+    def get_routes_by_autnum(self, autnum, ipv6_enabled=False):
+        """Requests all the route[6] prefixes for a given AS number."""
+        with self._prefetched_lock:
+            if (autnum, ipv6_enabled) in self._prefetched:
+                return self._prefetched.pop((autnum, ipv6_enabled))
+        try:
+            replies = self.query_many(self._route_queries(autnum, ipv6_enabled))
+        except errors.SendRequestError as e:
+            logging.error('Get all routes failed for {}. {}'.format(autnum, e))
+            return None
+        return self._join_routes(replies)
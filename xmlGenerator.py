@@ -3,6 +3,7 @@ import datetime
 from collections import deque
 
 import aggregator
+import asregistry
 
 
 class XmlGenerator:
@@ -171,28 +172,15 @@ class XmlGenerator:
 
     def _AS_set_to_XML(self, AS_set_object, AS_object_dir, AS_set_object_dir,
                        pl_root, aggregate):
-        """Traverses the tree created by the AS sets. Ignores duplicate ASes
-        and avoids loops.
+        """Converts the ASes of the AS set and its nested AS sets (see
+        AsSetObjectDir.ASN_closure), each one once.
         """
-        AS_set_tree = deque([AS_set_object.get_key()])
-        traversed_AS_sets = set()
-        traversed_ASes = set()
-
-        while AS_set_tree:
-            current_set_name = AS_set_tree.popleft()
-            current_set = AS_set_object_dir.data[current_set_name]
-            for child_AS in current_set.ASN_members:
-                if child_AS not in traversed_ASes:
-                    traversed_ASes.add(child_AS)
-                    try:
-                        self._AS_to_XML(AS_object_dir.data[child_AS], pl_root, aggregate)
-                    except KeyError:
-                        pass
-
-            for child_set in current_set.AS_set_members:
-                if child_set not in traversed_AS_sets:
-                    traversed_AS_sets.add(child_set)
-                    AS_set_tree.append(child_set)
+        ASNs = AS_set_object_dir.ASN_closure(AS_set_object.get_key())
+        for child_AS in asregistry.registry.ASNs(ASNs):
+            try:
+                self._AS_to_XML(AS_object_dir.data[child_AS], pl_root, aggregate)
+            except KeyError:
+                pass
 
     def _peering_point_to_XML(self, points_root, peering_point):
         if peering_point.get_key() is not "|":
@@ -4,6 +4,7 @@ from collections import deque
 import yaml
 
 import aggregator
+import asregistry
 
 
 class YamlGenerator:
@@ -40,31 +41,18 @@ class YamlGenerator:
         return {self.name_prefix + AS_object.origin: {'ipv4': routes4, 'ipv6': routes6}}
 
     def _convert_ASset_to_dict(self, AS_set_object, AS_object_dir, AS_set_object_dir, aggregate):
-        """Traverses the tree created by the AS sets. Ignores duplicate ASes
-        and avoids loops.
+        """Collects the routes of the ASes of the AS set and its nested AS
+        sets (see AsSetObjectDir.ASN_closure), each AS once.
         """
-        AS_set_tree = deque([AS_set_object.get_key()])
-        traversed_AS_sets = set()
-        traversed_ASes = set()
-
         routes4 = []
         routes6 = []
 
-        while AS_set_tree:
-            current_set_name = AS_set_tree.popleft()
-            current_set = AS_set_object_dir.data[current_set_name]
-            for child_AS in current_set.ASN_members:
-                if child_AS not in traversed_ASes:
-                    traversed_ASes.add(child_AS)
-                    try:
-                        self._get_all_AS_routes(AS_object_dir.data[child_AS], routes4, routes6)
-                    except KeyError:
-                        pass
-
-            for child_set in current_set.AS_set_members:
-                if child_set not in traversed_AS_sets:
-                    traversed_AS_sets.add(child_set)
-                    AS_set_tree.append(child_set)
+        ASNs = AS_set_object_dir.ASN_closure(AS_set_object.get_key())
+        for child_AS in asregistry.registry.ASNs(ASNs):
+            try:
+                self._get_all_AS_routes(AS_object_dir.data[child_AS], routes4, routes6)
+            except KeyError:
+                pass
 
         if aggregate:
             routes4 = aggregator.aggregate_prefix_list(routes4)